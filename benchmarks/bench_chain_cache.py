@@ -0,0 +1,101 @@
+# benchmarks/bench_chain_cache.py
+"""
+質問ごとのチェーン組み立てコストを、キャッシュ導入前後で比較するマイクロベンチマーク。
+LLMと埋め込みモデルはダミーに差し替え、セットアップ処理のオーバーヘッドだけを計測します。
+
+    python benchmarks/bench_chain_cache.py [--iterations 2000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListLLM
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from core.pal_logic import PalLogic
+from core.utils import resource_path
+
+CONFIG = {"user_name": "User", "ai_name": "Pal"}
+HISTORY = [
+    {"role": "user", "content": "Hello!"},
+    {"role": "assistant", "content": "Hi there, how can I help?"},
+]
+
+
+def make_logic():
+    """重いモデルを読み込まずに、ダミー部品でPalLogicを組み立てる"""
+    logic = PalLogic.__new__(PalLogic)
+    logic.db = InMemoryVectorStore(DeterministicFakeEmbedding(size=384))
+    logic.db.add_texts([f"Document chunk number {i}." for i in range(50)])
+    logic.llm = FakeListLLM(responses=["ok"])
+    # ダミーのLLMにはトークナイザがないため、空白区切りの単語数で代用する
+    logic._count_tokens = lambda text: len(text.split())
+    logic._truncate_tokens = lambda text, max_tokens: " ".join(text.split()[:max_tokens])
+    logic.n_ctx = 4096
+    logic.prompt_config_path = resource_path("prompt_config.json")
+    logic.prompt_config_mtime = logic._get_prompt_config_mtime()
+    logic.prompt_config = logic._load_prompt_config()
+    logic._chain_cache = {}
+    logic._chain_cache_names = None
+    logic._chain_cache_lock = threading.Lock()
+    return logic
+
+
+def build_chain_uncached(logic, query, history, config):
+    """キャッシュ導入前と同じく、質問のたびにリトリーバーとテンプレートを作り直す"""
+    retriever = logic.db.as_retriever(search_kwargs={"k": 3})
+    system_prompt = logic.prompt_config["system_prompt"]
+    variant = "prompt_with_history" if history else "prompt_no_history"
+    prompt_template = logic.prompt_config[variant].format(
+        system_prompt=system_prompt, user_name=config["user_name"], ai_name=config["ai_name"]
+    )
+    prompt = PromptTemplate.from_template(prompt_template)
+    inputs = {"context": retriever, "question": RunnablePassthrough()}
+    if history:
+        history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+        inputs["history"] = lambda x: history_str
+    return inputs | prompt | logic.llm | StrOutputParser()
+
+
+def measure(label, func, iterations):
+    # PalLogic内のprint出力は計測対象外にする
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(iterations):
+            func(i)
+        elapsed = time.perf_counter() - start
+    per_query_us = elapsed / iterations * 1e6
+    print(f"{label:<28} {per_query_us:10.1f} us/query")
+    return per_query_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    logic = make_logic()
+    history_for = lambda i: HISTORY if i % 2 else []
+
+    print(f"Per-query chain setup overhead ({args.iterations} iterations)")
+    before = measure("before (rebuild per query)",
+                     lambda i: build_chain_uncached(logic, "What is Pal?", history_for(i), CONFIG),
+                     args.iterations)
+    after = measure("after (compiled cache)",
+                    lambda i: logic._build_chain("What is Pal?", history_for(i), CONFIG),
+                    args.iterations)
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/bench_chunking.py
+"""
+チャンク分割の方式を比較するベンチマーク。
+文字数での分割 (以前の500文字/50文字) とトークン数での分割 (MiniLMの256トークン) について、
+学習のスループット (分割と埋め込みの時間) と、チャンクのトークン数の分布
+(256トークンを超えた分は埋め込みモデルに切り捨てられる) を計測します。
+質問ファイルを渡すと、上位k件のチャンクに答えが含まれる割合 (ヒット率) も計測します。
+
+    python benchmarks/bench_chunking.py docs/ [--questions questions.json] [--k 3]
+
+質問ファイルは [{"question": "...", "answer": "チャンクに含まれるべき文字列"}, ...] の形式です。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core.ingest import (collect_files, load_and_split, CHARACTER_FALLBACK, DEFAULT_CHUNKING,
+                         TOKENIZER_NAME, _get_tokenizer)
+
+STRATEGIES = {
+    "characters 500/50": lambda path: CHARACTER_FALLBACK,
+    "tokens 256/32": lambda path: DEFAULT_CHUNKING.get(os.path.splitext(path)[1].lower(), CHARACTER_FALLBACK),
+}
+
+
+def split_all(files, settings_for):
+    texts = []
+    # 読み込みエラーなどのprint出力は計測対象外にする
+    with contextlib.redirect_stdout(io.StringIO()):
+        for path in files:
+            texts.extend(text for text, _ in load_and_split(path, settings_for(path)) or [])
+    return texts
+
+
+def token_stats(texts, tokenizer) -> str:
+    lengths = np.array([len(tokenizer.encode(text, verbose=False)) for text in texts])
+    over = (lengths > 256).mean() * 100
+    return (f"tokens/chunk mean {lengths.mean():.0f}, p95 {np.percentile(lengths, 95):.0f}, "
+            f"max {lengths.max()}, over 256: {over:.1f}%")
+
+
+def hit_rate(questions, texts, vectors, embeddings, k: int) -> float:
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    hits = 0
+    for item in questions:
+        query = np.asarray(embeddings.embed_query(item["question"]), dtype=np.float32)
+        top = np.argsort(-(vectors @ query))[:k]
+        if any(item["answer"].lower() in texts[i].lower() for i in top):
+            hits += 1
+    return hits / len(questions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="学習させるファイルまたはフォルダ (.pdf / .txt)")
+    parser.add_argument("--questions", help="ヒット率を計測する質問ファイル (JSON)")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embeddings = HuggingFaceEmbeddings(model_name=TOKENIZER_NAME)
+    tokenizer = _get_tokenizer()
+    questions = None
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+
+    files = collect_files(args.paths)
+    print(f"{len(files)} files")
+    for label, settings_for in STRATEGIES.items():
+        start = time.perf_counter()
+        texts = split_all(files, settings_for)
+        split_seconds = time.perf_counter() - start
+        if not texts:
+            print(f"{label}: no chunks")
+            continue
+
+        start = time.perf_counter()
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        embed_seconds = time.perf_counter() - start
+
+        total = split_seconds + embed_seconds
+        print(f"\n{label}")
+        print(f"  {len(texts)} chunks: split {split_seconds:.2f}s, embed {embed_seconds:.2f}s "
+              f"({len(texts) / total:.1f} chunks/s, {len(files) / total:.2f} files/s)")
+        if tokenizer is not None:
+            print(f"  {token_stats(texts, tokenizer)}")
+        if questions:
+            print(f"  hit rate@{args.k}: {hit_rate(questions, texts, vectors, embeddings, args.k) * 100:.1f}% "
+                  f"({len(questions)} questions)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# benchmarks/bench_import_time.py
+"""
+`python -X importtime` を使って、main.py の起動時 (スプラッシュ表示まで) の
+import時間を計測するスクリプト。予算を超えた場合や、重いモジュールが
+起動時に読み込まれている場合は終了コード1を返します。
+
+    python benchmarks/bench_import_time.py [--budget-ms 800] [--module main]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# スプラッシュ表示前に読み込まれてはいけないモジュール (初回使用時にimportする)
+DEFERRED_MODULES = [
+    "langchain", "langchain_core", "langchain_community", "langchain_huggingface",
+    "langchain_chroma", "chromadb", "torch", "transformers", "sentence_transformers",
+    "llama_cpp", "pygame", "pyglet", "wordcloud", "numpy",
+]
+
+LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(module: str):
+    """サブプロセスで指定モジュールをimportし、(モジュール名, 累積us, 階層) のリストを返す"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit(f"Failed to import '{module}'.")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match:
+            cumulative_us = int(match.group(2))
+            depth = (len(match.group(3)) - 1) // 2
+            entries.append((match.group(4), cumulative_us, depth))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="import to measure (default: main)")
+    parser.add_argument("--budget-ms", type=float, default=800.0, help="allowed total import time")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    args = parser.parse_args()
+
+    entries = measure_imports(args.module)
+    top_level = [(name, us) for name, us, depth in entries if depth == 0]
+    total_ms = sum(us for _, us in top_level) / 1000
+
+    print(f"Import time of '{args.module}': {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print("Slowest top-level imports:")
+    for name, us in sorted(top_level, key=lambda e: e[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    loaded = {name.split(".")[0] for name, _, _ in entries}
+    eager = [name for name in DEFERRED_MODULES if name in loaded]
+
+    ok = True
+    if eager:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(eager)}")
+        ok = False
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import time exceeds budget by {total_ms - args.budget_ms:.1f} ms")
+        ok = False
+    if ok:
+        print("OK")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_rerank.py
+"""
+リランク (クロスエンコーダ) の有無で、質問から回答までの時間を比較するベンチマーク。
+学習済みのDB (./pal_db) と実際のモデルを使い、回答キャッシュは無効にして計測します。
+
+    python benchmarks/bench_rerank.py [--questions questions.txt] [--repeat 2]
+
+質問ファイルは1行に1つの質問を書いたテキストです。
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core.pal_logic import PalLogic
+from core.reranker import DEFAULT_RERANK_MODEL
+
+DEFAULT_QUESTIONS = [
+    "What is this document about?",
+    "Summarize the main points.",
+    "What are the key terms defined in the documents?",
+]
+BASE_CONFIG = {"user_name": "User", "ai_name": "Pal", "answer_cache": False}
+
+
+def run(logic, questions, config, repeat: int):
+    """各質問の回答時間と、検索のうちリランクにかかった時間を返す"""
+    answer_seconds = []
+    rerank_ms = []
+    for _ in range(repeat):
+        for question in questions:
+            # 2回目以降も採点し直すよう、リランクのスコアキャッシュを空にする
+            if logic._reranker is not None:
+                logic._reranker._cache.clear()
+            # PalLogic内のprint出力は計測対象外にする
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                logic.ask_question(question, [], config)
+                answer_seconds.append(time.perf_counter() - start)
+            rerank_ms.append((logic.last_retrieval or {}).get("stages", {}).get("rerank", 0.0))
+    return answer_seconds, rerank_ms
+
+
+def report(label, answer_seconds, rerank_ms):
+    answer_ms = sorted(seconds * 1000 for seconds in answer_seconds)
+    p95 = answer_ms[min(len(answer_ms) - 1, int(len(answer_ms) * 0.95))]
+    print(f"{label:<12} answer median {statistics.median(answer_ms):8.1f} ms, p95 {p95:8.1f} ms, "
+          f"rerank median {statistics.median(rerank_ms):6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="質問ファイル (1行に1つ)")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    logic = PalLogic()
+    # モデルの読み込みと最初の生成を計測から外す
+    with contextlib.redirect_stdout(io.StringIO()):
+        logic.ask_question(questions[0], [], BASE_CONFIG)
+        # クロスエンコーダの読み込みが終わるまで待つ
+        reranker = logic._get_reranker(DEFAULT_RERANK_MODEL)
+        reranker.is_ready()
+        reranker._model_future.result()
+
+    print(f"{len(questions)} questions x {args.repeat}")
+    report("rerank off", *run(logic, questions, dict(BASE_CONFIG, rerank=False), args.repeat))
+    report("rerank on", *run(logic, questions, dict(BASE_CONFIG, rerank=True), args.repeat))
+
+
+if __name__ == "__main__":
+    main()
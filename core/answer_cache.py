@@ -0,0 +1,104 @@
+# core/answer_cache.py
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+
+class AnswerCache:
+    """
+    質問文の埋め込みをキーにした回答キャッシュ。
+    コサイン類似度がしきい値以上の質問が、同じ知識ベースのバージョン・同じ設定 (settings_key) に対して
+    再度聞かれた場合は、LLMを使わずに保存済みの回答を返す。
+    """
+    def __init__(self, path: str, max_entries: int = 200):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.kb_version = 0 # 知識ベースが変わるたびに増える
+        self._entries = [] # {"question", "answer", "names", "settings", "embedding", "last_used"}
+        self._matrix = None # 正規化済み埋め込みの行列 (検索用)
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.kb_version = int(data.get("kb_version", 0))
+            self._entries = data.get("entries", [])[-self.max_entries:]
+            print(f"Answer cache loaded ({len(self._entries)} entries).")
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError, json.JSONDecodeError) as e:
+            print(f"Warning: Answer cache could not be loaded ({e}). Starting empty.")
+            self._entries = []
+        self._rebuild_matrix()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"kb_version": self.kb_version, "entries": self._entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save answer cache ({e}).")
+
+    def _rebuild_matrix(self):
+        if not self._entries:
+            self._matrix = None
+            return
+        matrix = np.asarray([entry["embedding"] for entry in self._entries], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.maximum(norms, 1e-12)
+
+    def lookup(self, embedding, names, threshold: float, settings_key: str = ""):
+        """最も似ている質問の類似度がしきい値以上なら、その回答を返す。なければNone。"""
+        with self._lock:
+            if self._matrix is None:
+                self.misses += 1
+                return None
+            query = np.asarray(embedding, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            scores = self._matrix @ query
+            # 名前やプロンプト・検索の設定が違うときに作られた回答は使わない
+            for index in np.argsort(-scores):
+                if scores[index] < threshold:
+                    break
+                entry = self._entries[index]
+                if entry["names"] == list(names) and entry.get("settings", "") == settings_key:
+                    entry["last_used"] = time.time()
+                    self.hits += 1
+                    print(f"Answer cache hit (similarity {scores[index]:.3f}): '{entry['question']}'")
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, question: str, embedding, names, answer: str, settings_key: str = ""):
+        """回答を保存する。上限を超えたら最も長く使われていないものを削除する。"""
+        with self._lock:
+            self._entries.append({
+                "question": question,
+                "answer": answer,
+                "names": list(names),
+                "settings": settings_key,
+                "embedding": [float(x) for x in embedding],
+                "last_used": time.time(),
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries.sort(key=lambda entry: entry["last_used"])
+                del self._entries[:len(self._entries) - self.max_entries]
+            self._rebuild_matrix()
+            self._save()
+
+    def invalidate(self):
+        """知識ベースが変わったので、全ての回答を破棄してバージョンを進める"""
+        with self._lock:
+            self.kb_version += 1
+            self._entries = []
+            self._matrix = None
+            self._save()
+        print(f"Answer cache invalidated (knowledge base version {self.kb_version}).")
@@ -0,0 +1,229 @@
+# core/chat_log.py
+import os
+import json
+import threading
+
+CHAT_LOG_FILE = "chat_log.jsonl"
+LEGACY_CHAT_LOG_FILE = "chat_log.json"
+
+_READ_BLOCK_SIZE = 64 * 1024
+
+
+class ChatLog:
+    """
+    1行1メッセージのJSONL形式で会話ログを管理するクラス。
+    追記はファイル末尾への書き込みだけで済み、最近の履歴はファイル末尾から読み込む。
+    """
+    def __init__(self, path: str = CHAT_LOG_FILE, legacy_path: str = LEGACY_CHAT_LOG_FILE):
+        self.path = path
+        self.legacy_path = legacy_path
+        # 学習済みの位置 (ログ先頭からのバイト数) を保存するファイル
+        self.watermark_path = path + ".learned"
+        self._lock = threading.RLock()
+        self._migrate_legacy_log()
+
+    def _migrate_legacy_log(self):
+        """旧形式のchat_log.json (配列) があれば、一度だけJSONLに変換する"""
+        if os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not migrate '{self.legacy_path}' ({e}).")
+            return
+        self._write_all(entries)
+        # 元のファイルは念のため残しておく
+        os.replace(self.legacy_path, self.legacy_path + ".bak")
+        print(f"Migrated {len(entries)} messages from '{self.legacy_path}' to '{self.path}'.")
+
+    @staticmethod
+    def _encode(entry: dict) -> bytes:
+        return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _decode(line: bytes):
+        """1行をパースする。書き込み途中で壊れた行はNoneを返す。"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            return json.loads(line.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return None
+
+    def _write_all(self, entries: list):
+        """ログ全体を書き直す (移行時など、例外的な場合だけ使う)"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for entry in entries:
+                f.write(self._encode(entry))
+        os.replace(tmp_path, self.path)
+
+    def append(self, entries: list):
+        """メッセージをファイル末尾に追記する"""
+        data = b"".join(self._encode(entry) for entry in entries)
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(data)
+
+    def read_records_before(self, offset=None, count: int = 20):
+        """
+        位置offset (バイト数、Noneならファイル末尾) より前にある最新のcount件を、
+        (位置, バイト数, メッセージ) のリストで古い順に返す。
+        ファイル末尾から必要な分だけ読み、返した先頭メッセージの位置も合わせて返す。
+        返した位置を次のoffsetに渡すと、さらに古いメッセージを読める (0ならそれ以上はない)。
+        """
+        if count <= 0:
+            return [], offset or 0
+        with self._lock:
+            try:
+                f = open(self.path, "rb")
+            except FileNotFoundError:
+                return [], 0
+            with f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell() if offset is None else min(offset, f.tell())
+                position = end
+                data = b""
+                # 先頭の行は途中から読んでいる可能性があるため、count+1個の改行が見つかるまで読む
+                while position > 0 and data.count(b"\n") <= count:
+                    size = min(_READ_BLOCK_SIZE, position)
+                    position -= size
+                    f.seek(position)
+                    data = f.read(size) + data
+
+        lines = data.split(b"\n")
+        line_start = position
+        if position > 0:
+            line_start += len(lines[0]) + 1
+            lines = lines[1:]
+        records = []
+        for line in lines:
+            entry = self._decode(line)
+            if entry is not None:
+                records.append((line_start, len(line) + 1, entry))
+            line_start += len(line) + 1
+
+        records = records[-count:]
+        if not records:
+            return [], position
+        return records, records[0][0]
+
+    def read_before(self, offset=None, count: int = 20):
+        """read_records_before と同じ範囲のメッセージだけを返す"""
+        records, start = self.read_records_before(offset, count)
+        return [entry for _, _, entry in records], start
+
+    def tail(self, count: int) -> list:
+        """最新のcount件を古い順に返す"""
+        return self.read_before(None, count)[0]
+
+    def read_all(self) -> list:
+        """全メッセージを古い順に返す"""
+        with self._lock:
+            try:
+                with open(self.path, "rb") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return []
+        return [entry for entry in (self._decode(line) for line in lines) if entry is not None]
+
+    def _load_watermark(self):
+        """保存済みの学習済み位置を返す。なければNone。"""
+        try:
+            with open(self.watermark_path, "r", encoding="utf-8") as f:
+                return int(json.load(f)["offset"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not read '{self.watermark_path}' ({e}).")
+            return None
+
+    def _initial_watermark(self) -> int:
+        """
+        学習済み位置がまだ保存されていない場合、旧形式の learned フラグから求める。
+        先頭から続く学習済みメッセージの直後を学習済み位置とする。
+        """
+        offset = 0
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    entry = self._decode(line)
+                    if entry is not None and not entry.get("learned"):
+                        break
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        return offset
+
+    def size(self) -> int:
+        """ログファイルのバイト数"""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def read_since(self, offset: int = 0, max_count: int = None):
+        """
+        位置offsetから後ろのメッセージを (位置, バイト数, メッセージ) のリストで返す。
+        max_count件読んだらそこで止める。書き込み途中の最終行は含めない。
+        次に読み始める位置も合わせて返す。
+        """
+        records = []
+        position = offset
+        with self._lock:
+            try:
+                f = open(self.path, "rb")
+            except FileNotFoundError:
+                return [], offset
+            with f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    entry = self._decode(line)
+                    if entry is not None:
+                        records.append((position, len(line), entry))
+                    position += len(line)
+                    if max_count is not None and len(records) >= max_count:
+                        break
+        return records, position
+
+    def read_unlearned(self):
+        """
+        前回の学習以降に追記されたメッセージと、その末尾の位置を返す。
+        学習済み位置からファイル末尾までだけを読み、書き込み途中の最終行は含めない。
+        """
+        with self._lock:
+            offset = self._load_watermark()
+            if offset is None:
+                offset = self._initial_watermark()
+            if offset > self.size():
+                # ログが削除・置き換えられた場合は最初から学習し直す
+                offset = 0
+            records, end_offset = self.read_since(offset)
+        return [entry for _, _, entry in records], end_offset
+
+    def mark_learned(self, offset: int):
+        """read_unlearned で返された位置までを学習済みとして保存する"""
+        tmp_path = self.watermark_path + ".tmp"
+        with self._lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"offset": offset}, f)
+                os.replace(tmp_path, self.watermark_path)
+            except OSError as e:
+                print(f"Warning: Could not save '{self.watermark_path}' ({e}).")
+
+
+_shared_logs = {}
+_shared_logs_lock = threading.Lock()
+
+
+def get_chat_log(path: str = CHAT_LOG_FILE) -> ChatLog:
+    """UIとPalLogicで同じロックを共有するため、パスごとに1つのChatLogを返す"""
+    with _shared_logs_lock:
+        if path not in _shared_logs:
+            _shared_logs[path] = ChatLog(path)
+        return _shared_logs[path]
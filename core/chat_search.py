@@ -0,0 +1,189 @@
+# core/chat_search.py
+import sqlite3
+import threading
+
+import numpy as np
+
+CHAT_INDEX_FILE = "pal_chat_index.sqlite"
+
+_SYNC_BATCH = 1000
+_EMBED_BATCH = 256
+_SNIPPET_LENGTH = 80
+
+
+class ChatSearchIndex:
+    """
+    会話ログの全文検索用インデックス (SQLite FTS5)。
+    ログのどの位置 (バイト数) まで索引したかを保存し、検索のたびに追記された分だけを追加する。
+    埋め込みモデルを渡すと、意味の近いメッセージを探すセマンティック検索もできる。
+    """
+    def __init__(self, chat_log, path: str = CHAT_INDEX_FILE):
+        self.chat_log = chat_log
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._vector_ids = None # セマンティック検索用のメッセージID (メモリ上のキャッシュ)
+        self._vector_matrix = None # 正規化済み埋め込みの行列
+        self._create_tables()
+
+    def _create_tables(self):
+        conn = self._conn
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        try:
+            # trigramトークナイザは空白で区切らない日本語も部分一致で検索できる
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+                         "content, role UNINDEXED, timestamp UNINDEXED, offset UNINDEXED, length UNINDEXED, "
+                         "tokenize='trigram')")
+        except sqlite3.OperationalError as e:
+            print(f"Warning: SQLite FTS5 is not available ({e}). Falling back to LIKE search.")
+            conn.execute("CREATE TABLE IF NOT EXISTS messages ("
+                         "content TEXT, role TEXT, timestamp TEXT, offset INTEGER, length INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS vectors (id INTEGER PRIMARY KEY, vector BLOB)")
+        conn.commit()
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'messages'").fetchone()[0]
+        self.fts_enabled = "fts5" in sql.lower()
+
+    def _get_meta(self, key: str, default=0):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _clear(self):
+        self._conn.execute("DELETE FROM messages")
+        self._conn.execute("DELETE FROM vectors")
+        self._set_meta("indexed_offset", 0)
+        self._conn.commit()
+        self._vector_ids = None
+        self._vector_matrix = None
+
+    def sync(self) -> int:
+        """前回から追記されたメッセージを索引に追加し、追加した件数を返す"""
+        with self._lock:
+            offset = self._get_meta("indexed_offset")
+            if offset > self.chat_log.size():
+                # ログが削除・置き換えられたので作り直す
+                print("Chat log was replaced. Rebuilding the search index...")
+                self._clear()
+                offset = 0
+
+            added = 0
+            while True:
+                records, next_offset = self.chat_log.read_since(offset, max_count=_SYNC_BATCH)
+                if next_offset == offset:
+                    break
+                self._conn.executemany(
+                    "INSERT INTO messages (content, role, timestamp, offset, length) VALUES (?, ?, ?, ?, ?)",
+                    [(entry.get("content", ""), entry.get("role", "unknown"), entry.get("timestamp"), position, length)
+                     for position, length, entry in records]
+                )
+                offset = next_offset
+                self._set_meta("indexed_offset", offset)
+                self._conn.commit()
+                added += len(records)
+            if added:
+                print(f"Indexed {added} new messages for search.")
+            return added
+
+    @staticmethod
+    def _make_snippet(content: str, query: str) -> str:
+        """一致した位置の前後だけを切り出す"""
+        index = content.lower().find(query.lower())
+        start = max(0, index - _SNIPPET_LENGTH // 4)
+        snippet = content[start:start + _SNIPPET_LENGTH]
+        if start > 0:
+            snippet = "…" + snippet
+        if start + _SNIPPET_LENGTH < len(content):
+            snippet += "…"
+        return snippet
+
+    @staticmethod
+    def _to_result(row, snippet: str, score=None) -> dict:
+        rowid, role, timestamp, offset, length = row
+        return {"id": rowid, "role": role, "timestamp": timestamp, "offset": offset, "length": length,
+                "snippet": snippet.replace("\n", " "), "score": score}
+
+    def search(self, query: str, limit: int = 50) -> list:
+        """キーワード (部分一致) で検索し、新しい順に返す"""
+        query = query.strip()
+        if not query:
+            return []
+        self.sync()
+        with self._lock:
+            # trigramは3文字未満の語を索引に使えないため、短い語はLIKEで探す
+            if self.fts_enabled and len(query) >= 3:
+                phrase = '"' + query.replace('"', '""') + '"'
+                rows = self._conn.execute(
+                    "SELECT rowid, role, timestamp, offset, length, snippet(messages, 0, '', '', '…', 24) "
+                    "FROM messages WHERE messages MATCH ? ORDER BY rowid DESC LIMIT ?", (phrase, limit)
+                ).fetchall()
+                return [self._to_result(row[:5], row[5]) for row in rows]
+
+            pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = self._conn.execute(
+                "SELECT rowid, role, timestamp, offset, length, content FROM messages "
+                "WHERE content LIKE ? ESCAPE '\\' ORDER BY rowid DESC LIMIT ?", (pattern, limit)
+            ).fetchall()
+            return [self._to_result(row[:5], self._make_snippet(row[5], query)) for row in rows]
+
+    def _load_vectors(self):
+        rows = self._conn.execute("SELECT id, vector FROM vectors ORDER BY id").fetchall()
+        self._vector_ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+        self._vector_matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else None
+
+    def _embed_new_messages(self, embeddings):
+        """まだ埋め込みを計算していないメッセージだけを埋め込み、保存する"""
+        if self._vector_ids is None:
+            self._load_vectors()
+        last_id = int(self._vector_ids[-1]) if len(self._vector_ids) else 0
+        rows = self._conn.execute("SELECT rowid, content FROM messages WHERE rowid > ? ORDER BY rowid", (last_id,)).fetchall()
+        if not rows:
+            return
+
+        print(f"Embedding {len(rows)} messages for semantic search...")
+        new_ids, new_vectors = [], []
+        for start in range(0, len(rows), _EMBED_BATCH):
+            batch = rows[start:start + _EMBED_BATCH]
+            vectors = np.asarray(embeddings.embed_documents([content for _, content in batch]), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            self._conn.executemany("INSERT OR REPLACE INTO vectors (id, vector) VALUES (?, ?)",
+                                   [(rowid, vector.tobytes()) for (rowid, _), vector in zip(batch, vectors)])
+            self._conn.commit()
+            new_ids.extend(rowid for rowid, _ in batch)
+            new_vectors.append(vectors)
+
+        self._vector_ids = np.concatenate([self._vector_ids, np.asarray(new_ids, dtype=np.int64)])
+        matrices = ([self._vector_matrix] if self._vector_matrix is not None else []) + new_vectors
+        self._vector_matrix = np.vstack(matrices)
+
+    def semantic_search(self, query: str, embeddings, limit: int = 20) -> list:
+        """
+        質問文と意味の近いメッセージを、類似度の高い順に返す。
+        初回は全メッセージの埋め込みを計算するため時間がかかるが、以降は追記分だけを計算する。
+        """
+        query = query.strip()
+        if not query:
+            return []
+        self.sync()
+        with self._lock:
+            self._embed_new_messages(embeddings)
+            if self._vector_matrix is None:
+                return []
+            query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+            query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+            scores = self._vector_matrix @ query_vector
+            limit = min(limit, len(scores))
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for index in top:
+                row = self._conn.execute(
+                    "SELECT rowid, role, timestamp, offset, length, content FROM messages WHERE rowid = ?",
+                    (int(self._vector_ids[index]),)
+                ).fetchone()
+                if row:
+                    snippet = row[5][:_SNIPPET_LENGTH] + ("…" if len(row[5]) > _SNIPPET_LENGTH else "")
+                    results.append(self._to_result(row[:5], snippet, float(scores[index])))
+            return results
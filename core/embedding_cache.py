@@ -0,0 +1,192 @@
+# core/embedding_cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+INDEX_SAVE_INTERVAL = 30.0 # 学習中に索引を保存する間隔 (秒)。学習の終わりには flush() で必ず保存する
+KEY_BYTES = 20 # SHA-1のバイト数
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    埋め込みモデルをラップし、同じテキストの埋め込みを再計算しないようにするクラス。
+    ドキュメントの埋め込みは float32 のメモリマップファイル + ハッシュ索引としてディスクに保存し、
+    上限を超えたら最も使われていないもの (LRU) から上書きする。
+    各行にはそのテキストのハッシュも書いておき、読み出すときに照合する
+    (索引の保存前に終了して、索引が上書き済みの行を指したままでも、別のテキストの埋め込みを返さないように)。
+    質問文の埋め込みはメモリ上のLRUにだけ保持する。
+    """
+    def __init__(self, base: Embeddings, cache_dir: str, max_entries: int = 20000, max_query_entries: int = 256):
+        self.base = base
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_query_entries = max_query_entries
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self.keys_path = os.path.join(cache_dir, "keys.bin")
+
+        self._lock = threading.Lock()
+        self._index = OrderedDict() # テキストのハッシュ -> 行番号 (古い順)
+        self._free_slots = []
+        self._vectors = None # np.memmap (max_entries, dim)
+        self._keys = None # np.memmap (max_entries, KEY_BYTES): 各行のテキストのハッシュ
+        self._dim = None
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._query_cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+
+        self._load_index()
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        """保存済みの索引とベクトルファイルを開く。壊れている場合は空から始める。"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if (data.get("max_entries") != self.max_entries or not os.path.exists(self.vectors_path)
+                    or not os.path.exists(self.keys_path)):
+                raise ValueError("cache layout changed")
+            self._dim = int(data["dim"])
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                      shape=(self.max_entries, self._dim))
+            self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode="r+", shape=(self.max_entries, KEY_BYTES))
+            self._index = OrderedDict((key, slot) for key, slot in data["entries"])
+            used = set(self._index.values())
+            self._free_slots = [slot for slot in range(self.max_entries - 1, -1, -1) if slot not in used]
+            print(f"Embedding cache loaded ({len(self._index)} entries).")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError, json.JSONDecodeError, OSError) as e:
+            print(f"Warning: Embedding cache could not be loaded ({e}). Starting empty.")
+            self._index = OrderedDict()
+            self._vectors = None
+            self._keys = None
+            self._dim = None
+
+    def _ensure_vectors(self, dim: int):
+        """最初の埋め込みの次元数に合わせてベクトルファイルを作成する"""
+        if self._vectors is not None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._dim = dim
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="w+", shape=(self.max_entries, dim))
+        self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode="w+", shape=(self.max_entries, KEY_BYTES))
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        try:
+            self._vectors.flush()
+            self._keys.flush()
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": self._dim, "max_entries": self.max_entries,
+                           "entries": list(self._index.items())}, f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        except OSError as e:
+            print(f"Warning: Could not save embedding cache index ({e}).")
+
+    def flush(self):
+        """変更があれば索引を保存する (学習が終わったときにまとめて呼ぶ)"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def _read(self, key: str, slot: int):
+        """行のハッシュがキーと一致すればベクトルを返す。一致しなければ索引から外してNoneを返す。"""
+        if bytes(self._keys[slot]) != bytes.fromhex(key):
+            del self._index[key]
+            self._free_slots.append(slot)
+            return None
+        self._index.move_to_end(key)
+        return self._vectors[slot].tolist()
+
+    def _store(self, key: str, vector):
+        """ベクトルを空き行 (なければLRUで最も古い行) に書き込む"""
+        if key in self._index:
+            return
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            _, slot = self._index.popitem(last=False)
+        # 先にハッシュを書き換え、古い索引からこの行を読んでも一致しないようにする
+        self._keys[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+        self._vectors[slot] = vector
+        self._index[key] = slot
+        self._dirty = True
+
+    def embed_documents(self, texts):
+        keys = [self._hash(text) for text in texts]
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                slot = self._index.get(key)
+                if slot is not None:
+                    results[i] = self._read(key, slot)
+                if results[i] is not None:
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+                    self.misses += 1
+
+        if missing:
+            # キャッシュにないテキストだけをまとめてモデルに渡す
+            missing_keys = list(missing)
+            vectors = self.base.embed_documents([texts[missing[key][0]] for key in missing_keys])
+            with self._lock:
+                self._ensure_vectors(len(vectors[0]))
+                for key, vector in zip(missing_keys, vectors):
+                    # キャッシュの有無で結果が変わらないよう、float32に丸めた値を返す
+                    vector = np.asarray(vector, dtype=np.float32)
+                    self._store(key, vector)
+                    for i in missing[key]:
+                        results[i] = vector.tolist()
+                # 索引全体を書き直すため、バッチごとではなく一定間隔で保存する
+                if time.monotonic() - self._last_save >= INDEX_SAVE_INTERVAL:
+                    self._save_index()
+        return results
+
+    def embed_query(self, text):
+        key = self._hash(text)
+        with self._lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                self.query_hits += 1
+                return list(vector)
+            self.query_misses += 1
+
+        vector = self.base.embed_query(text)
+        with self._lock:
+            self._query_cache[key] = vector
+            if len(self._query_cache) > self.max_query_entries:
+                self._query_cache.popitem(last=False)
+        return list(vector)
+
+    def stats(self) -> dict:
+        """ステータス画面に表示するヒット/ミスの件数"""
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses,
+            }
@@ -0,0 +1,47 @@
+# core/generation_stats.py
+import os
+import json
+import threading
+
+CUTOFF_REASONS = ("stopped", "max_tokens", "max_seconds")
+
+
+class GenerationStats:
+    """
+    回答の生成回数と、途中で打ち切った回数 (停止・トークン数の上限・時間の上限) を数え、小さなJSONに保存するクラス。
+    上限の設定が短すぎないかをステータス画面で確かめられるようにする。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._counts = {"answers": 0, **{reason: 0 for reason in CUTOFF_REASONS}}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key in self._counts:
+                self._counts[key] = int(data.get(key, 0))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, AttributeError, json.JSONDecodeError) as e:
+            print(f"Warning: Generation stats could not be loaded ({e}). They will be reset.")
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._counts, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save generation stats ({e}).")
+
+    def record(self, cutoff: str = None):
+        """1回の生成を記録する。cutoffは打ち切った理由 (最後まで生成した場合はNone)"""
+        with self._lock:
+            self._counts["answers"] += 1
+            if cutoff:
+                self._counts[cutoff] += 1
+            self._save()
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
@@ -0,0 +1,186 @@
+# core/ingest.py
+"""
+ドキュメント読み込み・チャンク分割の処理。
+プロセスプールの子プロセスからも呼ばれるため、このモジュールのトップレベルでは
+重いライブラリをimportしないこと。
+"""
+import os
+import re
+import json
+import hashlib
+from functools import lru_cache
+
+from .utils import config_values
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")
+
+# ファイルの種類ごとの分割設定 (config.jsonの "chunking" で上書きできる)
+# splitter: "tokens" は埋め込みモデルのトークン数、"characters" は文字数で chunk_size / chunk_overlap を数える
+DEFAULT_CHUNKING = {
+    ".pdf": {"splitter": "tokens", "chunk_size": 256, "chunk_overlap": 32},
+    ".txt": {"splitter": "tokens", "chunk_size": 256, "chunk_overlap": 32},
+}
+# トークナイザが使えない場合の文字数での分割
+CHARACTER_FALLBACK = {"splitter": "characters", "chunk_size": 500, "chunk_overlap": 50}
+
+# 埋め込みモデル (all-MiniLM-L6-v2) は256トークンより後ろを切り捨てるため、チャンクをその長さに揃える
+TOKENIZER_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# 段落、文、読点、単語の順に区切る (日本語の句読点も含む)
+_SEPARATORS = ["\n\n", "\n", "。", "．", "！", "？", ". ", "! ", "? ", "、", "，", ", ", " ", ""]
+
+# 見出しとみなす行: Markdownの見出し、"1.2 概要" のような番号付きの節、"第3章"、"Chapter 3"
+_HEADING_PATTERN = re.compile(
+    r"^(#{1,6}\s+\S.*"
+    r"|\d+(\.\d+)+\.?\s+\S.*"
+    r"|第\s*[0-9０-９一二三四五六七八九十百]+\s*[章節部].*"
+    r"|(Chapter|Section|Part)\s+[0-9IVXivx]+\b.*)$"
+)
+MAX_HEADING_CHARS = 80
+
+
+def file_sha256(file_path: str) -> str:
+    """ファイル内容のハッシュを返す (変更されていないファイルの再学習を避けるため)"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(text: str) -> str:
+    """チャンク本文のハッシュを返す"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def collect_files(paths) -> list:
+    """ドロップされたパスを展開し、学習対象のファイル一覧を返す (フォルダは再帰的に探索)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                        files.append(os.path.abspath(os.path.join(dirpath, filename)))
+        elif path.lower().endswith(SUPPORTED_EXTENSIONS):
+            files.append(os.path.abspath(path))
+    # 同じファイルが重複して指定された場合は1回だけ処理する
+    return list(dict.fromkeys(files))
+
+
+def chunking_settings(config: dict) -> dict:
+    """ファイルの種類ごとの分割設定を、config.jsonの値で上書きして返す"""
+    overrides = (config or {}).get("chunking", {})
+    return {ext: config_values(overrides.get(ext, {}), defaults) for ext, defaults in DEFAULT_CHUNKING.items()}
+
+
+def settings_for(file_path: str, chunking: dict) -> dict:
+    return chunking.get(os.path.splitext(file_path)[1].lower(), CHARACTER_FALLBACK)
+
+
+def chunking_signature(settings: dict) -> str:
+    """分割設定の短いハッシュ (設定が変わったファイルを学習し直すため、file_hashに含める)"""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+
+
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    """埋め込みモデルのトークナイザを読み込む (プロセスごとに1回)。使えなければNone。"""
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    except Exception as e:
+        print(f"Warning: Could not load tokenizer '{TOKENIZER_NAME}' ({e}). Splitting by characters.")
+        return None
+
+
+def make_splitter(settings: dict):
+    """分割設定からテキストスプリッターを作る"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    if settings["splitter"] == "tokens":
+        tokenizer = _get_tokenizer()
+        if tokenizer is not None:
+            # chunk_size は [CLS] / [SEP] を含めたモデルの入力長として数える
+            return RecursiveCharacterTextSplitter(
+                chunk_size=settings["chunk_size"] - tokenizer.num_special_tokens_to_add(),
+                chunk_overlap=settings["chunk_overlap"],
+                length_function=lambda text: len(tokenizer.encode(text, add_special_tokens=False, verbose=False)),
+                separators=_SEPARATORS, keep_separator="end",
+            )
+        settings = CHARACTER_FALLBACK
+    return RecursiveCharacterTextSplitter(
+        chunk_size=settings["chunk_size"], chunk_overlap=settings["chunk_overlap"],
+        separators=_SEPARATORS, keep_separator="end",
+    )
+
+
+def split_sections(text: str, heading: str = None) -> list:
+    """
+    見出しの行でテキストを区切り、(見出し, 本文) のリストを返す。
+    headingは前のページから続いている見出し (最初の区切りまでの本文に付ける)。
+    見出しの行は本文に含めない (見出しだけの小さなチャンクができないように)。
+    """
+    sections = []
+    lines = []
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if len(stripped) <= MAX_HEADING_CHARS and _HEADING_PATTERN.match(stripped):
+            if "".join(lines).strip():
+                sections.append((heading, "".join(lines)))
+            heading = stripped.lstrip("#").strip()
+            lines = []
+            continue
+        lines.append(line)
+    if "".join(lines).strip():
+        sections.append((heading, "".join(lines)))
+    return sections
+
+
+def split_documents(documents, splitter) -> list:
+    """
+    ページ (PyPDFLoaderのDocument) と見出しをまたがないようにチャンクへ分割し、(本文, メタデータ) のリストを返す。
+    見出しはページをまたいで引き継ぎ、メタデータの "section" に入れる。
+    節の中では段落、文の順に区切りを優先する。
+    """
+    pairs = []
+    heading = None
+    for document in documents:
+        sections = split_sections(document.page_content, heading)
+        for section_heading, body in sections:
+            for text in splitter.split_text(body):
+                metadata = dict(document.metadata)
+                if section_heading:
+                    metadata["section"] = section_heading
+                pairs.append((text, metadata))
+        if sections:
+            heading = sections[-1][0]
+    return pairs
+
+
+def load_and_split(file_path: str, settings: dict, file_hash: str = None) -> list:
+    """
+    ファイルを読み込んでチャンクに分割し、(本文, メタデータ) のリストを返す。
+    プロセス間で受け渡しやすいよう、Documentではなくタプルで返す。
+    メタデータには差分学習用の file_hash / chunk_hash を含める。
+    読み込めなかった場合はNoneを返す (空のファイルの場合の空リストと区別するため)。
+    """
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+
+    try:
+        if file_path.lower().endswith(".pdf"): loader = PyPDFLoader(file_path)
+        elif file_path.lower().endswith(".txt"): loader = TextLoader(file_path, encoding="utf-8")
+        else: return None
+        documents = loader.load()
+        pairs = []
+        for text, metadata in split_documents(documents, make_splitter(settings)):
+            metadata["source"] = file_path
+            metadata["chunk_hash"] = chunk_hash(text)
+            if file_hash:
+                metadata["file_hash"] = file_hash
+            pairs.append((text, metadata))
+        return pairs
+    except Exception as e:
+        print(f"Error processing document {file_path}: {e}")
+        return None
@@ -0,0 +1,242 @@
+# core/jobs.py
+"""
+PalLogicを使う処理 (質問への回答、ドキュメントや会話ログの学習) を実行するジョブスケジューラ。
+優先度の高いジョブ (質問) から順に、決まった数のワーカースレッドで実行する。
+グループごとに同時に実行できる数を制限し、学習が2つ同時に走ったり、
+LLMで2つの生成が同時に走ったりしないようにする。
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+PRIORITY_INTERACTIVE = 0 # ユーザーが待っている処理 (質問への回答)
+PRIORITY_MAINTENANCE = 5 # 会話の要約など
+PRIORITY_BACKGROUND = 10 # 学習
+
+GROUP_LLM = "llm"
+GROUP_LEARNING = "learning"
+DEFAULT_GROUP_LIMITS = {GROUP_LLM: 1, GROUP_LEARNING: 1}
+
+
+class JobCancelled(Exception):
+    """キャンセルされたジョブが、区切りのよいところで処理をやめるために送出する"""
+
+
+class Job:
+    """
+    スケジューラに投入された1つの処理。
+    実行される関数は最初の引数にこのJobを受け取り、cancelled を見て途中でやめたり、
+    report_progress() で進捗を知らせたりできる。
+    """
+    def __init__(self, func, args, kwargs, priority: int, group: str, name: str, on_progress, on_done):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.group = group
+        self.name = name or getattr(func, "__name__", "job")
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.state = "queued" # queued / running / done / failed / cancelled
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """キャンセルを要求する。待機中なら実行されず、実行中なら関数が cancelled を見てやめる。"""
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def report_progress(self, progress):
+        if self.on_progress:
+            try:
+                self.on_progress(self, progress)
+            except Exception as e:
+                print(f"Error in progress callback of job '{self.name}': {e}")
+
+    def done(self) -> bool:
+        return self._done_event.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        return self._done_event.wait(timeout)
+
+    def _finish(self, state: str):
+        self.state = state
+        self._done_event.set()
+        if self.on_done:
+            try:
+                self.on_done(self)
+            except Exception as e:
+                print(f"Error in done callback of job '{self.name}': {e}")
+
+
+class JobScheduler:
+    """
+    優先度付きのジョブキュー。数値の小さい優先度から、同じ優先度なら投入順に実行する。
+    ワーカースレッドの数 (max_workers) と、グループごとの同時実行数 (group_limits) の両方を守る。
+    """
+    def __init__(self, max_workers: int = 2, group_limits: dict = None):
+        self.max_workers = max_workers
+        self.group_limits = dict(DEFAULT_GROUP_LIMITS if group_limits is None else group_limits)
+        self._condition = threading.Condition()
+        self._queue = [] # (優先度, 投入順, Job)
+        self._running = {} # グループ -> 実行中の数
+        self._active = [] # 実行中のジョブ
+        self._counter = itertools.count()
+        self._workers = []
+        self._shutdown = False
+
+    def submit(self, func, *args, priority: int = PRIORITY_BACKGROUND, group: str = None, name: str = None,
+               on_progress=None, on_done=None, **kwargs) -> Job:
+        """
+        func(job, *args, **kwargs) を実行するジョブを投入する。
+        on_progress(job, progress) と on_done(job) はワーカースレッドから呼ばれる (UIの更新はafterで行うこと)。
+        """
+        job = Job(func, args, kwargs, priority, group, name, on_progress, on_done)
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("JobScheduler has been shut down.")
+            self._queue.append((priority, next(self._counter), job))
+            self._queue.sort(key=lambda entry: entry[:2])
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._worker, daemon=True, name=f"pal-job-{len(self._workers)}")
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify_all()
+        return job
+
+    def pending(self, group: str = None) -> list:
+        """待機中と実行中のジョブ (groupを指定するとそのグループだけ)"""
+        with self._condition:
+            return [job for _, _, job in self._queue if group is None or job.group == group] + \
+                   [job for job in self._active if group is None or job.group == group]
+
+    def cancel_all(self, group: str = None):
+        for job in self.pending(group):
+            job.cancel()
+        with self._condition:
+            self._condition.notify_all()
+
+    def shutdown(self, cancel: bool = True):
+        """新しいジョブを受け付けないようにする (アプリの終了時)"""
+        if cancel:
+            self.cancel_all()
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+
+    def _next_job(self):
+        """実行できる (グループの上限に達していない) ジョブのうち、最も優先度の高いものを取り出す"""
+        for index, (_, _, job) in enumerate(self._queue):
+            if job.cancelled:
+                del self._queue[index]
+                return job # キャンセル済みのものは実行せずに終了させる
+            limit = self.group_limits.get(job.group)
+            if limit is None or self._running.get(job.group, 0) < limit:
+                del self._queue[index]
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if self._shutdown:
+                        return
+                    self._condition.wait()
+                    job = self._next_job()
+                if not job.cancelled:
+                    self._running[job.group] = self._running.get(job.group, 0) + 1
+                    self._active.append(job)
+                    job.state = "running"
+
+            if job.cancelled and job.state == "queued":
+                job._finish("cancelled")
+                continue
+
+            self._run(job)
+
+            with self._condition:
+                self._running[job.group] -= 1
+                self._active.remove(job)
+                self._condition.notify_all()
+
+    @staticmethod
+    def _run(job: Job):
+        start_time = time.perf_counter()
+        wait_seconds = time.time() - job.submitted_at
+        try:
+            job.result = job.func(job, *job.args, **job.kwargs)
+            state = "cancelled" if job.cancelled else "done"
+        except JobCancelled:
+            state = "cancelled"
+        except Exception as e:
+            print(f"Error in job '{job.name}': {e}")
+            job.error = e
+            state = "failed"
+        print(f"Job '{job.name}' {state} in {time.perf_counter() - start_time:.2f}s (waited {wait_seconds:.2f}s).")
+        job._finish(state)
+
+
+class ReadWriteLock:
+    """
+    複数の読み込みは同時に、書き込みは単独で行うためのロック。
+    書き込みを待っている間は新しい読み込みを待たせ、質問が続いても学習の書き込みが止まらないようにする。
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_job_scheduler() -> JobScheduler:
+    """アプリ全体で共有するスケジューラ"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
@@ -0,0 +1,92 @@
+# core/learning_stats.py
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+
+class LearningStats:
+    """
+    ステータス画面に表示する統計情報 (ドキュメント数、単語数、ファイルごとの最終学習日時、DBサイズ) を
+    小さなJSONとして保存し、学習のたびに変わった分だけ更新するクラス。
+    ステータス画面を開くときにDBの中身を読み込まずに済む。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sources = {} # ソースファイル -> {"chunks", "words", "last_learned"}
+        self._history = {"chunks": 0, "words": 0, "last_learned": None} # 会話ログから学習した分
+        self._db_size = 0.0
+        self.loaded = self._load()
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._sources = data.get("sources", {})
+            self._history.update(data.get("history", {}))
+            self._db_size = float(data.get("db_size", 0.0))
+            return True
+        except FileNotFoundError:
+            return False
+        except (ValueError, TypeError, AttributeError, json.JSONDecodeError) as e:
+            print(f"Warning: Learning stats could not be loaded ({e}). They will be rebuilt.")
+            self._sources = {}
+            return False
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"sources": self._sources, "history": self._history, "db_size": self._db_size},
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.loaded = True
+        except OSError as e:
+            print(f"Warning: Could not save learning stats ({e}).")
+
+    def update_source(self, source: str, chunks: int, words: int, last_learned: float = None):
+        """ファイルを学習し直した後の、そのファイル由来のチャンク数と単語数を記録する"""
+        with self._lock:
+            if chunks:
+                self._sources[source] = {"chunks": chunks, "words": words,
+                                         "last_learned": last_learned or time.time()}
+            else:
+                self._sources.pop(source, None)
+            self._save()
+
+    def add_history(self, chunks: int, words: int):
+        """会話ログから学習した分を加算する"""
+        with self._lock:
+            self._history["chunks"] += chunks
+            self._history["words"] += words
+            self._history["last_learned"] = time.time()
+            self._save()
+
+    def set_db_size(self, db_size: float):
+        with self._lock:
+            self._db_size = db_size
+            self._save()
+
+    def replace(self, sources: dict, history: dict, db_size: float):
+        """DBの中身から作り直した統計で置き換える (統計ファイルがない場合に一度だけ使う)"""
+        with self._lock:
+            self._sources = sources
+            self._history = history
+            self._db_size = db_size
+            self._save()
+
+    def summary(self) -> dict:
+        """ステータス画面用の集計値を返す"""
+        with self._lock:
+            word_count = sum(source["words"] for source in self._sources.values()) + self._history["words"]
+            times = [source.get("last_learned") for source in self._sources.values()]
+            times.append(self._history.get("last_learned"))
+            times = [t for t in times if t]
+            return {
+                "doc_count": len(self._sources),
+                "word_count": word_count,
+                "last_learned": datetime.fromtimestamp(max(times)).strftime("%Y-%m-%d") if times else "Not available",
+                "db_size": self._db_size,
+            }
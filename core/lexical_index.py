@@ -0,0 +1,149 @@
+# core/lexical_index.py
+import re
+import sqlite3
+import threading
+
+from .term_frequency import STOPWORDS
+
+LEXICAL_INDEX_FILE = "pal_lexical_index.sqlite"
+
+_MAX_QUERY_TERMS = 64
+_MAX_SHORT_TERMS = 4
+_SHORT_TERM_CANDIDATES = 200 # 短い語のLIKE検索で、語の区切りを確かめる前に取り出す件数
+# "AB-1234" や "v2.3.1" のような型番は1語として扱う ("C#" や "C++" の記号も含める)
+_TERM_PATTERN = re.compile(r"\w(?:[\w.\-]*\w)?[#+]*")
+
+
+def match_query(text: str) -> str:
+    """
+    質問文からFTS5のMATCH式を作る。語のどれかを含むチャンクが候補になり、BM25で順位が付く。
+    trigramトークナイザは3文字未満の語を検索できないため、短い語は short_terms() でLIKE検索する。
+    空白で区切らない日本語などは、3文字ずつずらした断片に分ける。
+    """
+    terms = []
+    for term in _TERM_PATTERN.findall(text.lower()):
+        if term in STOPWORDS or len(term) < 3:
+            continue
+        if term.isascii():
+            terms.append(term)
+        else:
+            terms.extend(term[i:i + 3] for i in range(len(term) - 2))
+    terms = list(dict.fromkeys(terms))[:_MAX_QUERY_TERMS]
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def short_terms(text: str) -> list:
+    """
+    trigramでは検索できない2文字の語 ("X5", "C#", "v2" など) を返す。
+    1文字の語はほとんどのチャンクに含まれるため使わない。
+    """
+    terms = [term for term in _TERM_PATTERN.findall(text.lower())
+             if len(term) == 2 and term.isascii() and term not in STOPWORDS]
+    return list(dict.fromkeys(terms))[:_MAX_SHORT_TERMS]
+
+
+def _like_pattern(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _contains_word(content: str, term: str) -> bool:
+    """LIKEは部分一致のため、前後が英数字でない位置に語があるかを確かめる ("x5" が "0x55" に一致しないように)"""
+    return re.search(r"(?<!\w)" + re.escape(term) + r"(?![\w#+])", content, re.IGNORECASE) is not None
+
+
+class LexicalIndex:
+    """
+    学習したチャンクのキーワード検索用インデックス (SQLite FTS5、BM25で順位付け)。
+    型番や固有名詞など、埋め込みの類似度では見つけにくい語の完全一致を拾うために、Chromaと同じチャンクを同じIDで持つ。
+    """
+    def __init__(self, path: str = LEXICAL_INDEX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        try:
+            # FTS5の列はIDで引けないため、チャンクIDと行番号の対応は通常のテーブルに持つ
+            self._conn.execute("CREATE TABLE IF NOT EXISTS chunk_ids (id INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE)")
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(content, tokenize='trigram')")
+            self._conn.commit()
+            self.enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"Warning: SQLite FTS5 is not available ({e}). Keyword search is disabled.")
+            self.enabled = False
+
+    def add(self, ids: list, texts: list):
+        if not self.enabled or not ids:
+            return
+        with self._lock:
+            # 同じIDのチャンクを入れ直した場合に重複しないよう、先に消す
+            self._delete(ids)
+            self._insert(ids, texts)
+            self._conn.commit()
+
+    def delete(self, ids: list):
+        if not self.enabled or not ids:
+            return
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def _insert(self, ids: list, texts: list):
+        for chunk_id, text in zip(ids, texts):
+            row_id = self._conn.execute("INSERT INTO chunk_ids (chunk_id) VALUES (?)", (chunk_id,)).lastrowid
+            self._conn.execute("INSERT INTO chunks (rowid, content) VALUES (?, ?)", (row_id, text))
+
+    def _delete(self, ids: list):
+        rows = [(chunk_id,) for chunk_id in ids]
+        self._conn.executemany("DELETE FROM chunks WHERE rowid = (SELECT id FROM chunk_ids WHERE chunk_id = ?)", rows)
+        self._conn.executemany("DELETE FROM chunk_ids WHERE chunk_id = ?", rows)
+
+    def count(self) -> int:
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM chunk_ids").fetchone()[0]
+
+    def replace(self, ids: list, texts: list):
+        """インデックスを作り直す (Chromaの件数と合わない場合に使う)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM chunk_ids")
+            self._insert(ids, texts)
+            self._conn.commit()
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """
+        BM25の高い順に (チャンクID, 本文) のリストを返す。
+        2文字の語 (型番など) があれば、それを全て含むチャンクを先に並べる。
+        """
+        expression = match_query(query)
+        terms = short_terms(query)
+        if not self.enabled or not (expression or terms):
+            return []
+        with self._lock:
+            ranked = []
+            if expression:
+                ranked = self._conn.execute(
+                    "SELECT chunk_ids.chunk_id, chunks.content FROM chunks "
+                    "JOIN chunk_ids ON chunk_ids.id = chunks.rowid "
+                    "WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?",
+                    (expression, limit)
+                ).fetchall()
+            if not terms:
+                return ranked
+            # trigramの索引は使えないため、短い語はchat_searchと同じくLIKEで探す
+            rows = self._conn.execute(
+                "SELECT chunk_ids.chunk_id, chunks.content FROM chunks "
+                "JOIN chunk_ids ON chunk_ids.id = chunks.rowid WHERE "
+                + " AND ".join("chunks.content LIKE ? ESCAPE '\\'" for _ in terms) + " LIMIT ?",
+                [_like_pattern(term) for term in terms] + [_SHORT_TERM_CANDIDATES]
+            ).fetchall()
+        matched = [row for row in rows if all(_contains_word(row[1], term) for term in terms)]
+        matched_ids = {chunk_id for chunk_id, _ in matched}
+        # BM25でも上位のものを先に、残りの一致をその後に、短い語を含まないBM25の結果を最後に並べる
+        results = [row for row in ranked if row[0] in matched_ids]
+        seen = {chunk_id for chunk_id, _ in results}
+        results += [row for row in matched if row[0] not in seen]
+        results += [row for row in ranked if row[0] not in matched_ids]
+        return results[:limit]
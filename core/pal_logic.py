@@ -2,33 +2,85 @@
 import os
 import re
 import json
-from datetime import datetime
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+# 重いモジュール (torch, chromadb, llama_cpp, pypdf) は使用時にimportする
 # from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
 # from langchain_community.vectorstores import Chroma
-from langchain_chroma import Chroma
-from langchain_community.llms import LlamaCpp
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
 from .utils import resource_path
+from .prompt_cache import PromptPrefixCache
+from .embedding_cache import CachedEmbeddings
+from .answer_cache import AnswerCache
+from .chat_log import get_chat_log
+from .chat_search import ChatSearchIndex
+from .learning_stats import LearningStats
+from .generation_stats import GenerationStats
+from .tracing import get_tracer
+from .term_frequency import TermFrequencyIndex, count_terms
+from .retrieval import retrieval_settings, fetch_count, select_chunks, reciprocal_rank_fusion
+from .lexical_index import LexicalIndex
+from .reranker import CrossEncoderReranker
+from .jobs import ReadWriteLock, get_job_scheduler, PRIORITY_MAINTENANCE, GROUP_LLM
+from .prompt_assembler import (PromptAssembler, HistorySummary, prompt_settings, format_message,
+                               HISTORY_SCAN_MESSAGES, DEFAULT_SUMMARY_PROMPT)
+from .ingest import (collect_files, load_and_split, file_sha256, chunk_hash,
+                     chunking_settings, settings_for, chunking_signature, make_splitter)
+
+def _component(name: str):
+    """
+    バックグラウンドで読み込まれるコンポーネントへの遅延アクセサを作る。
+    読み込みが終わっていなければ、最初のアクセス時に完了まで待つ。
+    """
+    def getter(self):
+        return self._futures[name].result()
+
+    def setter(self, value):
+        future = Future()
+        future.set_result(value)
+        self.__dict__.setdefault("_futures", {})[name] = future
+
+    return property(getter, setter)
+
+
+class _LazyEmbeddings(Embeddings):
+    """埋め込みモデルの読み込み完了を待ってから処理を委譲するラッパー"""
+    def __init__(self, future):
+        self._future = future
+
+    def embed_documents(self, texts):
+        return self._future.result().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._future.result().embed_query(text)
+
 
 class PalLogic:
-    def __init__(self):
-        # ... (以前の__init__のコードは変更なし) ...
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        embed_model_name = "sentence-transformers/all-MiniLM-L6-v2"
-        self.embeddings = HuggingFaceEmbeddings(model_name=embed_model_name)
+    # 重いコンポーネントはスレッドプールで並列に読み込み、アクセス時に待つ
+    embeddings = _component("embeddings")
+    db = _component("db")
+    llm = _component("llm")
 
+    def __init__(self):
+        self.init_start_time = time.time()
+        self.embed_batch_size = 256 # 一度の add_documents で埋め込むチャンク数
+        self.embed_model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        self.embed_cache_dir = "./pal_embed_cache"
 
         self.db_path = "./pal_db"
-        self.chat_log_path = "chat_log.json"
-        self.db = Chroma(
-            persist_directory=self.db_path,
-            embedding_function=self.embeddings
-        )
+        # 学習中のDBへの書き込みと、質問時の検索が同時に行われないようにする
+        self._db_lock = ReadWriteLock()
+        self.chat_log = get_chat_log()
+        self._history_lock = threading.Lock()
+        self._history_index = None # 会話ログの検索インデックス (初めて検索するときに開く)
+        self._history_index_lock = threading.Lock()
 
         # model_path = "./models/qwen2-1_5b-instruct-q4_k_m.gguf"
         # model_path = "./models/qwen2-0_5b-instruct-q4_k_m.gguf"
@@ -37,17 +89,99 @@ class PalLogic:
 
         # model_path = resource_path("./models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf")
         model_path = resource_path("./models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf")
-        self.llm = LlamaCpp(
-            model_path=model_path, n_gpu_layers=-1, n_batch=512, n_ctx=4096, verbose=False,
-        )
+        self.model_path = model_path
+        self.n_ctx = 4096
+        self._llm_lock = threading.Lock() # llama.cppは同時に1つの生成しか扱えない
+
+        # 埋め込みモデル・Chroma・LlamaCppを並列に読み込み開始する
+        self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="pal-startup")
+        self._futures = {}
+        self._futures["embeddings"] = self._submit_load("embeddings", self._load_embeddings)
+        self._futures["db"] = self._submit_load("db", self._load_db)
+        self._futures["llm"] = self._submit_load("llm", self._load_llm)
+        self._executor.shutdown(wait=False)
+
+        # 固定プロンプト部分のKVキャッシュ (config.jsonの prompt_prefix_cache で切り替え)
+        self.prompt_cache_dir = "./pal_prompt_cache"
+        self.prompt_prefix_cache = PromptPrefixCache(self.prompt_cache_dir, model_path)
+        self.prefix_cache_enabled = True
+        self.prefix_cache_on_disk = True
+
+        # 似た質問への回答キャッシュ (知識ベースが変わると破棄される)
+        self.answer_cache = AnswerCache("./pal_answer_cache.json")
+
+        # ステータス画面用の統計情報 (学習のたびに差分だけ更新する)
+        self.learning_stats = LearningStats("./pal_stats.json")
+        # 回答の生成を途中で打ち切った回数
+        self.generation_stats = GenerationStats("./pal_generation_stats.json")
+        # ワードクラウド用の単語の出現回数
+        self.term_frequencies = TermFrequencyIndex("./pal_term_freq.json")
 
         # ▼▼▼ ここから追加 ▼▼▼
         # プロンプト設定ファイルを読み込む処理
         # self.prompt_config_path = "prompt_config.json"
         self.prompt_config_path = resource_path("prompt_config.json")
+        self.prompt_config_mtime = self._get_prompt_config_mtime()
         self.prompt_config = self._load_prompt_config()
         # ▲▲▲ ここまで追加 ▲▲▲
-        print("PalLogic initialized.")
+
+        # 組み立て済みチェーンのキャッシュ
+        # キー: (テンプレート種別, user_name, ai_name)
+        self._chain_cache = {}
+        self._chain_cache_names = None
+        self._chain_cache_lock = threading.Lock()
+        self.last_retrieval = None # 直前の検索の所要時間 (段階ごと) とチャンク数
+
+        # キーワード検索 (BM25) 用のインデックス。Chromaにチャンクを追加・削除するたびに同じ変更を反映する。
+        self.lexical_index = LexicalIndex("./pal_lexical_index.sqlite")
+        self._lexical_checked = False
+        self._lexical_lock = threading.Lock()
+        self._search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pal-search")
+        self._reranker = None # クロスエンコーダ (config.jsonの rerank を有効にしたときに読み込む)
+
+        # 入りきらない古い会話の要約 (chat_log.jsonl.summary に保存する)
+        self.history_summary = HistorySummary(self.chat_log)
+        self._summary_job = None
+        self.last_prompt = None # 直前のプロンプトのトークン数と、履歴に入れた範囲
+        print(f"[startup] PalLogic initialized in {time.time() - self.init_start_time:.2f}s "
+              "(models are still loading in the background).")
+
+    def _submit_load(self, name: str, loader):
+        """読み込み処理をスレッドプールに投入し、所要時間をコンソールに出力する"""
+        def run():
+            start = time.time()
+            component = loader()
+            print(f"[startup] {name} ready in {time.time() - start:.2f}s "
+                  f"({time.time() - self.init_start_time:.2f}s since start).")
+            return component
+        return self._executor.submit(run)
+
+    def _load_embeddings(self):
+        from langchain_huggingface import HuggingFaceEmbeddings
+        # 同じテキストを何度も埋め込まないよう、ディスクキャッシュでラップする
+        cache_dir = os.path.join(self.embed_cache_dir, self.embed_model_name.replace("/", "_"))
+        return CachedEmbeddings(HuggingFaceEmbeddings(model_name=self.embed_model_name), cache_dir)
+
+    def _load_db(self):
+        from langchain_chroma import Chroma
+        # 埋め込みモデルの読み込みを待たずにDBを開けるよう、遅延ラッパーを渡す
+        return Chroma(
+            persist_directory=self.db_path,
+            embedding_function=_LazyEmbeddings(self._futures["embeddings"])
+        )
+
+    def _load_llm(self):
+        from langchain_community.llms import LlamaCpp
+        return LlamaCpp(
+            model_path=self.model_path, n_gpu_layers=-1, n_batch=512, n_ctx=self.n_ctx,
+            # 回答の長さは ask_question_stream がトークンを数えて打ち切る (config.jsonの answer_max_tokens)
+            max_tokens=-1, verbose=False,
+        )
+
+    def is_ready(self, name: str) -> bool:
+        """指定したコンポーネント ("embeddings" / "db" / "llm") の読み込みが完了しているか"""
+        future = self._futures.get(name)
+        return future is not None and future.done() and future.exception() is None
 
 
     # ▼▼▼ ここから追加 ▼▼▼
@@ -68,137 +202,843 @@ class PalLogic:
             }
     # ▲▲▲ ここまで追加 ▲▲▲
 
-    def _load_and_split_document(self, file_path: str):
-        # ... (変更なし) ...
+    def _get_prompt_config_mtime(self):
+        """prompt_config.jsonの更新時刻を返す。存在しない場合はNone。"""
         try:
-            if file_path.lower().endswith(".pdf"): loader = PyPDFLoader(file_path)
-            elif file_path.lower().endswith(".txt"): loader = TextLoader(file_path, encoding="utf-8")
-            else: return []
-            documents = loader.load()
-            return self.text_splitter.split_documents(documents)
+            return os.path.getmtime(self.prompt_config_path)
+        except OSError:
+            return None
+
+    def _refresh_prompt_config_if_changed(self):
+        """prompt_config.jsonが更新されていれば読み込み直し、チェーンのキャッシュを破棄する"""
+        mtime = self._get_prompt_config_mtime()
+        if mtime == self.prompt_config_mtime:
+            return
+        print("Prompt configuration changed. Reloading and clearing chain cache.")
+        self.prompt_config_mtime = mtime
+        self.prompt_config = self._load_prompt_config()
+        self._chain_cache.clear()
+
+    def _get_chain(self, variant: str, user_name: str, ai_name: str):
+        """
+        組み立て済みのチェーンと、テンプレート部分のトークン数をキャッシュから返す。
+        variant は prompt_config.json のテンプレートキー ("prompt_no_history" / "prompt_with_history")。
+        """
+        with self._chain_cache_lock:
+            self._refresh_prompt_config_if_changed()
+
+            # 名前が変更された場合は古いチェーンを破棄する
+            if self._chain_cache_names != (user_name, ai_name):
+                self._chain_cache.clear()
+                self._chain_cache_names = (user_name, ai_name)
+
+            key = (variant, user_name, ai_name)
+            cached = self._chain_cache.get(key)
+            if cached is None:
+                print(f"Building chain for {key}.")
+                prompt_template = self._format_template(variant, user_name, ai_name)
+                # 変数を空にしたテンプレートのトークン数 (プロンプトの上限から差し引く分)
+                template_tokens = self._count_tokens(prompt_template.format(context="", question="", history=""))
+                cached = (self._compile_chain(prompt_template), template_tokens)
+                self._chain_cache[key] = cached
+            return cached
+
+    def _format_template(self, variant: str, user_name: str, ai_name: str) -> str:
+        """設定ファイルのテンプレートに、システムプロンプトと名前を埋め込む"""
+        system_prompt = self.prompt_config["system_prompt"]
+        base_template = self.prompt_config[variant]
+        return base_template.format(system_prompt=system_prompt, user_name=user_name, ai_name=ai_name)
+
+    def _compile_chain(self, prompt_template: str):
+        """プロンプトテンプレートを解析し、LCELチェーンを組み立てる"""
+        prompt = PromptTemplate.from_template(prompt_template)
+
+        # 入力は {"context": ..., "question": ..., "history": ...} の辞書で受け取る
+        # (コンテキストはチェーンの外で _retrieve_context が選ぶ)
+
+        # LLMに渡す直前に、固定プレフィックスのKVキャッシュを復元する
+        prefix_text = self._get_static_prefix(prompt_template)
+        restore_prefix = RunnableLambda(lambda prompt_value: self._restore_prompt_prefix(prompt_value, prefix_text))
+        return prompt | restore_prefix | self.llm | StrOutputParser()
+
+    def _get_static_prefix(self, prompt_template: str) -> str:
+        """
+        テンプレートのうち、質問ごとに変わらない先頭部分を返す。
+        トークン境界がずれないよう、{context} 直前の改行までで区切る。
+        """
+        index = prompt_template.find("{context}")
+        if index < 0:
+            return ""
+        return prompt_template[:prompt_template.rfind("\n", 0, index) + 1]
+
+    def _restore_prompt_prefix(self, prompt_value, prefix_text: str):
+        """プロンプト評価の前に、保存済みのプレフィックス状態をllama.cppに読み込む"""
+        if not self.prefix_cache_enabled:
+            return prompt_value
+        try:
+            saved = self.prompt_prefix_cache.restore(
+                self.llm.client, prompt_value.to_string(), prefix_text, use_disk=self.prefix_cache_on_disk
+            )
+            print(f"Prompt prefix cache: skipped {saved} prompt-eval tokens "
+                  f"(total {self.prompt_prefix_cache.total_tokens_saved}).")
         except Exception as e:
-            print(f"Error processing document {file_path}: {e}")
-            return []
+            print(f"Warning: Could not restore prompt prefix state ({e}).")
+        return prompt_value
+
+    def _load_and_split_document(self, file_path: str, settings: dict, file_hash: str = None):
+        pairs = load_and_split(file_path, settings, file_hash)
+        if pairs is None:
+            return None
+        return [Document(page_content=text, metadata=metadata) for text, metadata in pairs]
+
+    def _persist_db(self):
+        """古いChromaラッパーとの互換のため、persist()がある場合のみ呼ぶ (langchain_chromaは自動保存)"""
+        persist = getattr(self.db, "persist", None)
+        if persist:
+            persist()
 
-    def learn_from_document(self, file_path: str):
-        # ... (変更なし) ...
-        chunks = self._load_and_split_document(file_path)
-        if not chunks: return "No content to learn."
-        self.db.add_documents(chunks)
-        self.db.persist()
+    def _flush_embedding_cache(self):
+        """埋め込みキャッシュの索引を保存する (学習中は一定間隔でしか保存しないため、学習の終わりに呼ぶ)"""
+        flush = getattr(self.embeddings, "flush", None)
+        if flush:
+            flush()
+
+    def learn_from_document(self, file_path: str, config: dict = None):
+        result = self.learn_from_documents([file_path], config=config)
+        if result["skipped_files"]: return f"'{os.path.basename(file_path)}' is already learned."
+        if not result["chunks"] and not result["deleted"]: return "No content to learn."
         filename = os.path.basename(file_path)
         return f"Finished learning '{filename}'!"
 
+    def _get_learned_chunks(self, source: str) -> dict:
+        """
+        DBに保存済みの、指定ファイル由来のチャンクを調べる。
+        {"file_hashes": set, "chunks": {chunk_hash: [id, ...]}} を返す。
+        """
+        existing = self.db.get(where={"source": source}, include=["metadatas"])
+        file_hashes = set()
+        chunks = {}
+        for chunk_id, metadata in zip(existing.get("ids", []), existing.get("metadatas", [])):
+            metadata = metadata or {}
+            file_hashes.add(metadata.get("file_hash"))
+            # chunk_hashがない古いチャンクは、再学習時に必ず置き換えられる
+            chunks.setdefault(metadata.get("chunk_hash"), []).append(chunk_id)
+        return {"file_hashes": file_hashes, "chunks": chunks}
+
+    def _iter_split_files(self, files: list, file_hashes: dict, chunking: dict):
+        """
+        ファイルを読み込み・分割し、終わったものから順に (パス, チャンクのリスト) をyieldする。
+        読み込めなかったファイルのチャンクのリストはNoneになる。
+        複数ファイルの場合はプロセスプールで並列に処理する。
+        """
+        if not files:
+            return
+        if len(files) == 1:
+            yield files[0], self._load_and_split_document(files[0], settings_for(files[0], chunking), file_hashes[files[0]])
+            return
+
+        max_workers = min(len(files), os.cpu_count() or 1)
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {
+                executor.submit(load_and_split, path, settings_for(path, chunking), file_hashes[path]): path
+                for path in files
+            }
+            for future in as_completed(futures):
+                try:
+                    pairs = future.result()
+                except Exception as e:
+                    print(f"Error in document worker: {e}")
+                    pairs = None
+                if pairs is None:
+                    yield futures[future], None
+                    continue
+                yield futures[future], [Document(page_content=text, metadata=metadata) for text, metadata in pairs]
+        finally:
+            # 学習がキャンセルされた場合は、まだ始まっていないファイルの分割を取り消す
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def learn_from_documents(self, paths, progress_callback=None, config: dict = None, should_stop=None) -> dict:
+        """
+        複数のファイル/フォルダをまとめて学習する。
+        分割はプロセスプールで並列に行い、埋め込みはファイルをまたいだ大きなバッチで行う。
+        内容も分割設定 (config.jsonの chunking) も変わっていないファイルはスキップし、
+        変更されたファイルは差分のチャンクだけを埋め込む。
+        progress_callback には {files_done, files_total, chunks_embedded, chunks_per_sec} が渡される。
+        should_stop() が真を返すと、ファイルやバッチの区切りで学習をやめる。
+        各段階 (ハッシュ、分割、埋め込み、DBへの書き込み) の所要時間は "ingest" のトレースに記録する。
+        """
+        start_time = time.time()
+        chunking = chunking_settings(config)
+        files = collect_files(paths)
+        progress = {"files_done": 0, "files_total": len(files), "chunks_embedded": 0, "chunks_per_sec": 0.0}
+        result = {"files": len(files), "skipped_files": 0, "chunks": 0, "deleted": 0, "seconds": 0.0,
+                  "cancelled": False}
+        if not files:
+            return result
+        trace = get_tracer().start("ingest", source="documents", files=len(files))
+        # 分割・埋め込み・書き込みはバッチごとに何度も行うため、所要時間を合計して最後にスパンとして記録する
+        stage_seconds = {"split": 0.0, "embed": 0.0, "db_write": 0.0}
+
+        def stopped():
+            return bool(should_stop and should_stop())
+
+        def report():
+            elapsed = time.time() - start_time
+            progress["chunks_per_sec"] = progress["chunks_embedded"] / elapsed if elapsed > 0 else 0.0
+            if progress_callback:
+                progress_callback(dict(progress))
+
+        # ファイル -> [まだDBに書き込んでいないチャンク数, 学習し直した後の全チャンクの本文]
+        stats_pending = {}
+
+        def update_stats(path, texts):
+            # 学習し直した後のこのファイルのチャンクは、今回の分割結果と一致する
+            self.learning_stats.update_source(path, len(texts), sum(len(text.split()) for text in texts))
+            self.term_frequencies.update_source(path, texts)
+
+        def embed_batch(batch):
+            ids = [chunk_id for _, chunk_id in batch]
+            texts = [doc.page_content for doc, _ in batch]
+            # 埋め込みの計算はロックの外で行い、質問の検索を待たせるのはDBへの書き込みの間だけにする
+            embed_start = time.perf_counter()
+            vectors = self.embeddings.embed_documents(texts)
+            write_start = time.perf_counter()
+            stage_seconds["embed"] += write_start - embed_start
+            with self._db_lock.write():
+                self.db._collection.upsert(ids=ids, embeddings=vectors, documents=texts,
+                                           metadatas=[doc.metadata for doc, _ in batch])
+                self.lexical_index.add(ids, texts)
+            stage_seconds["db_write"] += time.perf_counter() - write_start
+            for doc, _ in batch:
+                path = doc.metadata["source"]
+                stats_pending[path][0] -= 1
+                if not stats_pending[path][0]:
+                    update_stats(path, stats_pending.pop(path)[1])
+            progress["chunks_embedded"] += len(batch)
+            report()
+
+        def timed_split(split_files):
+            # 分割はプロセスプールで埋め込みと並行して進むため、結果を待った時間だけを数える
+            iterator = iter(split_files)
+            while True:
+                split_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    stage_seconds["split"] += time.perf_counter() - split_start
+                yield item
+
+        # 1. ファイルのハッシュを計算し、変更のないファイルは読み込む前にスキップする
+        hash_start = time.perf_counter()
+        file_hashes = {}
+        learned = {}
+        files_to_learn = []
+        for path in files:
+            try:
+                # 分割設定が変わった場合も学習し直すよう、設定のハッシュも含める
+                file_hashes[path] = f"{file_sha256(path)}-{chunking_signature(settings_for(path, chunking))}"
+            except OSError as e:
+                print(f"Error reading {path}: {e}")
+                progress["files_done"] += 1
+                continue
+            learned[path] = self._get_learned_chunks(path)
+            if learned[path]["file_hashes"] == {file_hashes[path]}:
+                print(f"Skipping unchanged file: {path}")
+                result["skipped_files"] += 1
+                progress["files_done"] += 1
+                continue
+            files_to_learn.append(path)
+        trace.add_span("hash", (time.perf_counter() - hash_start) * 1000, start=hash_start)
+        report()
+
+        # 2. 変更・追加されたファイルを分割し、新しいチャンクだけを埋め込む
+        pending = []
+        try:
+            for path, chunks in timed_split(self._iter_split_files(files_to_learn, file_hashes, chunking)):
+                if stopped():
+                    result["cancelled"] = True
+                    break
+                progress["files_done"] += 1
+                if chunks is None:
+                    # 読み込めなかったファイルは、学習済みのチャンクをそのまま残す
+                    continue
+                existing_chunks = learned[path]["chunks"]
+                # チャンクIDは (ファイルパス, 本文) から決まるため、同じチャンクが二重に登録されない
+                source_id = chunk_hash(path)[:16]
+                new_hashes = set()
+                new_texts = []
+                new_pending = 0
+                for chunk in chunks:
+                    hash_value = chunk.metadata["chunk_hash"]
+                    if hash_value in new_hashes:
+                        continue # 同じファイル内の重複チャンク
+                    new_hashes.add(hash_value)
+                    new_texts.append(chunk.page_content)
+                    if hash_value not in existing_chunks:
+                        pending.append((chunk, f"{source_id}-{hash_value}"))
+                        new_pending += 1
+
+                # 新しい内容に存在しない古いチャンクを削除する (空になったファイルは全て削除する)
+                stale_ids = [chunk_id for hash_value, ids in existing_chunks.items()
+                             if hash_value not in new_hashes for chunk_id in ids]
+                write_start = time.perf_counter()
+                if stale_ids:
+                    with self._db_lock.write():
+                        self.db.delete(ids=stale_ids)
+                        self.lexical_index.delete(stale_ids)
+                    result["deleted"] += len(stale_ids)
+                # 残したチャンクのfile_hashを最新にする
+                kept_ids = [chunk_id for hash_value, ids in existing_chunks.items()
+                            if hash_value in new_hashes for chunk_id in ids]
+                if kept_ids:
+                    self._update_file_hash(kept_ids, file_hashes[path])
+                stage_seconds["db_write"] += time.perf_counter() - write_start
+                # 統計はこのファイルの新しいチャンクが全てDBに書き込まれてから更新する
+                if new_pending:
+                    stats_pending[path] = [new_pending, new_texts]
+                else:
+                    update_stats(path, new_texts)
+
+                # バッチサイズに達したら、パース中の残りのファイルを待たずに埋め込む
+                while len(pending) >= self.embed_batch_size and not stopped():
+                    embed_batch(pending[:self.embed_batch_size])
+                    del pending[:self.embed_batch_size]
+                report()
+
+            if pending and not stopped():
+                embed_batch(pending)
+            elif pending:
+                result["cancelled"] = True
+        except Exception as e:
+            trace.set(error=str(e))
+            raise
+        finally:
+            # 途中までしか埋め込んでいないファイル (キャンセルや埋め込みの失敗) は、次回の学習でやり直すようにする
+            for path in stats_pending:
+                self._invalidate_file(path)
+            # 埋め込みに失敗した場合も、そこまでのトレースを残す
+            for stage, seconds in stage_seconds.items():
+                trace.add_span(stage, seconds * 1000)
+            trace.set(chunks=progress["chunks_embedded"], skipped_files=result["skipped_files"],
+                      deleted=result["deleted"], cancelled=result["cancelled"])
+            trace.finish()
+        self._persist_db()
+        self.term_frequencies.flush()
+        self._flush_embedding_cache()
+        if progress["chunks_embedded"] or result["deleted"]:
+            self.answer_cache.invalidate()
+            self.learning_stats.set_db_size(self.get_db_size())
+
+        elapsed = time.time() - start_time
+        result["chunks"] = progress["chunks_embedded"]
+        result["seconds"] = elapsed
+        print(f"{'Cancelled after learning' if result['cancelled'] else 'Learned'} {result['chunks']} chunks "
+              f"from {len(files)} files in {elapsed:.2f}s "
+              f"({progress['chunks_per_sec']:.1f} chunks/s); skipped {result['skipped_files']} unchanged files, "
+              f"deleted {result['deleted']} stale chunks.")
+        return result
+
+    def _invalidate_file(self, path: str):
+        """
+        保存済みチャンクのfile_hashを消し、次回の学習で必ず分割し直されるようにする。
+        統計 (チャンク数・単語数・出現回数) は、実際にDBに残っているチャンクに合わせる。
+        """
+        existing = self.db.get(where={"source": path}, include=["documents"])
+        if existing["ids"]:
+            self._update_file_hash(existing["ids"], "")
+        texts = [text or "" for text in existing.get("documents", [])]
+        self.learning_stats.update_source(path, len(texts), sum(len(text.split()) for text in texts))
+        self.term_frequencies.update_source(path, texts)
+
+    def _update_file_hash(self, ids: list, file_hash: str):
+        """既存チャンクのメタデータにあるfile_hashを書き換える (再埋め込みはしない)"""
+        existing = self.db.get(ids=ids, include=["metadatas"])
+        metadatas = []
+        for metadata in existing.get("metadatas", []):
+            metadata = dict(metadata or {})
+            metadata["file_hash"] = file_hash
+            metadatas.append(metadata)
+        # langchain_chromaのupdate_documentsは再埋め込みを行うため、コレクションを直接更新する
+        with self._db_lock.write():
+            self.db._collection.update(ids=existing["ids"], metadatas=metadatas)
+
     # --- ↓↓↓ ここから追加 ↓↓↓ ---
-    def ask_question(self, query: str, history: list, config: dict) -> str:
+    def _count_tokens(self, text: str) -> int:
+        """モデルのトークナイザでトークン数を数える"""
+        return len(self.llm.client.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _truncate_tokens(self, text: str, max_tokens: int) -> str:
+        """先頭max_tokensトークンまでに切り詰める"""
+        tokens = self.llm.client.tokenize(text.encode("utf-8"), add_bos=False)[:max(0, max_tokens)]
+        return self.llm.client.detokenize(tokens).decode("utf-8", errors="ignore")
+
+    def _answer_token_limit(self, settings: dict) -> int:
+        """1回の回答で生成するトークン数の上限 (プロンプトの枠がなくならないよう、n_ctxの半分までにする)"""
+        return max(1, min(settings["answer_max_tokens"], self.n_ctx // 2))
+
+    def _prompt_budget(self, max_new_tokens: int) -> int:
+        """プロンプトに使えるトークン数 (BOSなどの特殊トークンの分を少し残す)"""
+        return self.n_ctx - max_new_tokens - 16
+
+    def _ensure_lexical_index(self):
         """
-        【メインの質問応答メソッド】
-        履歴の有無に応じてプロンプトを切り替えます。
+        キーワード検索のインデックスがChromaと同じ件数か、起動後の最初の検索で一度だけ確かめる。
+        以前のバージョンで学習したDBなど、件数が合わない場合はDBの中身から作り直す。
         """
-        print(f"Received question: {query}")
-        retriever = self.db.as_retriever(search_kwargs={"k": 3})
+        with self._lexical_lock:
+            if self._lexical_checked or not self.lexical_index.enabled:
+                return
+            if self.lexical_index.count() != self.db._collection.count():
+                print("Rebuilding the keyword search index from the database...")
+                db_content = self.db.get(include=["documents"])
+                self.lexical_index.replace(db_content["ids"], [text or "" for text in db_content["documents"]])
+            self._lexical_checked = True
+
+    def _get_reranker(self, model_name: str) -> CrossEncoderReranker:
+        if self._reranker is None or self._reranker.model_name != model_name:
+            self._reranker = CrossEncoderReranker(model_name)
+        return self._reranker
+
+    @staticmethod
+    def _timed(timings: dict, stage: str, func, *args, **kwargs):
+        """funcを実行し、所要時間をtimings[stage]に記録する"""
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] = time.perf_counter() - start_time
+
+    def _retrieve_context(self, query: str, config: dict) -> str:
+        """質問に関連するチャンクを選び、コンテキストの文字列を返す (学習中の書き込みとは同時に行わない)"""
+        with self._db_lock.read():
+            return self._search_context(query, config)
+
+    def _search_context(self, query: str, config: dict) -> str:
+        """
+        質問に関連するチャンクを選び、コンテキストの文字列を返す。
+        ベクトル検索とキーワード検索 (BM25) の順位をRRFで統合し、
+        しきい値を超えたチャンクだけを、config.jsonのトークン数の上限に収まる分だけ使う。
+        """
+        start_time = time.perf_counter()
+        settings = retrieval_settings(config)
+        timings = {}
+        collection = self.db._collection
+        total = collection.count()
+        if total == 0:
+            self.last_retrieval = {"seconds": 0.0, "chunks": 0, "candidates": 0, "stages": {}}
+            return ""
+        n_results = min(fetch_count(settings), total)
+
+        # キーワード検索はSQLiteで行うため、埋め込みとベクトル検索の間に別スレッドで済ませられる
+        hybrid = settings["retrieval_hybrid"] and self.lexical_index.enabled
+        keyword_future = None
+        if hybrid:
+            self._ensure_lexical_index()
+            if settings["retrieval_concurrent"]:
+                keyword_future = self._search_executor.submit(
+                    self._timed, timings, "keyword", self.lexical_index.search, query, n_results)
+
+        # 質問の埋め込みは ask_question_stream で計算済みのため、キャッシュから返る
+        query_vector = self._timed(timings, "embed", self.embeddings.embed_query, query)
+        results = self._timed(timings, "vector", collection.query, query_embeddings=[query_vector],
+                              n_results=n_results, include=["documents", "embeddings"])
+        keyword_results = []
+        if hybrid:
+            keyword_results = (keyword_future.result() if keyword_future
+                               else self._timed(timings, "keyword", self.lexical_index.search, query, n_results))
+
+        fuse_start = time.perf_counter()
+        ids = results["ids"][0]
+        texts = results["documents"][0]
+        vectors = list(results["embeddings"][0])
+        rank_scores = keyword_hits = None
+        if keyword_results:
+            candidates = {chunk_id: (text, vector) for chunk_id, text, vector in zip(ids, texts, vectors)}
+            # キーワード検索だけで見つかったチャンクは、MMRと類似度の計算のために埋め込みを取り出す
+            missing = [chunk_id for chunk_id, _ in keyword_results if chunk_id not in candidates]
+            if missing:
+                extra = collection.get(ids=missing, include=["documents", "embeddings"])
+                for chunk_id, text, vector in zip(extra["ids"], extra["documents"], extra["embeddings"]):
+                    candidates[chunk_id] = (text, vector)
+            keyword_ranking = [chunk_id for chunk_id, _ in keyword_results]
+            # キーワード検索の上位はしきい値に関係なく使う (型番や固有名詞は類似度が低くなりやすい)
+            strong_keywords = set(keyword_ranking[:settings["retrieval_top_k"]])
+            fused = [(chunk_id, score) for chunk_id, score
+                     in reciprocal_rank_fusion([ids, keyword_ranking], settings["retrieval_rrf_k"])
+                     if chunk_id in candidates]
+            ids = [chunk_id for chunk_id, _ in fused]
+            texts = [candidates[chunk_id][0] for chunk_id in ids]
+            vectors = [candidates[chunk_id][1] for chunk_id in ids]
+            rank_scores = [score for _, score in fused]
+            keyword_hits = [chunk_id in strong_keywords for chunk_id in ids]
+        timings["fuse"] = time.perf_counter() - fuse_start
 
+        if settings["rerank"] and texts:
+            count = settings["rerank_candidates"]
+            ids, texts, vectors = ids[:count], texts[:count], vectors[:count]
+            if keyword_hits:
+                keyword_hits = keyword_hits[:count]
+            rerank_scores = self._timed(timings, "rerank", self._get_reranker(settings["rerank_model"]).rerank,
+                                        query, ids, texts, settings["rerank_budget_ms"])
+            if rerank_scores is None:
+                print("Reranking skipped (model loading or over budget). Using the retrieval order.")
+                if rank_scores:
+                    rank_scores = rank_scores[:count]
+            else:
+                rank_scores = rerank_scores
+
+        chunks = self._timed(timings, "select", select_chunks, query_vector, texts, vectors, settings,
+                             self._count_tokens, rank_scores, keyword_hits)
+
+        elapsed = time.perf_counter() - start_time
+        stages = {stage: seconds * 1000 for stage, seconds in timings.items()}
+        self.last_retrieval = {"seconds": elapsed, "chunks": len(chunks), "candidates": len(texts), "stages": stages}
+        scores = ", ".join(f"{score:.2f}" for _, score in chunks)
+        stage_text = ", ".join(f"{stage} {ms:.1f}" for stage, ms in stages.items())
+        print(f"Retrieval: {len(chunks)}/{len(texts)} chunks in {elapsed * 1000:.1f} ms ({stage_text} ms; "
+              f"hybrid={hybrid}, keyword hits={len(keyword_results)}, rerank={settings['rerank']}, "
+              f"mmr={settings['retrieval_mmr']}, scores=[{scores}]).")
+        return "\n\n".join(text for text, _ in chunks)
+
+    def _build_chain(self, query: str, history, config: dict, context: str = ""):
+        """
+        プロンプトの各部分をトークン数の上限に収め、キャッシュ済みチェーンとその入力を返す。
+        history がNoneなら会話ログの末尾と古い会話の要約から履歴を作る。
+        ask_question / ask_question_stream の共通処理。
+        """
         # --- configから設定値を取得 ---
         ai_name = config.get("ai_name", "Assistant")
         user_name = config.get("user_name", "User")
-        
-        # get_tone_descriptionは常に同じシンプルな指示を返す
-        system_prompt = "You are a helpful AI assistant."
+        self.prefix_cache_enabled = config.get("prompt_prefix_cache", True)
+        self.prefix_cache_on_disk = config.get("prompt_prefix_cache_disk", True)
+        settings = prompt_settings(config)
 
-        # ▼▼▼ ここからが変更点 ▼▼▼
-        # 設定ファイルからシステムプロンプトを取得
-        system_prompt = self.prompt_config["system_prompt"]
+        if history is None:
+            records, _ = self.chat_log.read_records_before(None, HISTORY_SCAN_MESSAGES)
+            summary_offset, summary = self.history_summary.get()
+        else:
+            records = [(i, 0, entry) for i, entry in enumerate(history)]
+            summary_offset, summary = 0, ""
 
-        # もし会話履歴(history)が空っぽの場合
-        system_prompt = self.prompt_config["system_prompt"]
+        # 履歴ありのテンプレートのトークン数で割り当てる (履歴なしの方が短いため、上限は必ず守られる)
+        _, template_tokens = self._get_chain("prompt_with_history", user_name, ai_name)
+        assembler = PromptAssembler(self._count_tokens, self._truncate_tokens,
+                                    self._prompt_budget(self._answer_token_limit(settings)))
+        prompt = assembler.assemble(template_tokens, query, context, records, summary_offset, summary, settings)
+        self.last_prompt = {
+            "tokens": prompt["tokens"], "records": records if history is None else [],
+            "summary_offset": summary_offset, "first_kept_offset": prompt["first_kept_offset"],
+        }
+        print(f"Prompt: about {prompt['tokens']} tokens (budget {assembler.prompt_budget}).")
 
-        if not history:
+        inputs = {"question": prompt["question"], "context": prompt["context"]}
+        if not prompt["history"]:
             print("History is empty. Using a prompt without history section.")
-            # 設定ファイルから履歴なしテンプレートを取得
-            base_template = self.prompt_config["prompt_no_history"]
-            # テンプレートにシステムプロンプトと変数名を埋め込む
-            prompt_template = base_template.format(
-                system_prompt=system_prompt, user_name=user_name, ai_name=ai_name
-            )
-            prompt = PromptTemplate.from_template(prompt_template)
-            chain = (
-                {"context": retriever, "question": RunnablePassthrough()}
-                | prompt | self.llm | StrOutputParser()
-            )
-        else:
-            print("History exists. Using a prompt with history section.")
-            history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-            # 設定ファイルから履歴ありテンプレートを取得
-            base_template = self.prompt_config["prompt_with_history"]
-            # テンプレートにシステムプロンプトと変数名を埋め込む
-            prompt_template = base_template.format(
-                system_prompt=system_prompt, user_name=user_name, ai_name=ai_name
-            )
-            prompt = PromptTemplate.from_template(prompt_template)
-            chain = (
-                {"context": retriever, "question": RunnablePassthrough(), "history": lambda x: history_str}
-                | prompt | self.llm | StrOutputParser()
-            )
+            chain, _ = self._get_chain("prompt_no_history", user_name, ai_name)
+            return chain, inputs
 
-        # ▲▲▲ ここまでが変更点 ▲▲▲
+        print("History exists. Using a prompt with history section.")
+        chain, _ = self._get_chain("prompt_with_history", user_name, ai_name)
+        inputs["history"] = prompt["history"]
+        return chain, inputs
+
+    def _pending_summary_records(self) -> list:
+        """直前のプロンプトに入りきらず、まだ要約されていない会話を返す"""
+        prompt = self.last_prompt
+        if not prompt:
+            return []
+        return [record for record in prompt["records"]
+                if prompt["summary_offset"] <= record[0] < prompt["first_kept_offset"]]
+
+    def _schedule_history_summary(self, config: dict):
+        """要約されていない古い会話がたまっていれば、裏で要約を更新する"""
+        settings = prompt_settings(config)
+        pending = self._pending_summary_records()
+        if len(pending) < max(1, settings["history_summary_batch"]):
+            return
+        if self._summary_job is not None and not self._summary_job.done():
+            return # 要約の更新中
+        # 質問への回答と同じLLMのグループに入れ、回答が終わってから優先度を下げて実行する
+        self._summary_job = get_job_scheduler().submit(
+            lambda job: self.update_history_summary(pending, config),
+            priority=PRIORITY_MAINTENANCE, group=GROUP_LLM, name="history summary")
+
+    def update_history_summary(self, records: list, config: dict):
+        """
+        (位置, バイト数, メッセージ) の古い順のリストを、これまでの要約に畳み込む。
+        要約のプロンプトに入りきらない分は残し、次回に回す。
+        """
+        settings = prompt_settings(config)
+        _, summary = self.history_summary.get()
+        summary = summary or "(none)"
+        template = self.prompt_config.get("prompt_history_summary", DEFAULT_SUMMARY_PROMPT)
+        names = {"user_name": config.get("user_name", "User"), "ai_name": config.get("ai_name", "Assistant")}
+        assembler = PromptAssembler(self._count_tokens, self._truncate_tokens,
+                                    self._prompt_budget(settings["history_summary_tokens"]))
+        budget = assembler.prompt_budget - self._count_tokens(template.format(summary=summary, conversation="", **names))
 
-        # チェーンを実行して回答を生成
+        lines = []
+        end_offset = None
+        for offset, length, entry in records:
+            line, tokens = assembler.fit(format_message(entry), settings["history_message_tokens"])
+            if tokens > budget:
+                break
+            lines.append(line)
+            budget -= tokens
+            end_offset = offset + length
+        if end_offset is None:
+            return
+
+        start_time = time.perf_counter()
+        prompt = template.format(summary=summary, conversation="\n".join(lines), **names)
+        with self._llm_lock:
+            new_summary = self.llm.invoke(prompt, max_tokens=settings["history_summary_tokens"]).strip()
+        self.history_summary.set(end_offset, new_summary)
+        print(f"Summarized {len(lines)} older messages in {time.perf_counter() - start_time:.1f}s.")
+
+    def _answer_settings_key(self, config: dict, history_text: str = "") -> str:
+        """
+        回答の内容に影響する設定 (prompt_config.json、検索・リランク・プロンプト・生成の設定、モデル) と、
+        プロンプトに入れた会話履歴 (古い会話の要約を含む) のハッシュ。
+        回答キャッシュは、この値が同じときに作られた回答だけを返す
+        ("なぜ?" のような続きの質問に、別の会話への回答を返さないように)。
+        """
+        with self._chain_cache_lock:
+            self._refresh_prompt_config_if_changed()
+            prompt_config = self.prompt_config
+        settings = {
+            "model": os.path.basename(self.model_path),
+            "prompt_config": prompt_config,
+            "retrieval": retrieval_settings(config),
+            "prompt": prompt_settings(config),
+            "history": history_text,
+        }
+        return hashlib.sha1(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _lookup_cached_answer(self, embedding, config: dict, settings_key: str):
+        """回答キャッシュを調べ、キャッシュ済みの回答 (なければNone) を返す"""
+        if not config.get("answer_cache", True):
+            return None
+        names = (config.get("user_name", "User"), config.get("ai_name", "Assistant"))
+        threshold = float(config.get("answer_cache_threshold", 0.95))
+        return self.answer_cache.lookup(embedding, names, threshold, settings_key)
+
+    def _store_answer(self, query: str, embedding, config: dict, answer: str, settings_key: str):
+        if not config.get("answer_cache", True) or not answer.strip():
+            return
+        names = (config.get("user_name", "User"), config.get("ai_name", "Assistant"))
+        self.answer_cache.store(query, embedding, names, answer, settings_key)
+
+    def ask_question(self, query: str, history: list = None, config: dict = None, should_stop=None) -> str:
+        """
+        【メインの質問応答メソッド】
+        回答全体が生成されるまでブロックして返します。
+        history がNoneなら会話ログから履歴を作ります。
+        should_stop() がTrueを返すと、トークンの合間で生成を打ち切り、それまでの回答を返します。
+        """
+        answer = "".join(self.ask_question_stream(query, history, config, should_stop))
+        print(f"Generated answer: {answer}")
+        return answer
+
+    def ask_question_stream(self, query: str, history: list = None, config: dict = None, should_stop=None,
+                            trace=None):
+        """
+        【ストリーミング版の質問応答メソッド】
+        LlamaCppが生成したトークンを、生成され次第順番にyieldします。
+        history がNoneなら会話ログから履歴を作ります。
+        should_stop() がTrueを返すか、config.jsonの answer_max_tokens / answer_max_seconds を超えると、
+        トークンの合間で生成を打ち切ります (呼び出し側がジェネレータを閉じた場合も同じ)。
+        各段階の所要時間は trace (core.tracing.Trace) に記録します。
+        渡さなければここでトレースを作り、回答が終わった時点で書き出します。
+        """
+        config = config or {}
+        print(f"Received question (stream): {query}")
+        own_trace = trace is None
+        if own_trace:
+            trace = get_tracer().start("answer")
+        received_any = False
         try:
-            answer = chain.invoke(query)
-            print(f"Generated answer: {answer}")
-            return answer
+            with trace.span("embed"):
+                # 回答キャッシュの確認と検索の両方で使う (検索時は埋め込みキャッシュから返る)
+                query_embedding = self.embeddings.embed_query(query)
+            with trace.span("retrieve") as span:
+                self.last_retrieval = None
+                context = self._retrieve_context(query, config)
+                if self.last_retrieval:
+                    span["chunks"] = self.last_retrieval["chunks"]
+                    span["stages_ms"] = {stage: round(ms, 2) for stage, ms in self.last_retrieval["stages"].items()}
+            with trace.span("prompt_build") as span:
+                chain, inputs = self._build_chain(query, history, config, context)
+                prompt_tokens = self.last_prompt["tokens"]
+                span["tokens"] = prompt_tokens
+            # 回答キャッシュは、プロンプトに入れた会話履歴が同じ場合だけ使う
+            settings_key = self._answer_settings_key(config, inputs.get("history", ""))
+            cached_answer = self._lookup_cached_answer(query_embedding, config, settings_key)
+            if cached_answer is not None:
+                trace.set(cached=True)
+                yield cached_answer
+                return
+            settings = prompt_settings(config)
+            max_tokens = self._answer_token_limit(settings)
+            tokens = []
+            cutoff = None
+            with self._llm_lock:
+                if should_stop and should_stop():
+                    print("Answer cancelled before generation.")
+                    return
+                generation_start = time.perf_counter()
+                deadline = generation_start + settings["answer_max_seconds"]
+                first_token_time = None
+                stream = chain.stream(inputs)
+                try:
+                    for token in stream:
+                        if first_token_time is None:
+                            # 最初のトークンまでの時間は、ほぼプロンプトの評価 (prefill) にかかった時間
+                            first_token_time = time.perf_counter()
+                        if should_stop and should_stop():
+                            cutoff = "stopped"
+                            break
+                        if not token:
+                            continue
+                        received_any = True
+                        tokens.append(token)
+                        yield token
+                        if len(tokens) >= max_tokens:
+                            cutoff = "max_tokens"
+                            break
+                        if time.perf_counter() >= deadline:
+                            cutoff = "max_seconds"
+                            break
+                except GeneratorExit:
+                    cutoff = "stopped" # 呼び出し側がこのジェネレータを閉じた
+                    raise
+                finally:
+                    # ジェネレータを閉じるとllama.cppの生成ループも止まり、次の生成のためにロックを空ける
+                    stream.close()
+                    self.generation_stats.record(cutoff)
+                    # プレフィックスの状態はチェーンの中 (プロンプトの評価の直前) で読み込まれる
+                    cached_tokens = self.prompt_prefix_cache.last_tokens_saved if self.prefix_cache_enabled else 0
+                    self._trace_generation(trace, generation_start, first_token_time, prompt_tokens,
+                                           cached_tokens, len(tokens), cutoff)
+            if cutoff:
+                # 途中で打ち切った回答はキャッシュしない
+                print(f"Answer cut off after {len(tokens)} tokens ({cutoff}).")
+                return
+            self._store_answer(query, query_embedding, config, "".join(tokens), settings_key)
+            if history is None:
+                self._schedule_history_summary(config)
         except Exception as e:
-            print(f"Error during chain execution: {e}")
-            return "Sorry, an error occurred while generating the answer."
+            print(f"Error during chain streaming: {e}")
+            trace.set(error=str(e))
+            # 途中まで出力済みの場合は、そのまま打ち切る
+            if not received_any:
+                yield "Sorry, an error occurred while generating the answer."
+        finally:
+            if own_trace:
+                trace.finish()
+
+    @staticmethod
+    def _trace_generation(trace, start: float, first_token_time: float, prompt_tokens: int, cached_tokens: int,
+                          output_tokens: int, cutoff: str):
+        """
+        プロンプトの評価 (最初のトークンまで) と生成 (それ以降) を、トークン/秒と一緒にトレースに記録する。
+        プロンプトの評価のトークン/秒は、KVキャッシュから読み込んだ分を除いた、実際に評価したトークン数で計算する。
+        """
+        end = time.perf_counter()
+        first_token_time = first_token_time or end
+        prompt_seconds = first_token_time - start
+        generate_seconds = end - first_token_time
+        evaluated_tokens = max(0, prompt_tokens - cached_tokens)
+        trace.add_span("prompt_eval", prompt_seconds * 1000, start=start, tokens=prompt_tokens,
+                       cached_tokens=cached_tokens, evaluated_tokens=evaluated_tokens,
+                       tokens_per_sec=round(evaluated_tokens / prompt_seconds, 1) if prompt_seconds > 0 else None)
+        # 最初のトークンはプロンプトの評価の側に含まれるため、残りのトークン数で割る
+        trace.add_span("generate", generate_seconds * 1000, start=first_token_time, tokens=output_tokens,
+                       tokens_per_sec=(round((output_tokens - 1) / generate_seconds, 1)
+                                       if output_tokens > 1 and generate_seconds > 0 else None),
+                       cutoff=cutoff)
 
             
-    def learn_from_history(self):
+    def learn_from_history(self, config: dict = None):
         """
-        chat_log.jsonを読み込み、未学習の会話をDBに学習させる
+        会話ログを読み込み、未学習の会話をDBに学習させる
+        (各段階の所要時間は、文書の学習と同じく "ingest" のトレースに記録する)
         """
-        # 1. ログファイルを読み込む
-        try:
-            with open(self.chat_log_path, "r", encoding="utf-8") as f:
-                log_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return "No chat history found."
-
-        # 2. 未学習のメッセージを抽出
-        unlearned_entries = [entry for entry in log_data if not entry.get("learned")]
-        
-        if not unlearned_entries:
-            return "No new conversations to learn."
-
-        # 3. 未学習メッセージを1つのテキストに整形
-        formatted_text = "\n".join(
-            [f"{entry['role']}: {entry['content']}" for entry in unlearned_entries]
-        )
+        # 同時に2回学習して同じ会話を重複登録しないようにする
+        with self._history_lock:
+            # 1. 前回の学習以降に追記されたメッセージだけを読み込む
+            unlearned_entries, end_offset = self.chat_log.read_unlearned()
+
+            if not unlearned_entries:
+                return "No new conversations to learn."
+
+            trace = get_tracer().start("ingest", source="history", messages=len(unlearned_entries))
+            try:
+                with trace.span("split"):
+                    # 2. 未学習メッセージを1つのテキストに整形
+                    formatted_text = "\n".join(
+                        [f"{entry['role']}: {entry['content']}" for entry in unlearned_entries]
+                    )
+
+                    # 3. テキストをチャンク分割してDBに追加
+                    chunks = make_splitter(chunking_settings(config)[".txt"]).split_text(formatted_text)
+                if not chunks:
+                    return "Failed to process chat history."
+                trace.set(chunks=len(chunks))
+
+                # 埋め込みの計算はロックの外で行う
+                with trace.span("embed"):
+                    vectors = self.embeddings.embed_documents(chunks)
+                chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+                with trace.span("db_write"), self._db_lock.write():
+                    self.db._collection.upsert(ids=chunk_ids, embeddings=vectors, documents=chunks)
+                    self.lexical_index.add(chunk_ids, chunks)
+            except Exception as e:
+                trace.set(error=str(e))
+                raise
+            finally:
+                trace.finish()
+            self._persist_db()
+            self.answer_cache.invalidate()
+            self.learning_stats.add_history(len(chunks), len(formatted_text.split()))
+            self.term_frequencies.add_history(chunks)
+            self.term_frequencies.flush()
+            self._flush_embedding_cache()
+            self.learning_stats.set_db_size(self.get_db_size())
+
+            # 4. 読み込んだ位置までを学習済みにする
+            # (学習中に追記されたメッセージはこの位置より後ろにあるため、次回学習する)
+            self.chat_log.mark_learned(end_offset)
 
-        # 4. テキストをチャンク分割してDBに追加
-        chunks = self.text_splitter.split_text(formatted_text)
-        if not chunks:
-            return "Failed to process chat history."
-        
-        # LangChainのDocument形式に変換
-        from langchain_core.documents import Document
-        documents_to_add = [Document(page_content=chunk) for chunk in chunks]
-
-        self.db.add_documents(documents_to_add)
-        self.db.persist()
-
-        # 5. 学習済みフラグを更新
-        for entry in log_data:
-            if not entry.get("learned"):
-                entry["learned"] = True
-        
-        # 6. JSONファイルを更新
-        with open(self.chat_log_path, "w", encoding="utf-8") as f:
-            json.dump(log_data, f, indent=2, ensure_ascii=False)
-        
         message = f"Learned from {len(unlearned_entries)} new messages."
         print(message)
         return message
 
+    def _get_history_index(self) -> ChatSearchIndex:
+        with self._history_index_lock:
+            if self._history_index is None:
+                self._history_index = ChatSearchIndex(self.chat_log)
+            return self._history_index
+
+    def search_history(self, query: str, semantic: bool = False, limit: int = 50) -> list:
+        """
+        会話ログを検索する。semantic=Trueなら埋め込みの類似度、それ以外はキーワードの部分一致で探す。
+        結果の offset / length はログファイル内の位置 (LogWindowで該当ページに移動するために使う)。
+        """
+        index = self._get_history_index()
+        if semantic:
+            # 会話の埋め込みでドキュメント用のキャッシュを押し出さないよう、元のモデルを直接使う
+            embeddings = getattr(self.embeddings, "base", self.embeddings)
+            return index.semantic_search(query, embeddings, limit=limit)
+        return index.search(query, limit=limit)
+
+    def sync_history_index(self):
+        """追記された会話を検索インデックスに反映する (ログ画面を開いたときに裏で呼ぶ)"""
+        return self._get_history_index().sync()
+
     def get_tone_description(self, tone_name: str, ai_name: str) -> str:
         """口調の名前からシステムプロンプトを返す"""
         tones = {
@@ -235,45 +1075,67 @@ class PalLogic:
                 total_size += os.path.getsize(fp)
         return total_size / (1024 * 1024) # MBに変換
 
+    def get_embedding_cache_stats(self) -> dict:
+        """埋め込みキャッシュのヒット/ミス件数を返す (モデル読み込み前はNone)"""
+        if not self.is_ready("embeddings"):
+            return None
+        return self.embeddings.stats()
+
+    def _rebuild_learning_stats(self):
+        """
+        統計ファイルがない場合 (以前のバージョンで学習したDBなど) に、DBの中身から一度だけ作り直す。
+        最終学習日時は分からないため、ソースファイルの最終更新日時で代用する。
+        """
+        print("Rebuilding learning stats from the database...")
+        db_content = self.db.get(include=["metadatas", "documents"])
+        sources = {}
+        history = {"chunks": 0, "words": 0, "last_learned": None}
+        for metadata, text in zip(db_content.get("metadatas", []), db_content.get("documents", [])):
+            source = (metadata or {}).get("source")
+            # 会話ログから学習したチャンクにはsourceがない
+            entry = sources.setdefault(source, {"chunks": 0, "words": 0, "last_learned": None}) if source else history
+            entry["chunks"] += 1
+            entry["words"] += len((text or "").split())
+        for source_path, entry in sources.items():
+            try:
+                entry["last_learned"] = os.path.getmtime(source_path)
+            except OSError:
+                pass # ファイルが移動・削除された場合
+        self.learning_stats.replace(sources, history, self.get_db_size())
+
     def get_learning_stats(self) -> dict:
-        """学習したドキュメントの統計情報を取得する"""
+        """学習したドキュメントの統計情報を返す (保存済みの統計を読むだけで、DBの中身は読み込まない)"""
         if not os.path.exists(self.db_path):
             return {
-                "doc_count": 0, "word_count": 0, "last_learned": "N/A",
-                "all_text": "", "db_size": 0.0
+                "doc_count": 0, "word_count": 0, "last_learned": "N/A", "db_size": 0.0,
+                "embedding_cache": self.get_embedding_cache_stats(),
+                "generation": self.generation_stats.summary()
             }
-        
-        # データベースからすべてのドキュメントとメタデータを取得
+        if not self.learning_stats.loaded:
+            self._rebuild_learning_stats()
+
+        stats = self.learning_stats.summary()
+        stats["embedding_cache"] = self.get_embedding_cache_stats()
+        stats["generation"] = self.generation_stats.summary()
+        return stats
+
+    def _rebuild_term_frequencies(self):
+        """出現回数の保存ファイルがない場合に、DBの中身から一度だけ作り直す"""
+        print("Rebuilding term frequencies from the database...")
         db_content = self.db.get(include=["metadatas", "documents"])
-        
-        # ドキュメント数をカウント
-        sources = [meta.get('source') for meta in db_content.get('metadatas', []) if meta]
-        unique_sources = set(sources)
-        doc_count = len(unique_sources)
-
-        # 全テキストを結合し、単語数をカウント
-        all_text = " ".join(db_content.get('documents', []))
-        word_count = len(all_text.split())
-
-        # 最後に学習した日を取得 (メタデータから最新の日付を探す)
-        # ChromaDBはドキュメント追加日を保存しないため、ソースファイルの最終更新日時で代用
-        last_learned_date = None
-        if unique_sources:
-            latest_time = 0
-            for source_path in unique_sources:
-                try:
-                    mod_time = os.path.getmtime(source_path)
-                    if mod_time > latest_time:
-                        latest_time = mod_time
-                except FileNotFoundError:
-                    continue # ファイルが移動・削除された場合はスキップ
-            if latest_time > 0:
-                last_learned_date = datetime.fromtimestamp(latest_time).strftime("%Y-%m-%d")
-
-        return {
-            "doc_count": doc_count,
-            "word_count": word_count,
-            "last_learned": last_learned_date if last_learned_date else "Not available",
-            "all_text": all_text,
-            "db_size": self.get_db_size()
-        }
\ No newline at end of file
+        texts_by_source = {}
+        history_texts = []
+        for metadata, text in zip(db_content.get("metadatas", []), db_content.get("documents", [])):
+            source = (metadata or {}).get("source")
+            if source:
+                texts_by_source.setdefault(source, []).append(text or "")
+            else:
+                history_texts.append(text or "")
+        sources = {source: count_terms(texts) for source, texts in texts_by_source.items()}
+        self.term_frequencies.replace(sources, count_terms(history_texts))
+
+    def get_wordcloud_frequencies(self, max_words: int = 200):
+        """ワードクラウド用に (出現回数表のバージョン, 出現回数の多い単語の辞書) を返す"""
+        if not self.term_frequencies.loaded and os.path.exists(self.db_path):
+            self._rebuild_term_frequencies()
+        return self.term_frequencies.version, self.term_frequencies.top(max_words)
@@ -0,0 +1,150 @@
+# core/prompt_assembler.py
+"""
+プロンプトのトークン数の割り当て。
+n_ctxから生成分を引いた上限の中で、テンプレートと質問、コンテキスト、会話履歴の順に枠を割り当てる。
+会話履歴は新しいものから入るだけ入れ、入りきらない古い会話はログと一緒に保存した要約で置き換える。
+"""
+import os
+import json
+import threading
+
+from .utils import config_values
+
+DEFAULT_PROMPT_SETTINGS = {
+    "history_token_budget": 768, # 会話履歴 (要約を含む) に使うトークン数の上限
+    "history_message_tokens": 256, # 1件のメッセージに使うトークン数の上限 (長い発言は切り詰める)
+    "history_summary_tokens": 160, # 古い会話の要約の長さの上限
+    "history_summary_batch": 6, # 要約されていない古いメッセージがこの件数たまったら要約し直す
+    "answer_max_tokens": 256, # 1回の回答で生成するトークン数の上限
+    "answer_max_seconds": 60.0, # 1回の回答の生成にかける時間の上限 (超えたらそこまでで打ち切る)
+}
+
+HISTORY_SCAN_MESSAGES = 40 # 会話履歴の候補としてログ末尾から読むメッセージ数
+QUESTION_MAX_TOKENS = 512
+
+DEFAULT_SUMMARY_PROMPT = (
+    "Summarize the earlier part of a conversation between {user_name} and {ai_name} in a few sentences. "
+    "Keep names, facts, decisions and open questions.\n\n"
+    "Previous summary:\n{summary}\n\n"
+    "Conversation:\n{conversation}\n\n"
+    "Summary:"
+)
+
+
+def prompt_settings(config: dict) -> dict:
+    """config.jsonの値を、足りないものはデフォルト値で補って返す"""
+    return config_values(config, DEFAULT_PROMPT_SETTINGS)
+
+
+def format_message(entry: dict) -> str:
+    return f"{entry.get('role', 'unknown')}: {entry.get('content', '')}"
+
+
+class HistorySummary:
+    """
+    古い会話の要約を、要約済みの範囲 (ログの先頭からのバイト数) と一緒に
+    ログの隣のファイル (chat_log.jsonl.summary) に保存するクラス。
+    """
+    def __init__(self, chat_log):
+        self.chat_log = chat_log
+        self.path = chat_log.path + ".summary"
+        self._lock = threading.Lock()
+        self.offset = 0
+        self.text = ""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.offset = int(data["offset"])
+            self.text = str(data["summary"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not read '{self.path}' ({e}).")
+
+    def get(self):
+        """(要約済みの範囲の終わりの位置, 要約) を返す。ログが置き換えられていれば要約はない。"""
+        with self._lock:
+            if self.offset > self.chat_log.size():
+                return 0, ""
+            return self.offset, self.text
+
+    def set(self, offset: int, text: str):
+        with self._lock:
+            self.offset = offset
+            self.text = text
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"offset": offset, "summary": text}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Warning: Could not save '{self.path}' ({e}).")
+
+
+class PromptAssembler:
+    """
+    モデルのトークナイザで数えながら、プロンプトの各部分をトークン数の上限に収める。
+    count_tokens(text) はトークン数を、truncate_tokens(text, n) は先頭nトークンに切り詰めた文字列を返す関数。
+    """
+    def __init__(self, count_tokens, truncate_tokens, prompt_budget: int):
+        self.count_tokens = count_tokens
+        self.truncate_tokens = truncate_tokens
+        self.prompt_budget = prompt_budget
+
+    def fit(self, text: str, max_tokens: int):
+        """テキストをmax_tokens以内に切り詰め、(テキスト, トークン数) を返す"""
+        if max_tokens <= 0 or not text:
+            return "", 0
+        tokens = self.count_tokens(text)
+        if tokens <= max_tokens:
+            return text, tokens
+        text = self.truncate_tokens(text, max_tokens - 1) + "…"
+        return text, self.count_tokens(text)
+
+    def assemble(self, template_tokens: int, question: str, context: str, records: list,
+                 summary_offset: int, summary: str, settings: dict) -> dict:
+        """
+        各部分を上限に収めて返す。records は (位置, バイト数, メッセージ) の古い順のリスト。
+        戻り値の first_kept_offset は、そのまま履歴に入れた最も古いメッセージの位置。
+        """
+        remaining = self.prompt_budget - template_tokens
+
+        # 1. 質問 (長すぎる場合だけ切り詰める)
+        question, question_tokens = self.fit(question, min(QUESTION_MAX_TOKENS, remaining))
+        remaining -= question_tokens
+
+        # 2. コンテキスト (検索時に予算内で選んでいるが、残りに収まらない場合は切り詰める)
+        context, context_tokens = self.fit(context, remaining)
+        remaining -= context_tokens
+
+        # 3. 会話履歴: 新しいものから、入りきる分だけ入れる
+        history_budget = min(settings["history_token_budget"], remaining)
+        summary_tokens = 0
+        if summary:
+            summary, summary_tokens = self.fit(summary, min(settings["history_summary_tokens"], history_budget))
+        history_budget -= summary_tokens
+
+        kept = []
+        kept_tokens = 0
+        first_kept_offset = records[-1][0] + records[-1][1] if records else summary_offset
+        for offset, _, entry in reversed(records):
+            if offset < summary_offset:
+                break # ここから前は要約に含まれている
+            line, tokens = self.fit(format_message(entry), settings["history_message_tokens"])
+            if tokens > history_budget:
+                break
+            kept.append(line)
+            kept_tokens += tokens
+            history_budget -= tokens
+            first_kept_offset = offset
+        kept.reverse()
+
+        history_lines = ([f"(Summary of earlier conversation) {summary}"] if summary_tokens else []) + kept
+        history = "\n".join(history_lines)
+        return {
+            "question": question,
+            "context": context,
+            "history": history,
+            "first_kept_offset": first_kept_offset,
+            "tokens": template_tokens + question_tokens + context_tokens + summary_tokens + kept_tokens,
+        }
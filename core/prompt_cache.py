@@ -0,0 +1,121 @@
+# core/prompt_cache.py
+import os
+import pickle
+import hashlib
+import threading
+
+# 保存した状態の形式。プレフィックスのトークン化を変えたときに上げ、古い状態を使わないようにする。
+_STATE_VERSION = 2
+
+
+def _tokenize(llama, text: str) -> list:
+    """llama-cpp-pythonが補完のプロンプトをトークン化するときと同じ設定でトークン化する"""
+    return llama.tokenize(text.encode("utf-8"), add_bos=True, special=True)
+
+
+def _common_prefix_length(a, b) -> int:
+    matched = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        matched += 1
+    return matched
+
+
+class PromptPrefixCache:
+    """
+    プロンプト先頭の固定部分 (システムプロンプト + ルール) を評価した後の
+    llama.cppの状態(KVキャッシュ)を保存し、質問のたびに復元するクラス。
+    復元後はllama-cpp-pythonのプレフィックス一致により、残りのトークンだけが評価される。
+    """
+    def __init__(self, cache_dir: str, model_path: str):
+        self.cache_dir = cache_dir
+        # モデルが変わると状態は使えないため、キーにモデルファイル名を含める
+        self.model_id = os.path.basename(model_path)
+        self._states = {} # キー -> (LlamaState, プレフィックスのトークン列)
+        self._lock = threading.Lock()
+        self.last_tokens_saved = 0
+        self.total_tokens_saved = 0
+
+    def _key(self, prefix_text: str) -> str:
+        return hashlib.sha1(f"{_STATE_VERSION}\n{self.model_id}\n{prefix_text}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.state")
+
+    def _load_from_disk(self, key: str):
+        """ディスクに保存済みの状態を読み込む。なければNone。"""
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Warning: Could not load prompt prefix state ({e}).")
+            return None
+
+    def _save_to_disk(self, key: str, entry):
+        """状態をディスクに書き出す。書き込み途中で落ちても壊れないよう一時ファイル経由にする。"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._disk_path(key) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            print(f"Warning: Could not save prompt prefix state ({e}).")
+
+    def _evaluate_prefix(self, llama, prefix_text: str):
+        """固定プレフィックスだけを評価し、その直後の状態を保存する"""
+        prefix_tokens = _tokenize(llama, prefix_text)
+        llama.reset()
+        llama.eval(prefix_tokens)
+        return llama.save_state(), prefix_tokens
+
+    def restore(self, llama, prompt_text: str, prefix_text: str, use_disk: bool = True) -> int:
+        """
+        プロンプトが固定プレフィックスで始まる場合、プレフィックス評価後の状態を
+        llama に読み込む。評価を省略できるトークン数を返す。
+        llamaの今のコンテキストがすでにプレフィックスで始まっている場合は読み込まない
+        (llama-cpp-pythonが前回のプロンプトと一致する部分 (コンテキストや履歴も含む) を使い回せるように)。
+        """
+        self.last_tokens_saved = 0
+        if not prefix_text or not prompt_text.startswith(prefix_text):
+            return 0
+
+        prompt_tokens = _tokenize(llama, prompt_text)
+        live_tokens = list(llama.input_ids[:llama.n_tokens])
+        if _common_prefix_length(live_tokens, prompt_tokens) >= \
+                _common_prefix_length(_tokenize(llama, prefix_text), prompt_tokens):
+            return self._count_saved(live_tokens, prompt_tokens)
+
+        key = self._key(prefix_text)
+        with self._lock:
+            entry = self._states.get(key)
+            if entry is None and use_disk:
+                entry = self._load_from_disk(key)
+                if entry is not None:
+                    print("Prompt prefix state loaded from disk.")
+            if entry is None:
+                print("Evaluating static prompt prefix for the KV cache...")
+                entry = self._evaluate_prefix(llama, prefix_text)
+                if use_disk:
+                    self._save_to_disk(key, entry)
+            self._states[key] = entry
+
+            state, prefix_tokens = entry
+            llama.load_state(state)
+
+        # 境界のトークン化の違いを考慮して、実際に一致するトークン数を数える
+        return self._count_saved(prefix_tokens, prompt_tokens)
+
+    def _count_saved(self, cached_tokens, prompt_tokens) -> int:
+        # 最後のトークンはロジット更新のため再評価される
+        saved = max(0, min(_common_prefix_length(cached_tokens, prompt_tokens), len(prompt_tokens) - 1))
+        self.last_tokens_saved = saved
+        self.total_tokens_saved += saved
+        return saved
+
+    def clear(self):
+        """メモリ上の状態を破棄する (ディスク上のファイルは残す)"""
+        with self._lock:
+            self._states.clear()
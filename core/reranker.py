@@ -0,0 +1,80 @@
+# core/reranker.py
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+_CACHE_SIZE = 10000
+
+
+class CrossEncoderReranker:
+    """
+    質問とチャンクの組をクロスエンコーダで採点し直すクラス。
+    モデルは初めて使うときに裏で読み込み、読み込みが終わるまでは採点しない (呼び出し側は元の順位を使う)。
+    採点結果は (質問のハッシュ, チャンクID) ごとにメモリにキャッシュする。
+    """
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL):
+        self.model_name = model_name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pal-rerank")
+        self._model_future = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict() # (質問のハッシュ, チャンクID) -> スコア
+
+    def _load_model(self):
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(self.model_name)
+        print(f"Reranker '{self.model_name}' loaded.")
+        return model
+
+    def is_ready(self) -> bool:
+        """モデルが使えるか (読み込み前なら読み込みを開始する)"""
+        with self._lock:
+            if self._model_future is None:
+                self._model_future = self._executor.submit(self._load_model)
+            future = self._model_future
+        if not future.done():
+            return False
+        if future.exception() is not None:
+            print(f"Warning: Reranker could not be loaded ({future.exception()}).")
+            return False
+        return True
+
+    def _predict(self, query_key: str, query: str, pairs: list):
+        """(チャンクID, 本文) のリストをまとめて採点し、キャッシュに入れる"""
+        scores = self._model_future.result().predict([(query, text) for _, text in pairs])
+        with self._lock:
+            for (chunk_id, _), score in zip(pairs, scores):
+                self._cache[(query_key, chunk_id)] = float(score)
+            while len(self._cache) > _CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, ids: list, texts: list, budget_ms: float):
+        """
+        各チャンクのスコアを ids と同じ順で返す。
+        モデルの読み込み中や、採点がbudget_ms以内に終わらない場合はNoneを返す。
+        (間に合わなかった採点も裏で続け、次に同じ質問が来たときはキャッシュから返す)
+        """
+        query_key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        with self._lock:
+            missing = [(chunk_id, text) for chunk_id, text in zip(ids, texts) if (query_key, chunk_id) not in self._cache]
+        if missing:
+            if not self.is_ready():
+                return None
+            future = self._executor.submit(self._predict, query_key, query, missing)
+            try:
+                future.result(timeout=budget_ms / 1000)
+            except TimeoutError:
+                return None
+            except Exception as e:
+                print(f"Warning: Reranking failed ({e}).")
+                return None
+        with self._lock:
+            scores = []
+            for chunk_id in ids:
+                key = (query_key, chunk_id)
+                if key not in self._cache:
+                    return None # 採点の間にキャッシュから押し出された
+                self._cache.move_to_end(key)
+                scores.append(self._cache[key])
+            return scores
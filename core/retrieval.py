@@ -0,0 +1,111 @@
+# core/retrieval.py
+"""
+質問に渡すコンテキストのチャンク選択。
+類似度のしきい値を超えたチャンクだけを、トークン数の上限に収まる分だけ使う。
+MMRを有効にすると、似通ったチャンクばかりにならないよう多様性も考慮して選ぶ。
+ハイブリッド検索では、ベクトル検索とキーワード検索 (BM25) の順位を Reciprocal Rank Fusion で統合する。
+リランクを有効にすると、多めに取った候補をクロスエンコーダで採点し直した順に選ぶ。
+"""
+import numpy as np
+
+from .utils import config_values
+
+DEFAULT_RETRIEVAL_SETTINGS = {
+    "retrieval_top_k": 3, # 使うチャンクの最大数
+    "retrieval_score_threshold": 0.25, # これ未満のコサイン類似度のチャンクは使わない
+    "retrieval_mmr": False,
+    "retrieval_mmr_lambda": 0.5, # 1に近いほど関連度、0に近いほど多様性を重視する
+    "retrieval_token_budget": 512, # コンテキスト全体のトークン数の上限
+    "retrieval_hybrid": True, # キーワード検索 (BM25) の結果も統合する
+    "retrieval_rrf_k": 60, # RRFの定数 (大きいほど下位の順位も重視する)
+    "retrieval_concurrent": True, # ベクトル検索とキーワード検索を並行して行う
+    "rerank": False, # クロスエンコーダで候補を採点し直す
+    "rerank_candidates": 20, # 採点し直す候補の数
+    "rerank_budget_ms": 300, # 採点がこの時間内に終わらなければ元の順位を使う
+    "rerank_model": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+}
+
+
+def retrieval_settings(config: dict) -> dict:
+    """config.jsonの値を、足りないものはデフォルト値で補って返す"""
+    return config_values(config, DEFAULT_RETRIEVAL_SETTINGS)
+
+
+def fetch_count(settings: dict) -> int:
+    """ベクトルストアから取得する候補の数 (MMRやリランクの場合は多めに取る)"""
+    top_k = max(1, settings["retrieval_top_k"])
+    count = max(top_k * 4, 20) if settings["retrieval_mmr"] else top_k
+    if settings["rerank"]:
+        count = max(count, settings["rerank_candidates"])
+    return count
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _mmr_order(query_scores, vectors, lambda_mult: float) -> list:
+    """Maximal Marginal Relevance で候補を並べ替える"""
+    remaining = list(range(len(query_scores)))
+    selected = []
+    max_redundancy = np.zeros(len(query_scores), dtype=np.float32)
+    while remaining:
+        scores = lambda_mult * query_scores[remaining] - (1 - lambda_mult) * max_redundancy[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        selected.append(best)
+        max_redundancy = np.maximum(max_redundancy, vectors @ vectors[best])
+    return selected
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60) -> list:
+    """
+    複数の検索結果 (IDの順位付きリスト) を統合し、(ID, スコア) をスコアの高い順に返す。
+    スコアは各リストでの順位rに対する 1 / (k + r) の合計。
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def select_chunks(query_vector, texts: list, vectors, settings: dict, count_tokens,
+                  rank_scores=None, keyword_hits=None) -> list:
+    """
+    候補のチャンクから、コンテキストに使うものを選んで (本文, 類似度) のリストで返す。
+    count_tokens は本文のトークン数を返す関数 (モデルのトークナイザ)。
+    rank_scores (RRFやリランクのスコア、0以上) を渡すと類似度の代わりにその順で選び、
+    keyword_hits が真のチャンク (キーワード検索で見つかったもの) は類似度のしきい値を満たさなくても使う。
+    """
+    if not texts:
+        return []
+    vectors = _normalize(vectors)
+    query_scores = vectors @ _normalize(query_vector)
+    if rank_scores is None:
+        relevance = query_scores
+    else:
+        relevance = np.asarray(rank_scores, dtype=np.float32)
+        relevance = relevance - min(0.0, float(relevance.min())) # 負のスコアを返すモデルの場合
+        relevance = relevance / max(float(relevance.max()), 1e-12)
+
+    if settings["retrieval_mmr"]:
+        order = _mmr_order(relevance, vectors, settings["retrieval_mmr_lambda"])
+    else:
+        order = list(np.argsort(-relevance, kind="stable"))
+
+    selected = []
+    used_tokens = 0
+    for index in order:
+        if len(selected) >= settings["retrieval_top_k"]:
+            break
+        score = float(query_scores[index])
+        if score < settings["retrieval_score_threshold"] and not (keyword_hits and keyword_hits[index]):
+            continue
+        tokens = count_tokens(texts[index])
+        if used_tokens + tokens > settings["retrieval_token_budget"]:
+            continue # 入りきらないチャンクは飛ばし、もっと短いものを探す
+        selected.append((texts[index], score))
+        used_tokens += tokens
+    return selected
@@ -0,0 +1,132 @@
+# core/term_frequency.py
+import os
+import re
+import json
+import heapq
+import uuid
+import threading
+from collections import Counter
+
+# wordcloudの既定のストップワード (英語) と同じもの
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are aren't as at be because been before being below
+between both but by can can't cannot com could couldn't did didn't do does doesn't doing don't down during each
+else ever few for from further get had hadn't has hasn't have haven't having he he'd he'll he's hence her here
+here's hers herself him himself his how how's however http i i'd i'll i'm i've if in into is isn't it it's its
+itself just k let's like me more most mustn't my myself no nor not of off on once only or other otherwise ought
+our ours ourselves out over own r same shall shan't she she'd she'll she's should shouldn't since so some such
+than that that's the their theirs them themselves then there there's therefore these they they'd they'll they're
+they've this those through to too under until up very was wasn't we we'd we'll we're we've were weren't what
+what's when when's where where's which while who who's whom why why's with won't would wouldn't www you you'd
+you'll you're you've your yours yourself yourselves
+""".split()) | {"user", "assistant"} # 会話ログを学習したときの話者名
+
+_WORD_PATTERN = re.compile(r"\w[\w']+")
+
+
+def count_terms(texts) -> Counter:
+    """wordcloudと同じ規則 (2文字以上、数字とストップワードを除く) で単語を数える"""
+    counts = Counter()
+    for text in texts:
+        for word in _WORD_PATTERN.findall(text):
+            word = word.lower()
+            if word.endswith("'s"):
+                word = word[:-2]
+            if word.isdigit() or word in STOPWORDS:
+                continue
+            counts[word] += 1
+    return counts
+
+
+class TermFrequencyIndex:
+    """
+    ワードクラウド用の単語の出現回数表。
+    ソースファイルごとの出現回数を保存しておき、ファイルを学習し直したときはその分だけ差し替える。
+    内容が変わるたびに version が変わるため、描画済みの画像のキャッシュキーに使える。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sources = {} # ソースファイル -> Counter
+        self._history = Counter() # 会話ログから学習した分
+        self._totals = Counter()
+        self._dirty = False
+        self.version = None
+        self.loaded = self._load()
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._sources = {source: Counter(counts) for source, counts in data["sources"].items()}
+            self._history = Counter(data.get("history", {}))
+            self.version = data["version"]
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, TypeError, AttributeError, json.JSONDecodeError) as e:
+            print(f"Warning: Term frequencies could not be loaded ({e}). They will be rebuilt.")
+            self._sources = {}
+            self._history = Counter()
+            return False
+        for counts in self._sources.values():
+            self._totals.update(counts)
+        self._totals.update(self._history)
+        return True
+
+    def _changed(self):
+        self.version = uuid.uuid4().hex
+        self._dirty = True
+
+    def update_source(self, source: str, texts):
+        """ファイルを学習し直した後の、そのファイル由来の全チャンクの本文で出現回数を差し替える"""
+        counts = count_terms(texts)
+        with self._lock:
+            old_counts = self._sources.pop(source, None)
+            if old_counts:
+                self._totals.subtract(old_counts)
+                # 0以下になった単語を取り除く
+                self._totals = +self._totals
+            if counts:
+                self._sources[source] = counts
+                self._totals.update(counts)
+            self._changed()
+
+    def add_history(self, texts):
+        counts = count_terms(texts)
+        with self._lock:
+            self._history.update(counts)
+            self._totals.update(counts)
+            self._changed()
+
+    def replace(self, sources: dict, history: Counter):
+        """DBの中身から作り直した出現回数で置き換える (保存ファイルがない場合に一度だけ使う)"""
+        with self._lock:
+            self._sources = sources
+            self._history = history
+            self._totals = Counter()
+            for counts in sources.values():
+                self._totals.update(counts)
+            self._totals.update(history)
+            self._changed()
+        self.flush()
+
+    def flush(self):
+        """変更があればファイルに保存する (学習が終わったときにまとめて呼ぶ)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"version": self.version, "sources": self._sources, "history": self._history},
+                              f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+                self.loaded = True
+            except OSError as e:
+                print(f"Warning: Could not save term frequencies ({e}).")
+
+    def top(self, max_words: int = 200) -> dict:
+        """出現回数の多い順にmax_words語を返す"""
+        with self._lock:
+            return dict(heapq.nlargest(max_words, self._totals.items(), key=lambda item: item[1]))
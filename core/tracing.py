@@ -0,0 +1,205 @@
+# core/tracing.py
+"""
+質問から回答までの各段階 (質問の埋め込み、検索、プロンプトの組み立て、プロンプトの評価、生成、UIの描画) の
+所要時間を記録するトレース。1回の質問を1行のJSONとして pal_trace.jsonl に書き出す (一定サイズで世代交代)。
+文書や会話ログの学習も、段階 (ハッシュ、分割、埋め込み、DBへの書き込み) ごとに "ingest" のトレースとして同じファイルに書き出す。
+ステータス画面では、最近の質問と学習について段階ごとの中央値 (p50) と p95 を表示する。
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+TRACE_FILE = "./pal_trace.jsonl"
+TRACE_MAX_BYTES = 1024 * 1024
+TRACE_BACKUP_COUNT = 3
+TRACE_RECENT = 200 # ステータス画面の集計に使う、最近のトレースの数
+
+# ステータス画面に表示する順番と名前
+SUMMARY_METRICS = [
+    ("embed", "ms", "Query Embedding"),
+    ("retrieve", "ms", "Retrieval"),
+    ("prompt_build", "ms", "Prompt Build"),
+    ("prompt_eval", "ms", "Prompt Evaluation"),
+    ("prompt_eval_tps", "tok/s", "Prompt Evaluation"),
+    ("generate", "ms", "Generation"),
+    ("generate_tps", "tok/s", "Generation"),
+    ("ui_render", "ms", "UI Render"),
+    ("total", "ms", "Total"),
+]
+
+INGEST_SUMMARY_METRICS = [
+    ("hash", "ms", "File Hashing"),
+    ("split", "ms", "Parse & Split"),
+    ("embed", "ms", "Embedding"),
+    ("db_write", "ms", "Database Write"),
+    ("total", "ms", "Total"),
+]
+
+# トレースの名前ごとの集計項目
+TRACE_METRICS = {"answer": SUMMARY_METRICS, "ingest": INGEST_SUMMARY_METRICS}
+
+
+def percentile(values: list, fraction: float) -> float:
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Trace:
+    """
+    1回の質問のトレース。span() で囲んだ処理や add_span() で渡した所要時間を、段階 (スパン) として記録する。
+    スレッドをまたいで使えるが、finish() した後に追加されたスパンは捨てる。
+    """
+    def __init__(self, tracer, name: str, attrs: dict):
+        self._tracer = tracer
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.finished = False
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """withで囲んだ処理の所要時間を記録する。yieldされるdictに項目を足すと、スパンの属性として残る。"""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add_span(name, (time.perf_counter() - start) * 1000, start=start, **attrs)
+
+    def add_span(self, name: str, duration_ms: float, start: float = None, **attrs):
+        """計測済みの所要時間をスパンとして記録する (startはperf_counterの値、省略すると今終わったものとみなす)"""
+        if start is None:
+            start = time.perf_counter() - duration_ms / 1000
+        span = {"name": name, "start_ms": round((start - self._start) * 1000, 2), "duration_ms": round(duration_ms, 2)}
+        span.update(attrs)
+        with self._lock:
+            if not self.finished:
+                self.spans.append(span)
+
+    def set(self, **attrs):
+        with self._lock:
+            self.attrs.update(attrs)
+
+    def finish(self):
+        """トレースを閉じてファイルに書き出す (2回目以降は何もしない)"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            record = {"trace_id": self.trace_id, "name": self.name,
+                      "time": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                      "total_ms": round((time.perf_counter() - self._start) * 1000, 2),
+                      "spans": self.spans}
+            record.update(self.attrs)
+        self._tracer._write(record)
+
+
+class Tracer:
+    """
+    トレースをJSONLファイルに書き出し、最近の分をメモリに持って集計するクラス。
+    ファイルの世代交代は logging の RotatingFileHandler に任せる。
+    """
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES,
+                 backup_count: int = TRACE_BACKUP_COUNT, recent: int = TRACE_RECENT):
+        self.path = path
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=recent)
+        self._recent_loaded = False
+        self._logger = logging.getLogger(f"pal.trace.{os.path.abspath(path)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False # トレースはコンソールに出さない
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                          encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def start(self, name: str, **attrs) -> Trace:
+        return Trace(self, name, attrs)
+
+    def _write(self, record: dict):
+        with self._lock:
+            self._recent.append(record)
+            try:
+                self._logger.info(json.dumps(record, ensure_ascii=False))
+            except Exception as e:
+                print(f"Warning: Could not write trace ({e}).")
+
+    def _load_recent(self):
+        """
+        書き出し済みの最近のトレースを読み込む (初めて集計するときに1回だけ)。
+        ファイルには今回の起動後に記録した分も入っているため、メモリ上の分は読み込んだもので置き換える。
+        """
+        records = deque(maxlen=self._recent.maxlen)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue # 書き込み途中で終了した行など
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not read traces ({e}).")
+        self._recent = records
+        self._recent_loaded = True
+
+    def recent(self) -> list:
+        with self._lock:
+            if not self._recent_loaded:
+                self._load_recent()
+            return list(self._recent)
+
+    def summary(self, name: str = "answer") -> dict:
+        """
+        最近のトレースについて、TRACE_METRICS の項目ごとの件数・p50・p95のリストを返す。
+        同じ名前のスパンが1回のトレースに複数ある場合は合計する。"_tps" はそのスパンのトークン/秒。
+        """
+        summary_metrics = TRACE_METRICS[name]
+        values = {key: [] for key, _, _ in summary_metrics}
+        traces = [record for record in self.recent() if record.get("name") == name]
+        for record in traces:
+            durations = {}
+            for span in record.get("spans", []):
+                durations[span["name"]] = durations.get(span["name"], 0.0) + span["duration_ms"]
+                if span.get("tokens_per_sec") is not None:
+                    values.setdefault(span["name"] + "_tps", []).append(span["tokens_per_sec"])
+            durations["total"] = record.get("total_ms", 0.0)
+            for key, duration in durations.items():
+                if key in values:
+                    values[key].append(duration)
+
+        metrics = []
+        for key, unit, label in summary_metrics:
+            samples = values[key]
+            # トークン/秒は小さいほど遅いため、p95 (遅い側) は下から5%の値にする
+            tail = 0.05 if unit == "tok/s" else 0.95
+            metrics.append({"key": key, "label": label, "unit": unit, "count": len(samples),
+                            "p50": percentile(samples, 0.5) if samples else None,
+                            "p95": percentile(samples, tail) if samples else None})
+        return {"traces": len(traces), "metrics": metrics}
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """アプリ全体で共有するトレーサー"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
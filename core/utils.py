@@ -13,4 +13,30 @@ def resource_path(relative_path):
         # 通常のPython環境で実行している場合
         base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
-    return os.path.join(base_path, relative_path)
\ No newline at end of file
+    return os.path.join(base_path, relative_path)
+
+
+def config_values(config: dict, defaults: dict) -> dict:
+    """
+    config.jsonから defaults のキーの値を取り出す。
+    ない値や型が合わない値はデフォルト値にする。
+    """
+    values = dict(defaults)
+    for key, default in defaults.items():
+        value = config.get(key, default)
+        try:
+            values[key] = _parse_bool(value) if isinstance(default, bool) else type(default)(value)
+        except (TypeError, ValueError):
+            print(f"Warning: Invalid value for '{key}' ({value!r}). Using {default}.")
+    return values
+
+
+def _parse_bool(value) -> bool:
+    """真偽値の設定を読む。bool("false") がTrueになるため、受け付ける値を限定する。"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    raise ValueError(f"not a boolean: {value!r}")
@@ -4,6 +4,7 @@ STRINGS = {
     "ja": {
         "app_title": "My AI Pal",
         "chat_hint": "Palに話しかける...",
+        "stop_button": "停止",
         "status_title": "Palのステータス",
         "learning_timeline_title": "学習のきろく",
         "drop_accepted": "{} を読み込みました！",
@@ -17,6 +18,7 @@ STRINGS = {
     "en": {
         "app_title": "My AI Pal",
         "chat_hint": "Talk to Pal...",
+        "stop_button": "Stop",
         "status_title": "Pal's Status",
         "learning_timeline_title": "Learning Timeline",
         "drop_accepted": "Loaded {}!",
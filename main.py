@@ -1,6 +1,7 @@
 import logging
 import traceback
 import ctypes
+import multiprocessing
 import os
 import sys
 import tkinter as tk
@@ -123,4 +124,6 @@ def main():
                 shutdown_func()
 
 if __name__ == "__main__":
+    # PyInstallerでビルドした場合に、学習用の子プロセスがアプリを再起動しないようにする
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -3,12 +3,9 @@ import json
 import customtkinter as ctk
 from tkinterdnd2 import DND_FILES, TkinterDnD
 from PIL import Image # 👈 この行を追加
-from .main_view import MainView
 import os
-import pyglet
 import time
 import threading
-from core.pal_logic import PalLogic
 from i18n import t
 from core.utils import resource_path
 
@@ -116,32 +113,53 @@ class App(TkinterDnD.Tk):
         self.withdraw()
         self.start_time = time.time()
         self.logic = None # ロジックを一旦 None で初期化
+        self.logic_error = None # PalLogicの読み込みに失敗した場合の例外
 
         self.themes = self.load_themes()
         self.config = self.get_config()
+        print(f"[startup] config and themes loaded in {time.time() - self.start_time:.2f}s.")
         theme_name = self.config.get("theme", "dark").lower()
         bg_color = self.themes.get(theme_name, {}).get("bg_color", "#242424")
 
         self.splash = SplashScreen(self, bg_color=bg_color)
+        # 重いモジュールのimportを始める前に、スプラッシュを確実に描画しておく
+        self.splash.update()
+        print(f"[startup] splash shown at {time.time() - self.start_time:.2f}s.")
 
-        # ★★★ 重いAIモデルの読み込みをバックグラウンドで開始 ★★★
+        # ★★★ PalLogic (langchain等) のimportとモデル読み込みはバックグラウンドで行う ★★★
+        # 読み込み完了を待たずにUIを準備する (各モデルは最初に使われる時に完了を待つ)
+        self.logic_ready = threading.Event()
         logic_loader_thread = threading.Thread(target=self._load_backend_logic, daemon=True)
         logic_loader_thread.start()
+        self.after(0, self._setup_ui)
 
 
     def _load_backend_logic(self):
-        """[バックグラウンド処理] 時間のかかるAIモデル(PalLogic)を初期化する"""
+        """[バックグラウンド処理] PalLogicをimportし、モデルの並列読み込みを開始する"""
         print("AIモデルの読み込みを開始します...")
-        # --- ここが時間のかかる処理 ---
-        self.logic = PalLogic()
-        # --- 処理ここまで ---
-        print("AIモデルの読み込みが完了しました。")
-
-        # 完了後、メイン画面の準備を予約する
-        self.after(0, self._setup_ui)
+        try:
+            from core.pal_logic import PalLogic
+            self.logic = PalLogic()
+            print(f"[startup] PalLogic imported and created at {time.time() - self.start_time:.2f}s.")
+        except Exception as e:
+            print(f"Error: Could not load the AI backend ({e}).")
+            self.logic_error = e
+        finally:
+            self.logic_ready.set()
+
+    def get_logic(self):
+        """
+        PalLogicの準備ができるまで待ってから返す (ワーカースレッドから呼ぶこと)。
+        読み込みに失敗していた場合はRuntimeErrorを送出する。
+        """
+        self.logic_ready.wait()
+        if self.logic is None:
+            raise RuntimeError(f"The AI backend could not be loaded ({self.logic_error}).")
+        return self.logic
 
     def _setup_ui(self):
-        """[メイン処理] AIモデルの読み込み完了後に、UIの準備を行う"""
+        """[メイン処理] UIの準備を行う (AIモデルの読み込み完了は待たない)"""
+        from .main_view import MainView
         if self.config.get("user_name") == "Any":
             dialog = InitialSetupDialog(self, self)
             self.wait_window(dialog)
@@ -164,6 +182,7 @@ class App(TkinterDnD.Tk):
         self.frames[MainView] = frame
         frame.grid(row=0, column=0, sticky="nsew")
         self.show_frame(MainView)
+        print(f"[startup] UI ready at {time.time() - self.start_time:.2f}s.")
         
         # UIの準備が全て終わったら、ローディング画面を閉じる処理を呼び出す
         self.dismiss_splash_screen()
@@ -185,6 +204,8 @@ class App(TkinterDnD.Tk):
 
 
     def __init__2(self):
+        from core.pal_logic import PalLogic
+        from .main_view import MainView
         super().__init__()
         
         # --- 設定とテーマの読み込み ---
@@ -275,7 +296,8 @@ class App(TkinterDnD.Tk):
             # フォントファイルへのフルパスを生成
             # font_path = os.path.join("assets/fonts", font_face_filename)
             font_path = resource_path(os.path.join("assets/fonts", font_face_filename))
-            # pygletを使ってフォントファイルを読み込む
+            # pygletを使ってフォントファイルを読み込む (起動を速くするため初回使用時にimport)
+            import pyglet
             pyglet.font.add_file(font_path)
             print(f"Successfully loaded font: {font_path}")
 
@@ -311,7 +333,34 @@ class App(TkinterDnD.Tk):
                 "font_face": "Inter_24pt-Regular.ttf",
                 "font_size": 16,
                 "width": 340,
-                "height": 640
+                "height": 640,
+                "prompt_prefix_cache": True,
+                "prompt_prefix_cache_disk": True,
+                "answer_cache": True,
+                "answer_cache_threshold": 0.95,
+                "typing_speed": 60,
+                "retrieval_top_k": 3,
+                "retrieval_score_threshold": 0.25,
+                "retrieval_mmr": False,
+                "retrieval_mmr_lambda": 0.5,
+                "retrieval_token_budget": 512,
+                "retrieval_hybrid": True,
+                "retrieval_rrf_k": 60,
+                "retrieval_concurrent": True,
+                "rerank": False,
+                "rerank_candidates": 20,
+                "rerank_budget_ms": 300,
+                "rerank_model": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                "history_token_budget": 768,
+                "history_message_tokens": 256,
+                "history_summary_tokens": 160,
+                "history_summary_batch": 6,
+                "answer_max_tokens": 256,
+                "answer_max_seconds": 60,
+                "chunking": {
+                    ".pdf": {"splitter": "tokens", "chunk_size": 256, "chunk_overlap": 32},
+                    ".txt": {"splitter": "tokens", "chunk_size": 256, "chunk_overlap": 32}
+                }
             }
 
     def save_config(self, new_config):
@@ -0,0 +1,121 @@
+# ui/frame_cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import customtkinter as ctk
+from PIL import Image, PngImagePlugin
+
+FRAME_CACHE_DIR = "./pal_frame_cache"
+_CACHE_FORMAT = 1 # 保存形式を変えたら上げる
+
+
+class GifFrameCache:
+    """
+    キャラクターのGIFアニメーションを、表示サイズに縮小したフレームとしてキャッシュするクラス。
+    縮小済みのフレームは横に並べた1枚のPNGとしてディスクに保存し、GIFの更新日時とサイズが
+    変わらない限り、次回以降の起動ではGIFのデコードと縮小を省略する。
+    読み込みはワーカースレッドで行い、同じGIFのフレームは全てのラベルで共有する。
+    """
+    def __init__(self, cache_dir: str = FRAME_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gif-frames")
+        self._lock = threading.Lock()
+        self._futures = {} # (パス, サイズ) -> Future[(PILのフレームのリスト, 表示時間のリスト)]
+        self._images = {} # (パス, サイズ) -> (CTkImageのリスト, 表示時間のリスト) ※UIスレッドからのみ使う
+
+    def load(self, path: str, size):
+        """フレームの読み込みを開始し、Futureを返す (読み込み済みなら完了済みのFuture)"""
+        key = (os.path.abspath(path), tuple(size))
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._executor.submit(self._load_frames, key[0], key[1])
+                self._futures[key] = future
+            return future
+
+    def get_images(self, path: str, size, frames, delays):
+        """読み込んだフレームをCTkImageにする (UIスレッドで呼ぶ)。同じGIFなら作成済みのものを返す。"""
+        key = (os.path.abspath(path), tuple(size))
+        if key not in self._images:
+            self._images[key] = ([ctk.CTkImage(frame, size=tuple(size)) for frame in frames], delays)
+        return self._images[key]
+
+    def _disk_path(self, path: str, size) -> str:
+        stat = os.stat(path)
+        key = json.dumps([_CACHE_FORMAT, path, stat.st_mtime_ns, stat.st_size, list(size)])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+    def _load_frames(self, path: str, size):
+        start_time = time.perf_counter()
+        cache_path = self._disk_path(path, size)
+        result = self._load_from_disk(cache_path, size)
+        source = "cache"
+        if result is None:
+            result = self._decode_gif(path, size)
+            self._save_to_disk(cache_path, *result)
+            source = "GIF"
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        print(f"Loaded {len(result[0])} frames of '{os.path.basename(path)}' from {source} in {elapsed_ms:.1f} ms.")
+        return result
+
+    @staticmethod
+    def _decode_gif(path: str, size):
+        """GIFの全フレームを表示サイズに縮小して返す"""
+        frames = []
+        delays = []
+        with Image.open(path) as im:
+            try:
+                while True:
+                    frames.append(im.copy().resize(size).convert("RGBA"))
+                    delays.append(im.info.get('duration', 100)) # durationがなければ100ms
+                    im.seek(len(frames))
+            except EOFError:
+                pass # フレームの終端
+        return frames, delays
+
+    @staticmethod
+    def _load_from_disk(cache_path: str, size):
+        """横に並べて保存したPNGを読み込み、フレームに切り分ける。なければNone。"""
+        try:
+            with Image.open(cache_path) as sheet:
+                sheet.load()
+                delays = json.loads(sheet.text["delays"])
+                width, height = size
+                frames = [sheet.crop((i * width, 0, (i + 1) * width, height)) for i in range(len(delays))]
+            return frames, delays
+        except FileNotFoundError:
+            return None
+        except (OSError, KeyError, ValueError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not read cached frames '{cache_path}' ({e}).")
+            return None
+
+    def _save_to_disk(self, cache_path: str, frames, delays):
+        if not frames:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            width, height = frames[0].size
+            sheet = Image.new("RGBA", (width * len(frames), height))
+            for i, frame in enumerate(frames):
+                sheet.paste(frame, (i * width, 0))
+            info = PngImagePlugin.PngInfo()
+            info.add_text("delays", json.dumps(delays))
+            tmp_path = cache_path + ".tmp"
+            sheet.save(tmp_path, format="PNG", pnginfo=info)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Warning: Could not cache frames ({e}).")
+
+
+_frame_cache = None
+
+
+def get_frame_cache() -> GifFrameCache:
+    """テーマやキャラクターを切り替えてMainViewを作り直しても共有される、アプリ全体のキャッシュ"""
+    global _frame_cache
+    if _frame_cache is None:
+        _frame_cache = GifFrameCache()
+    return _frame_cache
@@ -10,7 +10,7 @@ HELP_PAGES = [
     },
     {
         "title": "How to Teach Pal",
-        "content": "Simply drag and drop your text files (.txt) or PDF files onto Pal's image.\n\nPal will read them and remember their content."
+        "content": "Simply drag and drop your text files (.txt) or PDF files onto Pal's image.\n\nYou can drop several files or a whole folder at once.\n\nPal will read them and remember their content."
     },
     {
         "title": "How to Chat",
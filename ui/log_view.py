@@ -1,11 +1,48 @@
 # ui/log_view.py
+import sys
+import time
+import threading
+import tkinter.font as tkfont
+from bisect import bisect_left, bisect_right
 import customtkinter as ctk
-import json
 from datetime import datetime
+from core.chat_log import get_chat_log
+
+
+class _Bubble:
+    """使い回すチャットバブル1つ分のウィジェット"""
+    def __init__(self, window, canvas):
+        self.frame = ctk.CTkFrame(canvas, corner_radius=15)
+        self.time_label = ctk.CTkLabel(self.frame, text="", height=16, font=("Arial", 10), text_color=("#666666", "#AAAAAA"))
+        self.text_widget = ctk.CTkTextbox(
+            self.frame,
+            wrap="word",
+            fg_color="transparent",
+            corner_radius=0,
+            border_width=0,
+            font=ctk.CTkFont(size=LogWindow.FONT_SIZE)
+        )
+        self.text_widget.pack(padx=10, pady=5, fill="both", expand=True)
+        self.window_id = canvas.create_window(0, 0, window=self.frame, anchor="nw", state="hidden")
+        # バブルの上でもホイールでログをスクロールできるようにする
+        for widget in (self.frame, self.time_label, self.text_widget):
+            window.bind_mouse_wheel(widget)
 
-CHAT_LOG_FILE = "chat_log.json"
 
 class LogWindow(ctk.CTkToplevel):
+    """
+    会話ログを新しい順に表示するウィンドウ。
+    ログファイルの末尾から必要な分だけページ単位で読み込み (下までスクロールすると続きを読む)、
+    画面に見えている分のバブルだけを作って使い回す。
+    """
+    PAGE_SIZE = 20
+    FONT_SIZE = 14
+    LOAD_MORE_MARGIN = 600 # 下端からこの距離 (px) まで近づいたら次のページを読み込む
+    BUBBLE_GAP = 10
+    TIME_HEIGHT = 21 # タイムスタンプ行の高さ (上の余白を含む)
+    TEXT_PADDING = 10 # テキストボックスの上下の余白
+    MIN_TEXT_HEIGHT = 40
+
     def __init__(self, master, controller):
         super().__init__(master)
         self.controller = controller
@@ -18,148 +55,352 @@ class LogWindow(ctk.CTkToplevel):
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(0, weight=1)
 
-        self.all_logs = []
-        self.current_page = 0
-        self.logs_per_page = 20
-        self.bubble_widgets = []
+        self.chat_log = get_chat_log()
+        self.entries = [] # 読み込み済みのメッセージ (新しい順)
+        self.heights = [] # 各バブルの高さ (px)
+        self.tops = [] # 各バブルの上端のy座標 (px)
+        self.total_height = 0
+        self.next_offset = None # 次に読み込むページの終わりの位置 (None = ファイル末尾)
+        self.has_more = True
+        self.layout_width = None # 高さを計算したときのキャンバスの幅
+        self.pool = [] # 使われていないバブル
+        self.assigned = {} # メッセージ番号 -> 表示中のバブル
+        self._word_widths = {}
+        self._resize_job = None
+        self._load_pending = False
+        self.view_end = None # 検索結果に移動したときの表示の終わりの位置 (None = 最新まで表示)
+        self.highlight_index = None # 検索で一致したメッセージの番号
+        self.result_buttons = []
+
+        self.scaling = ctk.ScalingTracker.get_widget_scaling(self)
+        self.measure_font = tkfont.Font(family=ctk.CTkFont().cget("family"), size=-round(self.FONT_SIZE * self.scaling))
+        self.line_height = self.measure_font.metrics("linespace")
 
         main_frame = ctk.CTkFrame(self, fg_color="transparent")
         main_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
-        main_frame.grid_rowconfigure(0, weight=1)
+        main_frame.grid_rowconfigure(2, weight=1)
         main_frame.grid_columnconfigure(0, weight=1)
 
-        self.scrollable_frame = ctk.CTkScrollableFrame(main_frame, fg_color="transparent")
-        self.scrollable_frame.grid(row=0, column=0, columnspan=2, sticky="nsew")
+        # --- 検索バー ---
+        search_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        search_frame.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 10))
+        search_frame.grid_columnconfigure(0, weight=1)
+
+        self.search_entry = ctk.CTkEntry(search_frame, placeholder_text="Search conversations...")
+        self.search_entry.grid(row=0, column=0, sticky="ew")
+        self.search_entry.bind("<Return>", lambda event: self.search())
+        self.semantic_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(search_frame, text="Semantic", variable=self.semantic_var, width=20).grid(row=0, column=1, padx=(10, 0))
+        ctk.CTkButton(search_frame, text="Search", width=70, command=self.search).grid(row=0, column=2, padx=(10, 0))
+        ctk.CTkButton(search_frame, text="Latest", width=70, command=self.show_latest).grid(row=0, column=3, padx=(10, 0))
+
+        # 検索結果の一覧 (検索するまでは隠しておく)
+        self.results_frame = ctk.CTkScrollableFrame(main_frame, height=150)
+        self.results_frame.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(0, 10))
+        self.results_frame.grid_remove()
+
+        self.canvas = ctk.CTkCanvas(main_frame, highlightthickness=0, bg=self._apply_appearance_mode(theme_colors["bg_color"]),
+                                    yscrollincrement=30)
+        self.canvas.grid(row=2, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(main_frame, command=self.canvas.yview)
+        self.scrollbar.grid(row=2, column=1, sticky="ns")
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
+        self.bind_mouse_wheel(self.canvas)
+
+        self.status_label = ctk.CTkLabel(main_frame, text="Loading...")
+        self.status_label.grid(row=3, column=0, columnspan=2, pady=(10,0))
+
+        self._refresh_layout_width()
+        self.load_more()
+
+        # 前回から追記された会話を、検索する前に裏で索引に追加しておく
+        threading.Thread(target=self._sync_history_index, daemon=True).start()
 
-        self.page_label = ctk.CTkLabel(main_frame, text="Page 1/1")
-        self.page_label.grid(row=1, column=0, columnspan=2, pady=(10,0))
+    def _sync_history_index(self):
+        """[別スレッド] 検索インデックスを更新する (get_logicはPalLogicの準備ができるまで待つため、UIスレッドでは呼ばない)"""
+        try:
+            self.controller.get_logic().sync_history_index()
+        except Exception as e:
+            print(f"Error syncing chat log search index: {e}")
+
+    # --- ページの読み込み ---
+
+    def load_more(self):
+        """ログファイルから、まだ読んでいない次のページ (より古いメッセージ) を読み込む"""
+        self._load_pending = False
+        if not self.has_more:
+            return
+        page, self.next_offset = self.chat_log.read_before(self.next_offset, self.PAGE_SIZE)
+        if self.next_offset == 0:
+            self.has_more = False
+
+        width = self._text_width()
+        for entry in reversed(page):
+            height = self._bubble_height(entry, width)
+            self.entries.append(entry)
+            self.heights.append(height)
+            self.tops.append(self.total_height)
+            self.total_height += height + self._scaled(self.BUBBLE_GAP)
 
-        button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
-        button_frame.grid(row=2, column=0, columnspan=2)
+        self._update_scrollregion()
+        self._update_status()
+        self.update_visible()
+
+    def reset_view(self, end_offset=None, highlight_index=None):
+        """読み込み済みのメッセージを破棄し、位置end_offsetより前のメッセージを表示し直す"""
+        for bubble in self.assigned.values():
+            self._release(bubble)
+        self.assigned = {}
+        self.entries, self.heights, self.tops = [], [], []
+        self.total_height = 0
+        self.next_offset = self.view_end = end_offset
+        self.has_more = True
+        self.highlight_index = highlight_index
+        self.load_more()
+
+    def show_latest(self):
+        self.reset_view()
+        self.canvas.yview_moveto(0)
+
+    def _update_status(self):
+        if not self.entries:
+            self.status_label.configure(text="No conversations yet.")
+        elif self.view_end is not None:
+            self.status_label.configure(text="Showing the search result. Press \"Latest\" to return to the newest messages.")
+        elif self.has_more:
+            self.status_label.configure(text=f"{len(self.entries)} messages loaded. Scroll down for older ones.")
+        else:
+            self.status_label.configure(text=f"All {len(self.entries)} messages loaded.")
 
-        self.prev_button = ctk.CTkButton(button_frame, text="< Previous", command=self.prev_page, state="disabled")
-        self.prev_button.pack(side="left", padx=10)
+    # --- 高さの計算 (描画を待たずにフォントの幅から求める) ---
 
-        self.next_button = ctk.CTkButton(button_frame, text="Next >", command=self.next_page, state="disabled")
-        self.next_button.pack(side="left", padx=10)
+    def _scaled(self, value):
+        return round(value * self.scaling)
 
-        self.load_and_display_logs()
+    def _refresh_layout_width(self):
+        canvas_width = self.canvas.winfo_width()
+        if canvas_width <= 1: # まだ表示されていない
+            canvas_width = self._scaled(600)
+        self.layout_width = canvas_width
 
-    def load_and_display_logs(self):
-        """JSONから全てのログを読み込み、逆順にして最初のページを表示する"""
+    def _text_width(self):
+        """バブル内のテキストの折り返し幅 (px)"""
+        # バブルは幅の4/5、その中の左右の余白とテキストボックスの枠を除く
+        return max(50, int(self._bubble_width() - self._scaled(2 * 10 + 2 * 3 + 8)))
+
+    def _bubble_width(self):
+        return (self.layout_width - self._scaled(20)) * 4 / 5
+
+    def _measure_word(self, word):
+        width = self._word_widths.get(word)
+        if width is None:
+            width = self._word_widths[word] = self.measure_font.measure(word)
+        return width
+
+    def _count_lines(self, text, width):
+        """wrap="word" で折り返したときの行数を見積もる"""
+        space_width = self._measure_word(" ")
+        count = 0
+        for paragraph in text.split("\n"):
+            count += 1
+            line_width = 0
+            for word in paragraph.split(" "):
+                word_width = self._measure_word(word)
+                if line_width and line_width + space_width + word_width > width:
+                    count += 1
+                    line_width = 0
+                if line_width:
+                    line_width += space_width
+                line_width += word_width
+                # 空白のない長い文 (日本語など) は文字の途中で折り返される
+                while line_width > width:
+                    count += 1
+                    line_width -= width
+        return count
+
+    def _text_height(self, entry, width):
+        """本文が全部見える高さ (上限は設けない。ホイールはログ全体のスクロールに使うため、バブルの中はスクロールできない)"""
+        num_lines = self._count_lines(entry.get("content", ""), width)
+        height = num_lines * self.line_height + self._scaled(2 * 3 + 4)
+        return max(self._scaled(self.MIN_TEXT_HEIGHT), height)
+
+    def _bubble_height(self, entry, width):
+        height = self._text_height(entry, width) + self._scaled(self.TEXT_PADDING)
+        if self._format_time(entry.get("timestamp")):
+            height += self._scaled(self.TIME_HEIGHT)
+        return height
+
+    @staticmethod
+    def _format_time(timestamp_str):
+        if not timestamp_str:
+            return None
         try:
-            with open(CHAT_LOG_FILE, "r", encoding="utf-8") as f:
-                self.all_logs = json.load(f)
-                self.all_logs.reverse()
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.all_logs = []
-        
-        self.display_page()
-
-    def display_page(self):
-        """現在のページのログを表示する"""
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-        self.bubble_widgets = []
-
-        start_index = self.current_page * self.logs_per_page
-        end_index = start_index + self.logs_per_page
-        logs_to_display = self.all_logs[start_index:end_index]
-
-        for log_entry in logs_to_display:
-            self.add_chat_bubble(log_entry)
-        
-        self.update_pagination_controls()
-
-    def add_chat_bubble(self, message_data: dict):
-        """スクロールフレームにチャットバブルを追加する"""
-        role = message_data.get("role", "unknown")
-        content = message_data.get("content", "")
-        timestamp_str = message_data.get("timestamp")
+            return datetime.fromisoformat(timestamp_str).strftime("%Y-%m-%d %H:%M")
+        except (ValueError, TypeError):
+            return None
+
+    def _on_canvas_configure(self, event):
+        """幅が変わったら、少し待ってから全バブルの高さを計算し直す"""
+        if event.width == self.layout_width:
+            self.update_visible()
+            return
+        if self._resize_job:
+            self.after_cancel(self._resize_job)
+        self._resize_job = self.after(150, self.relayout)
+
+    def relayout(self):
+        self._resize_job = None
+        self._refresh_layout_width()
+        width = self._text_width()
+        self.total_height = 0
+        for index, entry in enumerate(self.entries):
+            self.heights[index] = self._bubble_height(entry, width)
+            self.tops[index] = self.total_height
+            self.total_height += self.heights[index] + self._scaled(self.BUBBLE_GAP)
+        # 位置と大きさが変わったので、表示中のバブルを全て配置し直す
+        for bubble in self.assigned.values():
+            self._release(bubble)
+        self.assigned = {}
+        self._update_scrollregion()
+        self.update_visible()
+
+    def _update_scrollregion(self):
+        self.canvas.configure(scrollregion=(0, 0, self.layout_width, max(self.total_height, 1)))
+
+    # --- 表示中のバブルの割り当て ---
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.update_visible()
+        # 下端に近づいたら続きを読み込む (画面が埋まるまで繰り返される)
+        view_bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        if self.has_more and not self._load_pending and view_bottom >= self.total_height - self._scaled(self.LOAD_MORE_MARGIN):
+            self._load_pending = True
+            self.after_idle(self.load_more)
+
+    def update_visible(self):
+        """画面に見えているメッセージにだけバブルを割り当てる"""
+        view_top = self.canvas.canvasy(0)
+        view_bottom = view_top + max(self.canvas.winfo_height(), 1)
+        first = max(0, bisect_right(self.tops, view_top) - 1)
+        last = bisect_left(self.tops, view_bottom)
+        visible = range(first, min(last, len(self.entries)))
+
+        for index in list(self.assigned):
+            if index not in visible:
+                self._release(self.assigned.pop(index))
+        for index in visible:
+            if index not in self.assigned:
+                bubble = self.pool.pop() if self.pool else _Bubble(self, self.canvas)
+                self._show(bubble, index)
+                self.assigned[index] = bubble
+
+    def _release(self, bubble):
+        self.canvas.itemconfigure(bubble.window_id, state="hidden")
+        self.pool.append(bubble)
+
+    def _show(self, bubble, index):
+        """バブルの内容をメッセージに合わせて書き換え、位置を決める"""
+        entry = self.entries[index]
         theme_colors = self.controller.theme_colors
-        
-        is_user = (role == "user")
-        bubble_container = ctk.CTkFrame(self.scrollable_frame, fg_color="transparent")
-        
+        is_user = (entry.get("role", "unknown") == "user")
+
         user_bubble_color = theme_colors.get("accent_color", "#4A90E2")
         pal_bubble_color = theme_colors.get("fg_color", "#3A3A3A")
-        
-        bubble_color = user_bubble_color if is_user else pal_bubble_color
-        
-        bubble = ctk.CTkFrame(bubble_container, fg_color=bubble_color, corner_radius=15)
-        
-        if timestamp_str:
-            try:
-                dt_object = datetime.fromisoformat(timestamp_str)
-                formatted_time = dt_object.strftime("%Y-%m-%d %H:%M")
-                time_label = ctk.CTkLabel(bubble, text=formatted_time, font=("Arial", 10), text_color=("#666666", "#AAAAAA"))
-                # ユーザーの発言か否かでタイムスタンプの表示位置を変える
-                anchor_side = "e" if is_user else "w"
-                time_label.pack(padx=10, pady=(5, 0), anchor=anchor_side)
-            except (ValueError, TypeError):
-                pass
+        bubble.frame.configure(fg_color=user_bubble_color if is_user else pal_bubble_color)
+        # 検索で一致したメッセージは枠線で目立たせる
+        if index == self.highlight_index:
+            bubble.frame.configure(border_width=2, border_color=theme_colors.get("text_color", "#E0E0E0"))
+        else:
+            bubble.frame.configure(border_width=0)
+
+        formatted_time = self._format_time(entry.get("timestamp"))
+        if formatted_time:
+            bubble.time_label.configure(text=formatted_time)
+            # ユーザーの発言か否かでタイムスタンプの表示位置を変える
+            bubble.time_label.pack(padx=10, pady=(5, 0), anchor="e" if is_user else "w", before=bubble.text_widget)
+        else:
+            bubble.time_label.pack_forget()
 
         text_color = "white" if is_user else theme_colors.get("text_color", "#E0E0E0")
-        
-        text_widget = ctk.CTkTextbox(
-            bubble,
-            wrap="word",
-            text_color=text_color,
-            fg_color="transparent",
-            corner_radius=0,
-            border_width=0,
-            font=ctk.CTkFont(size=14)
-        )
-        text_widget.insert("1.0", content)
-        text_widget.configure(state="disabled")
-
-        text_widget.update_idletasks()
-        num_lines = int(text_widget.index("end-1c").split('.')[0])
-        height = max(40, min(num_lines * 20, 400))
-        text_widget.configure(height=height)
-
-        text_widget.pack(padx=10, pady=5, fill="x", expand=True)
-
-        # 👈 変更点: レイアウトマネージャをpackからgridに変更し、バブルの幅と配置を制御
-        bubble_container.grid_rowconfigure(0, weight=1)
-        if is_user:
-            # ユーザー（右寄せ）
-            # 0列目（空きスペース）と1列目（バブル）の幅の比率を1:4に設定
-            bubble_container.grid_columnconfigure(0, weight=1)
-            bubble_container.grid_columnconfigure(1, weight=4)
-            # バブルを1列目に配置し、横幅いっぱい(ew)に広げる
-            bubble.grid(row=0, column=1, padx=10, pady=5, sticky="ew")
+        text_height = self.heights[index] - self._scaled(self.TEXT_PADDING)
+        if formatted_time:
+            text_height -= self._scaled(self.TIME_HEIGHT)
+        bubble.text_widget.configure(state="normal", text_color=text_color, height=text_height / self.scaling)
+        bubble.text_widget.delete("1.0", "end")
+        bubble.text_widget.insert("1.0", entry.get("content", ""))
+        bubble.text_widget.configure(state="disabled")
+
+        # ユーザーは右寄せ、アシスタントは左寄せ (幅は全体の4/5)
+        bubble_width = self._bubble_width()
+        x = self.layout_width - self._scaled(10) - bubble_width if is_user else self._scaled(10)
+        self.canvas.coords(bubble.window_id, x, self.tops[index])
+        self.canvas.itemconfigure(bubble.window_id, width=bubble_width, height=self.heights[index], state="normal")
+
+    # --- 検索 ---
+
+    def search(self):
+        query = self.search_entry.get().strip()
+        if not query:
+            return
+        semantic = self.semantic_var.get()
+        self.status_label.configure(text="Searching...")
+        threading.Thread(target=self._run_search, args=(query, semantic), daemon=True).start()
+
+    def _run_search(self, query, semantic):
+        """別スレッドで検索する (セマンティック検索は初回に埋め込みの計算が入るため)"""
+        start_time = time.perf_counter()
+        try:
+            results = self.controller.get_logic().search_history(query, semantic=semantic)
+        except Exception as e:
+            print(f"Error searching chat log: {e}")
+            self.after(0, lambda: self.status_label.configure(text="Search failed."))
+            return
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        print(f"Chat log search for '{query}' took {elapsed_ms:.1f} ms ({len(results)} results).")
+        self.after(0, self._show_results, results, elapsed_ms)
+
+    def _show_results(self, results, elapsed_ms):
+        for button in self.result_buttons:
+            button.destroy()
+        self.result_buttons = []
+
+        for result in results:
+            formatted_time = self._format_time(result.get("timestamp")) or ""
+            speaker = "You" if result["role"] == "user" else "Pal"
+            button = ctk.CTkButton(
+                self.results_frame, text=f"{formatted_time}  {speaker}: {result['snippet']}", anchor="w",
+                fg_color="transparent", text_color=self.controller.theme_colors.get("text_color", "#E0E0E0"),
+                command=lambda result=result: self.jump_to(result)
+            )
+            button.pack(fill="x")
+            self.result_buttons.append(button)
+
+        self.results_frame.grid()
+        self.status_label.configure(text=f"{len(results)} results ({elapsed_ms:.0f} ms)." if results else "No matching messages.")
+
+    def jump_to(self, result):
+        """検索結果のメッセージを含むページに移動する"""
+        message_end = result["offset"] + result["length"]
+        # 一致したメッセージより新しい会話も少し表示する
+        newer, page_end = self.chat_log.read_since(message_end, max_count=self.PAGE_SIZE // 2)
+        self.reset_view(page_end, highlight_index=len(newer))
+        if self.highlight_index < len(self.tops):
+            self.canvas.yview_moveto(self.tops[self.highlight_index] / max(self.total_height, 1))
+
+    # --- マウスホイール ---
+
+    def bind_mouse_wheel(self, widget):
+        if sys.platform.startswith("linux"):
+            widget.bind("<Button-4>", self._on_mouse_wheel, add="+")
+            widget.bind("<Button-5>", self._on_mouse_wheel, add="+")
         else:
-            # アシスタント（左寄せ）
-            # 0列目（バブル）と1列目（空きスペース）の幅の比率を4:1に設定
-            bubble_container.grid_columnconfigure(0, weight=4)
-            bubble_container.grid_columnconfigure(1, weight=1)
-            # バブルを0列目に配置し、横幅いっぱい(ew)に広げる
-            bubble.grid(row=0, column=0, padx=10, pady=5, sticky="ew")
-        
-        bubble_container.pack(fill="x", pady=(0, 5))
-
-
-    def on_frame_configure(self, event=None):
-        """フレームのサイズが変更された際に呼び出される（現在は未使用）"""
-        pass
-
-    def update_pagination_controls(self):
-        """ページネーションボタンの状態とラベルを更新する"""
-        total_pages = (len(self.all_logs) + self.logs_per_page - 1) // self.logs_per_page
-        if total_pages == 0: total_pages = 1
-        self.page_label.configure(text=f"Page {self.current_page + 1} / {total_pages}")
-
-        self.prev_button.configure(state="normal" if self.current_page > 0 else "disabled")
-        self.next_button.configure(state="normal" if (self.current_page + 1) < total_pages else "disabled")
-
-    def prev_page(self):
-        if self.current_page > 0:
-            self.current_page -= 1
-            self.display_page()
-
-    def next_page(self):
-        total_pages = (len(self.all_logs) + self.logs_per_page - 1) // self.logs_per_page
-        if (self.current_page + 1) < total_pages:
-            self.current_page += 1
-            self.display_page()
\ No newline at end of file
+            widget.bind("<MouseWheel>", self._on_mouse_wheel, add="+")
+
+    def _on_mouse_wheel(self, event):
+        if getattr(event, "num", None) in (4, 5):
+            self.canvas.yview_scroll(-1 if event.num == 4 else 1, "units")
+        elif event.delta:
+            self.canvas.yview_scroll(-1 if event.delta > 0 else 1, "units")
+        return "break"
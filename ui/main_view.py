@@ -3,7 +3,7 @@ import customtkinter as ctk
 from i18n import t
 from PIL import Image
 from tkinterdnd2 import DND_FILES
-import threading
+import queue
 import os
 import json
 from datetime import datetime
@@ -15,11 +15,16 @@ from .settings_view import SettingsWindow
 from .help_view import HelpWindow
 from .status_view import StatusWindow 
 from PIL import Image, ImageTk
-import pygame
 from core.utils import resource_path
+from core.chat_log import get_chat_log
+from core.jobs import get_job_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, GROUP_LLM, GROUP_LEARNING
+from core.tracing import get_tracer
+from .frame_cache import get_frame_cache
 
 
-CHAT_LOG_FILE = "chat_log.json"
+STREAM_POLL_INTERVAL_MS = 50 # ストリーミング中のトークンキューを確認する間隔
+TYPING_FRAME_INTERVAL_MS = 33 # 文字送りの描画間隔 (約30fps)
+DEFAULT_TYPING_SPEED = 60 # 文字送りの速度 (文字/秒)
 
 
 # main_view.py の上部 (import文の後あたり) にこのクラスを追加します
@@ -28,29 +33,40 @@ from PIL import Image, ImageTk
 class AnimatedGifLabel(ctk.CTkLabel):
     """
     アニメーションGIFを再生するためのカスタムラベルクラス
+    フレームは初めて再生するときに、共有のフレームキャッシュからワーカースレッドで読み込む。
     """
     def __init__(self, master, path, size=(180, 180)):
         super().__init__(master, text="")
+        if not os.path.exists(path):
+            raise FileNotFoundError(2, "No such file", path)
         self.path = path
         self.size = size
-        self.frames = []
-        self.delays = []
-        self._load_gif()
+        self.frames = None
+        self.delays = None
         self.frame_index = 0
         self.animation_id = None
+        self._loading = False
+        self._playing = False
 
     def _load_gif(self):
-        """GIFを読み込み、フレームと遅延時間をリストに格納する"""
-        with Image.open(self.path) as im:
-            try:
-                while True:
-                    # CTkImageオブジェクトに変換してリストに追加
-                    frame_image = ctk.CTkImage(im.copy().resize(self.size), size=self.size)
-                    self.frames.append(frame_image)
-                    self.delays.append(im.info.get('duration', 100)) # durationがなければ100ms
-                    im.seek(len(self.frames))
-            except EOFError:
-                pass # フレームの終端
+        """フレームの読み込みを開始する (終わったら_on_frames_loadedが呼ばれる)"""
+        if self.frames is not None or self._loading:
+            return
+        self._loading = True
+        future = get_frame_cache().load(self.path, self.size)
+        future.add_done_callback(lambda f: self.after(0, self._on_frames_loaded, f))
+
+    def _on_frames_loaded(self, future):
+        self._loading = False
+        try:
+            frames, delays = future.result()
+            self.frames, self.delays = get_frame_cache().get_images(self.path, self.size, frames, delays)
+        except Exception as e:
+            print(f"Error loading animation '{self.path}': {e}")
+            return
+        # 読み込み中にこの状態が終わっていなければ再生する
+        if self._playing and self.animation_id is None and self.frames:
+            self._animate()
 
     def _animate(self):
         """フレームを更新し、次の更新を予約する"""
@@ -71,11 +87,15 @@ class AnimatedGifLabel(ctk.CTkLabel):
 
     def start(self):
         """アニメーションを開始する"""
-        if self.animation_id is None:
+        self._playing = True
+        if self.frames is None:
+            self._load_gif()
+        elif self.animation_id is None and self.frames:
             self._animate()
 
     def stop(self):
         """アニメーションを停止する"""
+        self._playing = False
         if self.animation_id:
             self.after_cancel(self.animation_id)
             self.animation_id = None
@@ -95,15 +115,27 @@ class MainView(ctk.CTkFrame):
         self.status_window = None
         self.active_animation_id = None
         self.learning_start_time = None # ★ 学習開始時刻を保持する変数を追加
+        self.learning_message = "" # 学習中に表示しているメッセージ
         self.current_state = None
 
         # ▼▼▼【ここを追加】▼▼▼
         self.stream_animation_id = None # ストリーミングアニメーションのID
+        self.stream_queue = None # ワーカースレッドから届くトークンのキュー
+        self.stream_tokens = []
+        self.stream_poll_id = None # キュー監視用のafter ID
+        self.stream_started = False # 最初のトークンを表示済みかどうか
+        self.question_start_time = None # 質問送信時刻 (最初のトークンまでの時間計測用)
+        self.question_job = None # 回答を生成中 (または待機中) のジョブ
+        self.question_trace = None # 回答中の質問のトレース (UIの描画時間もここに記録する)
+        self.render_seconds = 0.0 # 回答欄への描画にかかった時間の合計
+        self.render_frames = 0
+        self.first_token_ms = None
         # ▲▲▲【追加はここまで】▲▲▲
 
         # ▼▼▼【ここから追加】▼▼▼
         self.typing_sound = None
         try:
+            import pygame # 起動を速くするため、ここで初めてimportする
             pygame.mixer.init()
             # 用意したサウンドファイルのパスを指定
             # sound_path = "assets/sounds/typing3.mp3" 
@@ -196,6 +228,12 @@ class MainView(ctk.CTkFrame):
                                         )
         self.chat_entry.grid(row=0, column=0, sticky="ew", padx=20, pady=(10,0))
         self.chat_entry.bind("<Return>", self.send_question)
+        self.chat_entry.bind("<Escape>", self.stop_answer)
+        # 回答の生成中だけ表示する停止ボタン
+        self.stop_button = ctk.CTkButton(self.control_frame, text=t("stop_button"), font=self.app_font, width=60,
+                                         corner_radius=0, command=self.stop_answer)
+        self.stop_button.grid(row=0, column=1, padx=(0, 20), pady=(10,0))
+        self.stop_button.grid_remove()
         icon_frame = ctk.CTkFrame(self.control_frame, fg_color="transparent")
         icon_frame.grid(row=1, column=0, pady=10)
         try:
@@ -313,6 +351,7 @@ class MainView(ctk.CTkFrame):
         self.answer_textbox.delete("1.0", "end")
         self.answer_textbox.insert("1.0", random.choice(learning_messages))
         self.answer_textbox.configure(state="disabled")
+        self.learning_message = self.answer_textbox.get("1.0", "end-1c")
         # self.answer_textbox.grid(row=0, column=0, sticky="nsew", padx=20, pady=(10, 0))
         self.answer_textbox.grid(row=0, column=0, sticky="ew", padx=20, pady=(10, 0))
 
@@ -322,14 +361,45 @@ class MainView(ctk.CTkFrame):
         self.chat_entry.configure(state="normal", placeholder_text=t("chat_hint"))
         # ▲▲▲【追加はここまで】▲▲▲
 
-        file_path = filepaths[0]
         self.set_pal_state("learning")
         
-        thread = threading.Thread(target=self.run_learning, args=(file_path,))
-        thread.start()
+        # ドロップされた全てのファイル/フォルダをまとめて学習する
+        # (学習中に別のファイルがドロップされた場合は、前の学習が終わってから始まる)
+        get_job_scheduler().submit(self.run_learning, list(filepaths),
+                                   priority=PRIORITY_BACKGROUND, group=GROUP_LEARNING, name="learn documents",
+                                   on_done=lambda job: self.after(0, self._on_learning_job_done, job))
+
+    def _show_learning_progress(self, progress):
+        """学習の進捗 (処理済みファイル数・埋め込み済みチャンク数・速度) を表示する"""
+        if self.current_state != "learning":
+            return
+        self.answer_textbox.configure(state="normal")
+        self.answer_textbox.delete("1.0", "end")
+        self.answer_textbox.insert("1.0",
+            f"{self.learning_message}\n"
+            f"Files: {progress['files_done']}/{progress['files_total']}  "
+            f"Chunks: {progress['chunks_embedded']:,} ({progress['chunks_per_sec']:.1f}/s)")
+        self.answer_textbox.configure(state="disabled")
+
 
+    def _on_learning_job_done(self, job):
+        """学習のジョブの終了時の処理。失敗した場合や、始まる前に取り消された場合も学習中の表示を終える。"""
+        if job.state == "failed":
+            self.on_learning_failed(job.error)
+        elif job.result is None:
+            self.set_pal_state("idle")
+        else:
+            self.on_learning_complete(*job.result)
 
-    def on_learning_complete(self, filename):
+    def on_learning_failed(self, error):
+        self.answer_textbox.configure(state="normal")
+        self.answer_textbox.delete("1.0", "end")
+        self.answer_textbox.insert("1.0", f"Sorry, I couldn't finish learning.\n{error}")
+        self.answer_textbox.configure(state="disabled")
+        self.answer_textbox.grid(row=0, column=0, sticky="nsew", padx=20, pady=(10, 0))
+        self.set_pal_state("idle")
+
+    def on_learning_complete(self, filename, result=None):
         # ▼▼▼ 修正点: 経過時間を計算し、遅延処理を行う ▼▼▼
         elapsed_time = time.time() - self.learning_start_time
         min_duration = 2.0  # 最低でも2秒間表示する
@@ -337,16 +407,26 @@ class MainView(ctk.CTkFrame):
         if elapsed_time < min_duration:
             delay_ms = int((min_duration - elapsed_time) * 1000)
             # 足りない時間分、待ってから完了表示を出す
-            self.after(delay_ms, self._show_learning_complete_ui, filename)
+            self.after(delay_ms, self._show_learning_complete_ui, filename, result)
         else:
             # 2秒以上かかっていたら、すぐに完了表示を出す
-            self._show_learning_complete_ui(filename)
+            self._show_learning_complete_ui(filename, result)
 
-    def _show_learning_complete_ui(self, filename):
+    def _show_learning_complete_ui(self, filename, result=None):
         """学習完了のUI更新を行う実際のメソッド"""
+        message = f"Learning completed！\nI learned the data that '{filename}' gave me."
+        if result:
+            if result["files"] and result["skipped_files"] == result["files"]:
+                message = f"I already know everything in '{filename}'!"
+            elif result.get("cancelled"):
+                message = f"I stopped reading '{filename}' partway through."
+            # スキップ・埋め込み・削除の件数を表示する
+            message += (f"\nSkipped {result['skipped_files']} unchanged file(s), "
+                        f"embedded {result['chunks']:,} new chunk(s), "
+                        f"removed {result['deleted']:,} stale chunk(s).")
         self.answer_textbox.configure(state="normal")
         self.answer_textbox.delete("1.0", "end")
-        self.answer_textbox.insert("1.0", f"Learning completed！\nI learned the data that '{filename}' gave me.")
+        self.answer_textbox.insert("1.0", message)
         self.answer_textbox.configure(state="disabled")
         self.answer_textbox.grid(row=0, column=0, sticky="nsew", padx=20, pady=(10, 0))
         self.set_pal_state("idle")
@@ -388,12 +468,168 @@ class MainView(ctk.CTkFrame):
         query = self.chat_entry.get()
         if not query: return
         self.answer_textbox.grid_remove() 
+        # 回答の生成中も入力欄は使えるままにし、新しい質問を送ると前の回答は打ち切られる
         self.chat_entry.delete(0, 'end')
-        self.chat_entry.configure(state="disabled", placeholder_text="Thinking...")
+        self.stop_button.grid()
         self.set_pal_state("thinking") 
-        self.current_user_message = { "role": "user", "content": query, "timestamp": datetime.now().isoformat(), "learned": False }
-        thread = threading.Thread(target=self.run_chatting, args=(query,))
-        thread.start()
+
+        # 前の質問は、待機中なら取り消し、生成中ならトークンの合間で打ち切る
+        if self.question_job is not None and not self.question_job.done():
+            self.question_job.cancel()
+        if self.question_trace is not None:
+            self.question_trace.set(superseded=True)
+            self.question_trace.finish()
+        self._flush_interrupted_exchange()
+        self.current_user_message = { "role": "user", "content": query, "timestamp": datetime.now().isoformat() }
+
+        # ワーカースレッドが生成したトークンをキュー経由で受け取り、Tkのループでまとめて描画する
+        # 質問は学習より優先して実行される
+        self.stream_queue = queue.Queue()
+        self.stream_started = False
+        self.stream_tokens = [] # 描画済みのトークン (打ち切られたときに回答としてログに残す)
+        self.question_start_time = time.time()
+        self.question_trace = get_tracer().start("answer")
+        self.render_seconds = 0.0
+        self.render_frames = 0
+        self.first_token_ms = None
+        stream_queue = self.stream_queue
+        # 完了の通知はジョブの終了時に送る (実行前に取り消された場合も届く)
+        self.question_job = get_job_scheduler().submit(self.run_chatting, query, stream_queue, self.question_trace,
+                                                       priority=PRIORITY_INTERACTIVE, group=GROUP_LLM, name="answer",
+                                                       on_done=lambda job: stream_queue.put(("done", self._job_answer(job))))
+        self.stream_poll_id = self.after(STREAM_POLL_INTERVAL_MS, self._poll_stream_queue, self.stream_queue)
+
+    @staticmethod
+    def _job_answer(job):
+        """回答のジョブの結果。失敗した場合はNone、最初のトークンより前に取り消された場合は空文字列。"""
+        if job.state == "failed":
+            return None
+        return job.result or ""
+
+    def _flush_interrupted_exchange(self):
+        """回答の途中で次の質問が送られた場合に、前の質問とそこまでの回答を会話ログに残す"""
+        stream_queue = self.stream_queue
+        if stream_queue is None or self.current_user_message is None:
+            return
+        answer = "".join(self.stream_tokens)
+        # まだ描画していないトークンも回答に含める
+        try:
+            while True:
+                kind, payload = stream_queue.get_nowait()
+                if kind == "token":
+                    answer += payload
+                else:
+                    answer = payload if payload is not None else ""
+                    break
+        except queue.Empty:
+            pass
+        self.stream_queue = None
+        self._append_answer_to_log(answer)
+
+    def stop_answer(self, event=None):
+        """生成中の回答を打ち切る。それまでに表示された分は回答として残る。"""
+        if self.question_job is not None and not self.question_job.done():
+            print("Stopping the answer...")
+            self.question_job.cancel()
+
+    def _poll_stream_queue(self, stream_queue):
+        """[メイン処理] キューに溜まったトークンをまとめて取り出し、回答欄に追記する"""
+        if stream_queue is not self.stream_queue:
+            return # 古い質問のストリームは無視する
+
+        tokens = []
+        done = False
+        final_answer = None
+        try:
+            while True:
+                kind, payload = stream_queue.get_nowait()
+                if kind == "token":
+                    tokens.append(payload)
+                else:
+                    done = True
+                    final_answer = payload
+                    break
+        except queue.Empty:
+            pass
+
+        if tokens:
+            render_start = time.perf_counter()
+            if not self.stream_started:
+                self._begin_stream_ui()
+            self.answer_textbox.insert("end", "".join(tokens))
+            self.answer_textbox.see("end")
+            self.stream_tokens.extend(tokens)
+            self.render_seconds += time.perf_counter() - render_start
+            self.render_frames += 1
+
+        if done:
+            self.on_stream_complete(final_answer)
+            return
+
+        self.stream_poll_id = self.after(STREAM_POLL_INTERVAL_MS, self._poll_stream_queue, stream_queue)
+
+    def _begin_stream_ui(self):
+        """最初のトークンが届いた時点で、回答欄を表示してtalking状態にする"""
+        self.stream_started = True
+        if self.question_start_time:
+            self.first_token_ms = (time.time() - self.question_start_time) * 1000
+            print(f"Time to first token: {self.first_token_ms / 1000:.2f}s")
+        self.set_pal_state("talking")
+        self.answer_textbox.configure(state="normal")
+        self.answer_textbox.delete("1.0", "end")
+        self.answer_textbox.grid(row=0, column=0, sticky="nsew", padx=20, pady=(10, 0))
+
+    def on_stream_complete(self, answer):
+        """
+        ストリーミング完了時の処理。停止ボタンを隠し、会話ログを保存する。
+        answer がNoneならジョブが失敗したので、エラーを表示するだけで回答はログに残さない。
+        """
+        self.stream_queue = None
+        self.stream_poll_id = None
+        self.stop_button.grid_remove()
+        if answer is None:
+            self.answer_textbox.configure(state="normal")
+            if self.stream_started:
+                self.answer_textbox.insert("end", "\n\n")
+            else:
+                self.answer_textbox.delete("1.0", "end")
+                self.answer_textbox.grid(row=0, column=0, sticky="nsew", padx=20, pady=(10, 0))
+            self.answer_textbox.insert("end", "Sorry, an error occurred while generating the answer.")
+            self.answer_textbox.configure(state="disabled")
+            self.set_pal_state("idle")
+            self._append_answer_to_log(None)
+            if self.question_trace is not None:
+                self.question_trace.set(error=True)
+            self._finish_question_trace(stopped=False)
+            return
+        if not answer and self.question_job is not None and self.question_job.cancelled:
+            # 最初のトークンより前に止めた場合は、質問だけをログに残す
+            self.set_pal_state("idle")
+            self._append_answer_to_log(None)
+            self._finish_question_trace(stopped=True)
+            return
+        render_start = time.perf_counter()
+        if not self.stream_started:
+            self._begin_stream_ui()
+            self.answer_textbox.insert("end", answer)
+        self.answer_textbox.configure(state="disabled")
+        self.render_seconds += time.perf_counter() - render_start
+        self.render_frames += 1
+        self.set_pal_state("idle")
+        self._append_answer_to_log(answer)
+        self._finish_question_trace(stopped=self.question_job is not None and self.question_job.cancelled)
+
+    def _finish_question_trace(self, stopped: bool):
+        """回答欄への描画時間をトレースに加えて書き出す"""
+        trace = self.question_trace
+        if trace is None:
+            return
+        self.question_trace = None
+        trace.add_span("ui_render", self.render_seconds * 1000, frames=self.render_frames,
+                       first_token_ms=round(self.first_token_ms, 1) if self.first_token_ms is not None else None)
+        if stopped:
+            trace.set(stopped=True)
+        trace.finish()
 
     def on_chat_complete(self, answer):
         self.chat_entry.configure(state="normal", placeholder_text=t("chat_hint"))
@@ -402,12 +638,19 @@ class MainView(ctk.CTkFrame):
         self.answer_textbox.delete("1.0", "end")
         self.answer_textbox.grid(row=0, column=0, sticky="nsew", padx=20, pady=(10, 0))
         self.stream_and_animate(answer)
-        assistant_message = { "role": "assistant", "content": answer, "timestamp": datetime.now().isoformat(), "learned": False }
-        log = self._load_chat_log()
-        if self.current_user_message: log.append(self.current_user_message); self.current_user_message = None
-        log.append(assistant_message)
-        self._save_chat_log(log)
-        print(f"'{CHAT_LOG_FILE}' has been updated.")
+        self._append_answer_to_log(answer)
+
+    def _append_answer_to_log(self, answer):
+        """ユーザーの質問とアシスタントの回答を会話ログに追記する (回答が空なら質問だけを残す)"""
+        new_messages = []
+        if self.current_user_message: new_messages.append(self.current_user_message); self.current_user_message = None
+        if answer:
+            new_messages.append({ "role": "assistant", "content": answer, "timestamp": datetime.now().isoformat() })
+        if not new_messages:
+            return
+        chat_log = get_chat_log()
+        chat_log.append(new_messages)
+        print(f"'{chat_log.path}' has been updated.")
 
 
     # ▼▼▼【このメソッドを丸ごと追加】▼▼▼
@@ -435,53 +678,52 @@ class MainView(ctk.CTkFrame):
 
 
 
-    def stream_and_animate(self, text, index=0):
+    def stream_and_animate(self, text):
+        """
+        回答を設定された速度 (文字/秒) で表示する。
+        1文字ずつではなく、一定の間隔で前回から表示すべき文字をまとめて挿入する。
+        """
         # talking状態を開始
-        if index == 0:
-            self.set_pal_state("talking")
-            # ▼▼▼【ここを追加】▼▼▼
-            self.full_answer_text = text # アニメーション開始時に全文を保持
-            # ▲▲▲【追加はここまで】▲▲▲
-
-        if index >= len(text):
+        self.set_pal_state("talking")
+        self.full_answer_text = text # スキップ用に全文を保持
+        try:
+            self.typing_chars_per_sec = max(1.0, float(self.controller.get_config().get("typing_speed", DEFAULT_TYPING_SPEED)))
+        except (TypeError, ValueError):
+            self.typing_chars_per_sec = DEFAULT_TYPING_SPEED
+        self.typing_start_time = time.perf_counter()
+        self.typing_index = 0
+        self._type_next_frame()
+
+    def _type_next_frame(self):
+        """経過時間から表示すべき文字数を求め、まだ表示していない分を挿入する"""
+        text = self.full_answer_text
+        elapsed = time.perf_counter() - self.typing_start_time
+        # 最初の1文字はすぐに表示する
+        due = min(len(text), int(elapsed * self.typing_chars_per_sec) + 1)
+        if due > self.typing_index:
+            self.answer_textbox.insert("end", text[self.typing_index:due])
+            self.answer_textbox.see("end")
+            self.typing_index = due
+
+        if self.typing_index >= len(text):
+            self.stream_animation_id = None
             self.set_pal_state("idle") # 会話が終わったら待機状態に戻す
-            # ▼▼▼【ここを追加】▼▼▼
             self.full_answer_text = None # 正常終了時もクリア
-            # ▲▲▲【追加はここまで】▲▲▲
             return
 
-        self.answer_textbox.insert("end", text[index])
-        self.answer_textbox.see("end")
-
-        # ▼▼▼【ここを追加】▼▼▼
-        # 効果音を再生
-        # if self.typing_sound:
-        #     self.typing_sound.play()
-        # ▲▲▲【追加はここまで】▲▲▲
-
-        typing_speed_ms = 30
-        
-        # afterのID管理が不要になる
-        # self.after(typing_speed_ms, self.stream_and_animate, text, index + 1)
-        # ▼▼▼【ここを変更】▼▼▼
-        # afterのIDをインスタンス変数に保存する
-        self.stream_animation_id = self.after(typing_speed_ms, self.stream_and_animate, text, index + 1)
-        # ▲▲▲【変更はここまで】▲▲▲
-
-        
-    def _load_chat_log(self):
-        try:
-            with open(CHAT_LOG_FILE, "r", encoding="utf-8") as f: return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError): return []
-
-    def _save_chat_log(self, log_data):
-        with open(CHAT_LOG_FILE, "w", encoding="utf-8") as f: json.dump(log_data, f, indent=2, ensure_ascii=False)
-
-    def run_chatting(self, query):
-        log = self._load_chat_log()
-        history = log[-6:] if len(log) > 6 else log
-        answer = self.controller.logic.ask_question(query, history, self.controller.get_config())
-        self.after(0, self.on_chat_complete, answer)
+        # afterのIDを保存し、スキップ時にキャンセルできるようにする
+        self.stream_animation_id = self.after(TYPING_FRAME_INTERVAL_MS, self._type_next_frame)
+
+    def run_chatting(self, job, query, stream_queue, trace):
+        """[ジョブ] 回答をトークン単位で生成してキューに流し込み、回答全体を返す"""
+        # 履歴はPalLogicがログ末尾と古い会話の要約から、トークン数の上限に収まる分だけ作る
+        # ジョブがキャンセルされると、PalLogicはトークンの合間で生成を打ち切る
+        chunks = []
+        for token in self.controller.get_logic().ask_question_stream(query, None, self.controller.get_config(),
+                                                                     should_stop=lambda: job.cancelled, trace=trace):
+            chunks.append(token)
+            stream_queue.put(("token", token))
+        return "".join(chunks)
     
     def _setup_dnd(self):
 
@@ -491,9 +733,19 @@ class MainView(ctk.CTkFrame):
                 anim_label.drop_target_register(DND_FILES)
                 anim_label.dnd_bind('<<Drop>>', self.on_drop)
 
-    def run_learning(self, file_path):
-        self.controller.logic.learn_from_document(file_path)
-        self.after(0, self.on_learning_complete, os.path.basename(file_path))
+    def run_learning(self, job, paths):
+        """[ジョブ] ドキュメントを学習し、進捗をUIに渡す。(表示名, 結果) を返す。"""
+        def on_progress(progress):
+            self.after(0, self._show_learning_progress, progress)
+
+        result = self.controller.get_logic().learn_from_documents(
+            paths, progress_callback=on_progress, config=self.controller.get_config(),
+            should_stop=lambda: job.cancelled)
+        if len(paths) == 1 and result["files"] <= 1:
+            name = os.path.basename(paths[0])
+        else:
+            name = f"{result['files']} files"
+        return name, result
 
     def open_log_window(self):
         if self.log_window is None or not self.log_window.winfo_exists(): self.log_window = LogWindow(self, self.controller); self.log_window.grab_set()
@@ -503,8 +755,14 @@ class MainView(ctk.CTkFrame):
         print("Starting to learn from chat history...")
         self.answer_textbox.grid_remove() 
         self.set_pal_state("learning")
-        thread = threading.Thread(target=self.controller.logic.learn_from_history)
-        thread.start()
+        get_job_scheduler().submit(
+            lambda job: self.controller.get_logic().learn_from_history(self.controller.get_config()),
+            priority=PRIORITY_BACKGROUND, group=GROUP_LEARNING, name="learn history",
+            on_done=lambda job: self.after(0, self._on_history_learning_complete))
+
+    def _on_history_learning_complete(self):
+        if self.current_state == "learning":
+            self.set_pal_state("idle")
 
     def open_help_window(self):
         if self.help_window is None or not self.help_window.winfo_exists(): self.help_window = HelpWindow(self); self.help_window.grab_set()
@@ -117,7 +117,9 @@ class SettingsWindow(ctk.CTkToplevel):
     def save_and_close(self):
         old_config = self.controller.get_config()
         
-        new_config = {
+        # 設定画面にない項目 (キャッシュ設定など) は既存の値を引き継ぐ
+        new_config = dict(self.config)
+        new_config.update({
             "user_name": self.user_name_entry.get(),
             "ai_name": self.ai_name_entry.get(),
             # "ai_tone": self.ai_tone_menu.get(),
@@ -129,7 +131,7 @@ class SettingsWindow(ctk.CTkToplevel):
             "proactive_chat": self.proactive_switch.get(),
             "width": self.config.get("width"),
             "height": self.config.get("height")
-        }
+        })
 
         self.controller.save_config(new_config)
 
@@ -1,18 +1,25 @@
 # ui/status_view.py
 import customtkinter as ctk
 from PIL import Image
-import numpy as np
-from wordcloud import WordCloud
 import io
+import os
+import json
+import hashlib
 import threading
 import random
 from core.utils import resource_path
+from core.tracing import get_tracer
+
+WORDCLOUD_MASK = "assets/brain_mask.png"
+WORDCLOUD_SIZE = 520
+WORDCLOUD_CACHE_DIR = "./pal_wordcloud_cache"
+WORDCLOUD_CACHE_KEEP = 4 # テーマ切り替え用に、最近の画像をいくつか残しておく
 
 class StatusWindow(ctk.CTkToplevel):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
-        self.geometry("640x720") # Choose a good default size
+        self.geometry("980x720") # Choose a good default size (右側に応答時間の表を表示する)
         self.resizable(True, True)
         self.title("Pal's Status")
 
@@ -43,6 +50,14 @@ class StatusWindow(ctk.CTkToplevel):
         self.word_count_label = self._create_stat_row(stats_frame, 1, "Total Knowledge:")
         self.last_learned_label = self._create_stat_row(stats_frame, 2, "Last Study Session:")
         self.db_size_label = self._create_stat_row(stats_frame, 3, "Memory Size:")
+        self.embed_cache_label = self._create_stat_row(stats_frame, 4, "Embedding Cache:")
+        self.cutoff_label = self._create_stat_row(stats_frame, 5, "Answers Cut Off:")
+
+        # --- 応答時間・学習時間の表示エリア (最近の質問と学習の、段階ごとのp50/p95) ---
+        self.trace_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        self.trace_frame.grid(row=0, column=1, rowspan=2, sticky="n", padx=(20, 0))
+        self.answer_trace_table = self._create_trace_table(0, "Response Times")
+        self.ingest_trace_table = self._create_trace_table(1, "Learning Times")
 
         # 閉じるボタン
         # close_button = ctk.CTkButton(self.main_frame, text="Close", command=self.destroy, fg_color="#555555", hover_color="#666666")
@@ -61,19 +76,72 @@ class StatusWindow(ctk.CTkToplevel):
         value_label.grid(row=row, column=1, sticky="e", pady=2, padx=5)
         return value_label
 
+    def _create_trace_table(self, row, title):
+        """段階ごとのp50/p95の表を作成するヘルパー関数"""
+        frame = ctk.CTkFrame(self.trace_frame, fg_color="transparent")
+        frame.grid(row=row, column=0, sticky="nw", pady=(0, 16))
+        title_label = ctk.CTkLabel(frame, text=title, anchor="w")
+        title_label.grid(row=0, column=0, columnspan=3, sticky="w", pady=(0, 6), padx=5)
+        for column, text in enumerate(("Stage", "p50", "p95")):
+            ctk.CTkLabel(frame, text=text, anchor="w" if column == 0 else "e").grid(
+                row=1, column=column, sticky="w" if column == 0 else "e", pady=2, padx=5)
+        return {"frame": frame, "title_label": title_label, "rows": []}
+
     def load_and_display_stats(self):
         """非同期で統計情報を取得し、UIを更新する"""
         try:
-            stats = self.controller.logic.get_learning_stats()
+            logic = self.controller.get_logic()
+            stats = logic.get_learning_stats()
             
             # メインスレッドでUIを更新
             self.after(0, self.update_ui, stats)
+            tracer = get_tracer()
+            self.after(0, self.update_trace_ui, self.answer_trace_table, tracer.summary("answer"),
+                       "Response Times", "answers")
+            self.after(0, self.update_trace_ui, self.ingest_trace_table, tracer.summary("ingest"),
+                       "Learning Times", "learning runs")
+
+            # ワードクラウドも描画までこのスレッドで行い、UIスレッドでは画像を表示するだけにする
+            # (知識が空の場合は update_ui が案内を表示する)
+            if stats["doc_count"] > 0:
+                version, frequencies = logic.get_wordcloud_frequencies()
+                if not frequencies:
+                    # WordCloudは単語が1つもないとValueErrorになる
+                    self.after(0, lambda: self.wordcloud_label.configure(
+                        text="Not enough words for a knowledge cloud yet.", image=None))
+                    return
+                pil_image = self.render_wordcloud(version, frequencies)
+                self.after(0, self.show_wordcloud, pil_image)
+        except FileNotFoundError:
+            self.after(0, lambda: self.wordcloud_label.configure(text="brain_mask.pngが見つかりません。", image=None))
+            print("Error: brain_mask.png not found.")
         except Exception as e:
             print(f"Error loading stats: {e}")
-            self.after(0, self.wordcloud_label.configure, {"text": "Could not load stats."})
+            self.after(0, lambda: self.wordcloud_label.configure(text="Could not load stats.", image=None))
+
+    def _format_embedding_cache(self, cache_stats):
+        """埋め込みキャッシュのヒット/ミス件数を表示用の文字列にする"""
+        if not cache_stats:
+            return "N/A"
+        hits = cache_stats["hits"] + cache_stats["query_hits"]
+        misses = cache_stats["misses"] + cache_stats["query_misses"]
+        total = hits + misses
+        rate = (hits / total * 100) if total else 0.0
+        return f"{hits:,} hits / {misses:,} misses ({rate:.0f}%)"
+
+    def _format_cutoffs(self, generation_stats):
+        """回答を途中で打ち切った回数を、理由ごとに表示用の文字列にする"""
+        if not generation_stats or not generation_stats["answers"]:
+            return "N/A"
+        answers = generation_stats["answers"]
+        cutoffs = generation_stats["stopped"] + generation_stats["max_tokens"] + generation_stats["max_seconds"]
+        return (f"{cutoffs:,} of {answers:,} ({cutoffs / answers * 100:.0f}%): stopped {generation_stats['stopped']:,}, "
+                f"length {generation_stats['max_tokens']:,}, time {generation_stats['max_seconds']:,}")
 
     def update_ui(self, stats):
         """取得した統計情報でUIを更新する"""
+        self.embed_cache_label.configure(text=self._format_embedding_cache(stats.get("embedding_cache")))
+        self.cutoff_label.configure(text=self._format_cutoffs(stats.get("generation")))
         if stats["doc_count"] == 0:
             self.wordcloud_label.configure(text="I haven't learned anything yet.\nDrag a file onto me to start!", image=None)
             self.doc_count_label.configure(text="0 documents")
@@ -88,30 +156,86 @@ class StatusWindow(ctk.CTkToplevel):
         self.last_learned_label.configure(text=stats['last_learned'])
         self.db_size_label.configure(text=f"{stats['db_size']:.2f} MB")
 
-        # ワードクラウドを生成
-        self.generate_wordcloud(stats['all_text'])
-
-    def generate_wordcloud(self, text):
-        """ワードクラウド画像を生成して表示する"""
+    @staticmethod
+    def _format_metric(value, unit):
+        if value is None:
+            return "-"
+        if unit == "ms" and value >= 1000:
+            return f"{value / 1000:.2f} s"
+        return f"{value:.0f} {unit}" if value >= 10 else f"{value:.1f} {unit}"
+
+    def update_trace_ui(self, table, summary, title, noun):
+        """トレースの集計 (段階ごとのp50/p95) で、応答時間または学習時間の表を更新する"""
+        frame = table["frame"]
+        table["title_label"].configure(text=f"{title} (last {summary['traces']} {noun})")
+        for labels in table["rows"]:
+            for label in labels:
+                label.destroy()
+        table["rows"] = []
+        if not summary["traces"]:
+            label = ctk.CTkLabel(frame, text=f"No {noun} yet.", anchor="w")
+            label.grid(row=2, column=0, columnspan=3, sticky="w", pady=2, padx=5)
+            table["rows"].append((label,))
+            return
+        for row, metric in enumerate(summary["metrics"], start=2):
+            if not metric["count"]:
+                continue
+            labels = (
+                ctk.CTkLabel(frame, text=metric["label"], anchor="w"),
+                ctk.CTkLabel(frame, text=self._format_metric(metric["p50"], metric["unit"]), anchor="e"),
+                ctk.CTkLabel(frame, text=self._format_metric(metric["p95"], metric["unit"]), anchor="e"),
+            )
+            for column, label in enumerate(labels):
+                label.grid(row=row, column=column, sticky="w" if column == 0 else "e", pady=2, padx=5)
+            table["rows"].append(labels)
+
+    def _wordcloud_cache_path(self, version):
+        """(出現回数表のバージョン, テーマ, マスク, サイズ) から描画済み画像の保存先を決める"""
+        mask_path = resource_path(WORDCLOUD_MASK)
+        key = json.dumps([version, self.controller.theme_colors, mask_path, os.path.getmtime(mask_path), WORDCLOUD_SIZE],
+                         sort_keys=True)
+        return os.path.join(WORDCLOUD_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+    def render_wordcloud(self, version, frequencies):
+        """ワードクラウド画像を返す。同じ条件で描画済みの画像があればそれを使う。"""
+        cache_path = self._wordcloud_cache_path(version)
+        if version and os.path.exists(cache_path):
+            with Image.open(cache_path) as image:
+                image.load()
+                print("Word cloud loaded from cache.")
+                return image
+
+        # numpy/wordcloudは重いため、ワードクラウドを作る時に初めてimportする
+        import numpy as np
+        from wordcloud import WordCloud
+
+        mask = np.array(Image.open(resource_path(WORDCLOUD_MASK)))
+        wc = WordCloud(width=WORDCLOUD_SIZE, height=WORDCLOUD_SIZE, background_color=None, mode="RGBA",
+                       max_words=100,
+                       mask=mask,
+                       color_func=self.theme_color_func).generate_from_frequencies(frequencies)
+        pil_image = wc.to_image()
+
+        if version:
+            self._save_wordcloud_cache(cache_path, pil_image)
+        return pil_image
+
+    def _save_wordcloud_cache(self, cache_path, pil_image):
+        """画像を保存し、古いキャッシュを削除する"""
         try:
-            # mask = np.array(Image.open("assets/brain_mask.png"))
-            mask = np.array(Image.open(resource_path("assets/brain_mask.png")))
-
-            # 修正箇所： colormap を color_func に変更
-            wc = WordCloud(width=520, height=520, background_color=None, mode="RGBA",
-                           max_words=100,
-                           mask=mask,
-                           color_func=self.theme_color_func).generate(text) # 👈 ここを変更
-
-            pil_image = wc.to_image()
-            ctk_image = ctk.CTkImage(light_image=pil_image, dark_image=pil_image, size=(520, 520))
-            self.wordcloud_label.configure(text="", image=ctk_image)
-        except FileNotFoundError:
-            self.wordcloud_label.configure(text="brain_mask.pngが見つかりません。", image=None)
-            print("Error: brain_mask.png not found.")
-        except Exception as e:
-            self.wordcloud_label.configure(text="Error creating cloud.", image=None)
-            print(f"Word cloud generation failed: {e}")
+            os.makedirs(WORDCLOUD_CACHE_DIR, exist_ok=True)
+            pil_image.save(cache_path)
+            cached_files = sorted((os.path.join(WORDCLOUD_CACHE_DIR, name) for name in os.listdir(WORDCLOUD_CACHE_DIR)),
+                                  key=os.path.getmtime, reverse=True)
+            for old_path in cached_files[WORDCLOUD_CACHE_KEEP:]:
+                os.remove(old_path)
+        except OSError as e:
+            print(f"Warning: Could not cache word cloud image ({e}).")
+
+    def show_wordcloud(self, pil_image):
+        """描画済みのワードクラウド画像を表示する"""
+        ctk_image = ctk.CTkImage(light_image=pil_image, dark_image=pil_image, size=(WORDCLOUD_SIZE, WORDCLOUD_SIZE))
+        self.wordcloud_label.configure(text="", image=ctk_image)
 
 
     def theme_color_func(self, word, font_size, position, orientation, **kwargs):